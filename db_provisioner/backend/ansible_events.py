@@ -0,0 +1,143 @@
+import json
+import os
+import subprocess
+from collections import deque
+
+# Where the jsonl_events stdout callback lives
+CALLBACK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ansible_plugins", "callback")
+CALLBACK_NAME = "jsonl_events"
+
+
+def callback_env(env=None):
+    # Environment that makes ansible-playbook print jsonl_events output
+    env = dict(env if env is not None else os.environ)
+    paths = [CALLBACK_DIR] + [p for p in env.get("ANSIBLE_CALLBACK_PLUGINS", "").split(os.pathsep) if p]
+    env["ANSIBLE_CALLBACK_PLUGINS"] = os.pathsep.join(paths)
+    env["ANSIBLE_STDOUT_CALLBACK"] = CALLBACK_NAME
+    return env
+
+
+class HostResult:
+    def __init__(self, task, host, status, changed=False, ignored=False, duration=None, result=None):
+        self.task = task
+        self.host = host
+        self.status = status  # ok, failed, skipped or unreachable
+        self.changed = changed
+        self.ignored = ignored
+        self.duration = duration
+        self.result = result or {}
+
+    @property
+    def msg(self):
+        return self.result.get("msg")
+
+    def error(self):
+        for key in ("msg", "stderr", "reason"):
+            if self.result.get(key):
+                return str(self.result[key]).strip()
+        return self.status
+
+
+class PlaybookEvents:
+    # Streaming parser for jsonl_events output; feed() is an on_line callback for
+    # run_async. Lines that are not events (warnings, ansible's own errors) are kept
+    # in a short tail for error messages.
+    def __init__(self, tail_lines=20):
+        self.results = []  # HostResult in arrival order
+        self.task_order = []  # task names as they started
+        self.stats = {}
+        self.returncode = None
+        self.other = deque(maxlen=tail_lines)
+
+    def feed(self, line):
+        line = line.strip()
+        event = None
+        if line.startswith("{"):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                pass
+        if not isinstance(event, dict) or "event" not in event:
+            if line and not line.startswith("[WARNING]"):
+                self.other.append(line)
+            return
+
+        kind = event["event"]
+        if kind in ("task_start", "host_result") and event["task"] not in self.task_order:
+            self.task_order.append(event["task"])
+        if kind == "host_result":
+            self.results.append(HostResult(
+                event["task"], event["host"], event["status"],
+                changed=event.get("changed", False),
+                ignored=event.get("ignored", False),
+                duration=event.get("duration"),
+                result=event.get("result"),
+            ))
+        elif kind == "stats":
+            self.stats = event.get("hosts", {})
+
+    def hosts(self):
+        return list(dict.fromkeys([r.host for r in self.results] + list(self.stats)))
+
+    def task(self, name):
+        # {host: HostResult} of the named task
+        return {r.host: r for r in self.results if r.task == name}
+
+    def facts(self, name):
+        # {host: value} of a fact set by set_fact (the last value wins)
+        found = {}
+        for r in self.results:
+            facts = r.result.get("ansible_facts") or {}
+            if name in facts:
+                found[r.host] = facts[name]
+        return found
+
+    def failures(self):
+        return [r for r in self.results if r.status in ("failed", "unreachable") and not r.ignored]
+
+    def error(self):
+        failures = self.failures()
+        if failures:
+            return "; ".join(f"{r.task} on {r.host}: {r.error()}" for r in failures[:5])
+        return "\n".join(self.other) or f"exit status {self.returncode}"
+
+    def timings(self):
+        # Per task: wall time of the slowest host and the per-host durations
+        timings = []
+        for name in self.task_order:
+            durations = {r.host: r.duration for r in self.results if r.task == name and r.duration is not None}
+            timings.append({
+                "task": name,
+                "duration": max(durations.values()) if durations else None,
+                "hosts": durations,
+            })
+        return timings
+
+
+def loop_results(events, task_name, count):
+    # Per-item results of a looped task. The bulk playbooks target every host in the
+    # group; an item is done if it went through on any.
+    results = [None] * count
+    for host_result in events.task(task_name).values():
+        for index, item in enumerate(host_result.result.get("results", [])[:count]):
+            if results[index] and results[index]["status"] != "failed":
+                continue
+            error = str(item.get("msg") or item.get("stderr") or "")
+            if not item.get("failed"):
+                results[index] = {"status": "created" if item.get("changed") else "exists"}
+            elif "already exists" in error:
+                results[index] = {"status": "exists"}
+            else:
+                results[index] = {"status": "failed", "error": error}
+    return [result or {"status": "failed", "error": "no result from playbook"} for result in results]
+
+
+class PlaybookFailed(subprocess.CalledProcessError):
+    # Raised for a non-zero exit; str() names the failed tasks and hosts instead of
+    # dumping raw output
+    def __init__(self, returncode, cmd, events):
+        super().__init__(returncode, cmd, output=events.error(), stderr=events.error())
+        self.events = events
+
+    def __str__(self):
+        return f"Playbook failed: {self.events.error()}"
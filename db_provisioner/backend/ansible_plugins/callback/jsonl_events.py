@@ -0,0 +1,128 @@
+# Stdout callback used for every playbook the backend runs: one JSON object per line
+# per event, flushed as it happens, so the backend can parse results while the
+# playbook is still running (see ansible_events.py).
+#
+#   ANSIBLE_CALLBACK_PLUGINS=<this directory> ANSIBLE_STDOUT_CALLBACK=jsonl_events
+
+import json
+import sys
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = """
+    name: jsonl_events
+    type: stdout
+    short_description: JSON lines, one per playbook event
+    description:
+        - Prints task starts, per-host results with durations and the final stats as JSON lines.
+"""
+
+
+# Keys of a loop item that are never printed, nor their values anywhere in the result
+SECRET_ITEM_KEYS = ("password",)
+MASK = "********"
+# Shorter secrets are only masked where a value is exactly the secret: replacing
+# them inside other text would garble it ("ok done" -> "******** done")
+MIN_MASKED_SUBSTRING = 8
+
+
+def _public(result):
+    return {key: value for key, value in result.items() if key != "invocation" and not key.startswith("_ansible")}
+
+
+def _secrets(item, found):
+    if isinstance(item, dict):
+        for key, value in item.items():
+            if key in SECRET_ITEM_KEYS and isinstance(value, str) and value:
+                found.add(value)
+    return found
+
+
+def _mask(value, secrets):
+    if isinstance(value, str):
+        if value in secrets:
+            return MASK
+        for secret in secrets:
+            if len(secret) >= MIN_MASKED_SUBSTRING:
+                value = value.replace(secret, MASK)
+        return value
+    if isinstance(value, dict):
+        return {key: _mask(v, secrets) for key, v in value.items()}
+    if isinstance(value, list):
+        return [_mask(v, secrets) for v in value]
+    return value
+
+
+def clean_result(result):
+    # A module result as printed: no invocation or internal keys, and for loops the
+    # same per item. Secret item fields (a user's password) are dropped from the item
+    # and masked wherever else they show up, e.g. in a shell task's cmd.
+    data = _public(result)
+    secrets = _secrets(data.get("item"), set())
+    if isinstance(data.get("results"), list):
+        data["results"] = [_public(item) if isinstance(item, dict) else item for item in data["results"]]
+        for item in data["results"]:
+            if isinstance(item, dict):
+                _secrets(item.get("item"), secrets)
+    data = _mask(data, secrets)
+    for entry in [data] + [item for item in data.get("results", []) if isinstance(item, dict)]:
+        if isinstance(entry.get("item"), dict):
+            entry["item"] = {key: value for key, value in entry["item"].items() if key not in SECRET_ITEM_KEYS}
+    return data
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "stdout"
+    CALLBACK_NAME = "jsonl_events"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._started = {}  # (task uuid, host) -> start time
+
+    def _emit(self, event, **fields):
+        sys.stdout.write(json.dumps({"event": event, "time": time.time(), **fields}, default=str) + "\n")
+        sys.stdout.flush()
+
+    def v2_playbook_on_play_start(self, play):
+        self._emit("play_start", play=play.get_name())
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._emit("task_start", task=task.get_name(), action=task.action)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._emit("task_start", task=task.get_name(), action=task.action, handler=True)
+
+    def v2_runner_on_start(self, host, task):
+        self._started[(task._uuid, host.get_name())] = time.time()
+
+    def _host_result(self, status, result, ignored=False):
+        host = result._host.get_name()
+        started = self._started.pop((result._task._uuid, host), None)
+        data = clean_result(result._result)
+        self._emit(
+            "host_result",
+            task=result._task.get_name(),
+            host=host,
+            status=status,
+            changed=bool(data.get("changed")),
+            ignored=ignored,
+            duration=round(time.time() - started, 3) if started else None,
+            result=data,
+        )
+
+    def v2_runner_on_ok(self, result):
+        self._host_result("ok", result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._host_result("failed", result, ignored=ignore_errors)
+
+    def v2_runner_on_skipped(self, result):
+        self._host_result("skipped", result)
+
+    def v2_runner_on_unreachable(self, result):
+        self._host_result("unreachable", result)
+
+    def v2_playbook_on_stats(self, stats):
+        self._emit("stats", hosts={host: stats.summarize(host) for host in sorted(stats.processed)})
@@ -0,0 +1,59 @@
+import os
+import random
+import subprocess
+import threading
+import time
+
+import metrics
+
+# What the AWS CLI and the terraform AWS provider print when the API throttles us
+THROTTLE_MARKERS = (
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "Rate exceeded",
+)
+
+
+class RateLimiter:
+    # Token bucket shared by every thread that starts AWS API work: rate tokens per
+    # second, at most burst at once.
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_throttled(error):
+    output = f"{error.output or ''}{error.stderr or ''}"
+    return any(marker in output for marker in THROTTLE_MARKERS)
+
+
+def call_with_backoff(fn, limiter=None, attempts=5, base_delay=2, max_delay=60):
+    # Runs fn, retrying while it fails with a CalledProcessError caused by throttling.
+    # Exponential backoff with full jitter so parallel deploys do not retry in lockstep.
+    for attempt in range(attempts):
+        if limiter:
+            limiter.acquire()
+        try:
+            return fn()
+        except subprocess.CalledProcessError as e:
+            if attempt == attempts - 1 or not is_throttled(e):
+                raise
+            metrics.AWS_THROTTLE_RETRIES.inc(os.path.basename(e.cmd[0]))
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
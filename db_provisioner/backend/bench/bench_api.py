@@ -0,0 +1,423 @@
+# Load benchmark for the HTTP API, offline: terraform, ansible-playbook, ansible and
+# aws are the stand-ins in fake_tools.py, with a configurable latency per tool.
+#
+# The backend runs in-process against a scratch clusters.db, deployments directory,
+# template store and terraform cache. --clusters clusters are deployed through
+# /deploy first. Then --clients concurrent clients send a weighted --mix of /deploy,
+# /status/{name}, /clusters, /create_database and /start for --seconds.
+#
+# The report covers per-endpoint throughput and p50/p99 latency, deploy job times and
+# event loop lag. It also shows how busy the request threadpool (sync endpoints) and
+# the job executor were.
+#
+# Each run is appended to --results and compared with the last stored run that used
+# the same settings. With --fail-on-regression, a p99 or throughput regression beyond
+# --threshold, or a higher error rate, makes the exit status non-zero.
+#
+#   python bench/bench_api.py --clients 32 --seconds 20 --latency ansible-playbook=0.2,terraform=1
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+FAKE_TOOLS = os.path.join(BENCH_DIR, "fake_tools.py")
+TOOLS = ("terraform", "ansible-playbook", "ansible", "aws")
+ENDPOINTS = ("deploy", "status", "status_refresh", "clusters", "create_database", "start")
+DEFAULT_MIX = "status=50,clusters=20,create_database=15,start=10,deploy=5"
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, "results", "bench_api.jsonl")
+SAMPLE_INTERVAL = 0.05
+
+
+def parse_pairs(value, cast, allowed):
+    pairs = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        key, _, number = entry.partition("=")
+        if key not in allowed:
+            sys.exit(f"Unknown name '{key}', expected one of {', '.join(allowed)}")
+        pairs[key] = cast(number)
+    return pairs
+
+
+def install_tools(bin_dir):
+    for tool in TOOLS:
+        path = os.path.join(bin_dir, tool)
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_TOOLS}" {tool} "$@"\n')
+        os.chmod(path, 0o755)
+
+
+def scratch_env(root, latency, fail_rate):
+    # Must be in place before the backend is imported: it reads these at import time
+    bin_dir = os.path.join(root, "bin")
+    os.makedirs(bin_dir)
+    install_tools(bin_dir)
+    os.environ.update({
+        "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+        "BENCH_FAKE_STATE": os.path.join(root, "fake_state"),
+        "BENCH_FAIL_RATE": str(fail_rate),
+        "DB_PROVISIONER_DB_PATH": os.path.join(root, "clusters.db"),
+        "DB_PROVISIONER_DEPLOYMENTS_DIR": os.path.join(root, "deployments"),
+        "DB_PROVISIONER_TEMPLATE_STORE": os.path.join(root, "template_store"),
+        "DB_PROVISIONER_TF_CACHE_DIR": os.path.join(root, "terraform_cache"),
+        "DB_PROVISIONER_SSH_CONTROL_DIR": os.path.join(root, "ssh"),
+    })
+    for tool in TOOLS:
+        os.environ[f"BENCH_LATENCY_{tool.upper().replace('-', '_')}"] = str(latency.get(tool, 0))
+
+
+def deploy_body(name):
+    return {
+        "cluster_name": name,
+        "platform": "ec2",
+        "instance_count": 1,
+        "postgresql_version": "16",
+        "ami": "ami-0a73e96a849c232cc",
+        "instance_type": "t3.medium",
+        "data_volume_size": 50,
+        "allowed_ip_1": "192.0.2.10/32",
+        "allowed_ip_2": "192.0.2.11/32",
+    }
+
+
+class Load:
+    # The clients' view: latency and status code of every request, per endpoint
+    def __init__(self, names):
+        self.names = names
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.codes = {name: {} for name in ENDPOINTS}
+        self.deploy_jobs = []
+        self._sequence = 0
+
+    def next_id(self):
+        self._sequence += 1
+        return self._sequence
+
+    async def request(self, client, endpoint, rng):
+        cluster = rng.choice(self.names)
+        if endpoint == "deploy":
+            call = client.post("/deploy", json=deploy_body(f"bench-load-{self.next_id()}"))
+        elif endpoint == "status":
+            call = client.get(f"/status/{cluster}")
+        elif endpoint == "status_refresh":
+            call = client.get(f"/status/{cluster}", params={"refresh": "true"})
+        elif endpoint == "clusters":
+            call = client.get("/clusters")
+        elif endpoint == "create_database":
+            call = client.post("/create_database", json={"cluster_name": cluster, "db_name": f"bench{self.next_id()}"})
+        else:
+            call = client.post("/start", json={"cluster_name": cluster})
+
+        start = time.perf_counter()
+        response = await call
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        self.codes[endpoint][response.status_code] = self.codes[endpoint].get(response.status_code, 0) + 1
+        if endpoint == "deploy" and response.status_code == 202:
+            self.deploy_jobs.append(response.json()["job_id"])
+
+
+class Saturation:
+    # Samples the anyio threadpool that runs sync endpoints, the job executor and
+    # event loop lag (how late a SAMPLE_INTERVAL sleep wakes up)
+    def __init__(self, backend):
+        import anyio.to_thread
+        self.limiter = anyio.to_thread.current_default_thread_limiter()
+        # ThreadPoolExecutor keeps no public count of busy workers
+        self.executor = backend.jobs.executor
+        self.samples = []
+
+    def sample(self, lag):
+        stats = self.limiter.statistics()
+        threads = len(self.executor._threads)
+        self.samples.append({
+            "threads_busy": stats.borrowed_tokens,
+            "threads_total": stats.total_tokens,
+            "threads_waiting": stats.tasks_waiting,
+            "jobs_busy": threads - self.executor._idle_semaphore._value,
+            "jobs_workers": self.executor._max_workers,
+            "jobs_queued": self.executor._work_queue.qsize(),
+            "loop_lag": lag,
+        })
+
+    async def run(self, stop):
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            self.sample(max(0.0, time.perf_counter() - start - SAMPLE_INTERVAL))
+
+    def summary(self):
+        if not self.samples:
+            return {}
+        n = len(self.samples)
+        lags = sorted(s["loop_lag"] for s in self.samples)
+        return {
+            "threadpool_busy_mean": round(statistics.mean(s["threads_busy"] for s in self.samples), 2),
+            "threadpool_busy_max": max(s["threads_busy"] for s in self.samples),
+            "threadpool_size": self.samples[-1]["threads_total"],
+            "threadpool_saturated_pct": round(100 * sum(s["threads_busy"] >= s["threads_total"] for s in self.samples) / n, 1),
+            "threadpool_waiting_max": max(s["threads_waiting"] for s in self.samples),
+            "jobs_busy_max": max(s["jobs_busy"] for s in self.samples),
+            "jobs_workers": self.samples[-1]["jobs_workers"],
+            "jobs_saturated_pct": round(100 * sum(s["jobs_busy"] >= s["jobs_workers"] for s in self.samples) / n, 1),
+            "jobs_queued_max": max(s["jobs_queued"] for s in self.samples),
+            "loop_lag_p50_ms": round(percentile(lags, 0.5) * 1000, 2),
+            "loop_lag_p99_ms": round(percentile(lags, 0.99) * 1000, 2),
+        }
+
+
+def percentile(values, fraction):
+    return values[max(0, int(len(values) * fraction + 0.5) - 1)]
+
+
+async def wait_for_jobs(backend, job_ids, timeout):
+    deadline = time.monotonic() + timeout
+    jobs = []
+    for job_id in job_ids:
+        while True:
+            job = backend.jobs.get(job_id)
+            if job["status"] not in ("queued", "running") or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.05)
+        jobs.append(job)
+    return jobs
+
+
+def job_summary(jobs):
+    finished = [j for j in jobs if j["finished_at"] and j["started_at"]]
+    durations = sorted(
+        (datetime.fromisoformat(j["finished_at"]) - datetime.fromisoformat(j["started_at"])).total_seconds()
+        for j in finished
+    )
+    waits = sorted(
+        (datetime.fromisoformat(j["started_at"]) - datetime.fromisoformat(j["created_at"])).total_seconds()
+        for j in finished
+    )
+    summary = {
+        "submitted": len(jobs),
+        "succeeded": sum(j["status"] == "succeeded" for j in jobs),
+        "failed": sum(j["status"] == "failed" for j in jobs),
+        "unfinished": len(jobs) - len(finished),
+    }
+    if durations:
+        summary.update({
+            "duration_p50": round(percentile(durations, 0.5), 3),
+            "duration_p99": round(percentile(durations, 0.99), 3),
+            "queue_wait_p50": round(percentile(waits, 0.5), 3),
+            "queue_wait_p99": round(percentile(waits, 0.99), 3),
+        })
+    return summary
+
+
+async def run_load(backend, args, mix):
+    import httpx
+
+    transport = httpx.ASGITransport(app=backend.app)
+    async with backend.lifespan(backend.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            names = [f"bench-{i}" for i in range(args.clusters)]
+            seeded = [await client.post("/deploy", json=deploy_body(name)) for name in names]
+            jobs = await wait_for_jobs(backend, [r.json()["job_id"] for r in seeded], args.drain)
+            failed = [j for j in jobs if j["status"] != "succeeded"]
+            if failed:
+                sys.exit(f"Seeding failed: {failed[0]['cluster_name']}: {failed[0]['error']}")
+            print(f"Seeded {len(names)} clusters")
+
+            load = Load(names)
+            saturation = Saturation(backend)
+            endpoints, weights = zip(*mix.items())
+            deadline = time.monotonic() + args.seconds
+
+            async def client_loop(number):
+                rng = random.Random(args.seed * 1000 + number)
+                while time.monotonic() < deadline:
+                    await load.request(client, rng.choices(endpoints, weights)[0], rng)
+
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(saturation.run(stop))
+            started = time.perf_counter()
+            await asyncio.gather(*(client_loop(n) for n in range(args.clients)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await sampler
+
+            deploy_jobs = await wait_for_jobs(backend, load.deploy_jobs, args.drain)
+    return load, saturation.summary(), job_summary(deploy_jobs), elapsed
+
+
+def endpoint_summary(load, elapsed):
+    summary = {}
+    for endpoint in ENDPOINTS:
+        values = sorted(load.latencies[endpoint])
+        if not values:
+            continue
+        codes = load.codes[endpoint]
+        summary[endpoint] = {
+            "requests": len(values),
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+            "errors": sum(count for code, count in codes.items() if code >= 400),
+            "codes": {str(code): count for code, count in sorted(codes.items())},
+        }
+    values = sorted(v for endpoint in ENDPOINTS for v in load.latencies[endpoint])
+    total = {
+        "requests": len(values),
+        "rps": round(len(values) / elapsed, 2),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 2) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2) if values else None,
+        "errors": sum(s["errors"] for s in summary.values()),
+    }
+    return summary, total
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(baseline, run, threshold):
+    # Regressions of run against baseline: p99 up or throughput down by more than
+    # threshold, or more than 1% of requests newly failing
+    regressions = []
+    print(f"== compared with {baseline['label'] or baseline['run_at']} ({baseline.get('revision') or 'unknown revision'})")
+    for endpoint, now in {**run["endpoints"], "total": run["total"]}.items():
+        before = baseline["endpoints"].get(endpoint) if endpoint != "total" else baseline["total"]
+        if not before or not before.get("p99_ms") or not before.get("rps"):
+            continue
+        p99_change = now["p99_ms"] / before["p99_ms"] - 1
+        rps_change = now["rps"] / before["rps"] - 1
+        errors_before = before.get("errors", 0) / max(1, before["requests"])
+        errors_now = now["errors"] / max(1, now["requests"])
+        flag = ""
+        if p99_change > threshold or rps_change < -threshold or errors_now > errors_before + 0.01:
+            flag = "  REGRESSION"
+            regressions.append(endpoint)
+        print(f"  {endpoint:16} p99 {before['p99_ms']:9.1f} -> {now['p99_ms']:9.1f} ms ({p99_change:+6.1%})"
+              f"   req/s {before['rps']:8.1f} -> {now['rps']:8.1f} ({rps_change:+6.1%})"
+              f"   errors {errors_before:5.1%} -> {errors_now:5.1%}{flag}")
+    return regressions
+
+
+def report(run):
+    config = run["config"]
+    total = run["total"]
+    print(f"== {config['clients']} clients, {config['seconds']}s, {config['clusters']} clusters, "
+          f"latency {config['latency'] or 'none'}")
+    print(f"  {'endpoint':16} {'requests':>8} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    for endpoint, s in run["endpoints"].items():
+        print(f"  {endpoint:16} {s['requests']:8d} {s['rps']:8.1f} {s['p50_ms']:9.1f} {s['p99_ms']:9.1f} {s['max_ms']:9.1f} {s['errors']:7d}")
+    print(f"  {'total':16} {total['requests']:8d} {total['rps']:8.1f} {total['p50_ms'] or 0:9.1f} {total['p99_ms'] or 0:9.1f} {'':9} {total['errors']:7d}")
+    sat = run["saturation"]
+    if sat:
+        print(f"  threadpool  busy mean {sat['threadpool_busy_mean']} / max {sat['threadpool_busy_max']} of {sat['threadpool_size']}, "
+              f"saturated {sat['threadpool_saturated_pct']}% of samples, up to {sat['threadpool_waiting_max']} waiting")
+        print(f"  jobs        busy max {sat['jobs_busy_max']} of {sat['jobs_workers']}, saturated {sat['jobs_saturated_pct']}%, "
+              f"up to {sat['jobs_queued_max']} queued")
+        print(f"  event loop  lag p50 {sat['loop_lag_p50_ms']} ms, p99 {sat['loop_lag_p99_ms']} ms")
+    jobs = run["deploy_jobs"]
+    if jobs["submitted"]:
+        print(f"  deploy jobs {jobs['succeeded']}/{jobs['submitted']} succeeded, {jobs['unfinished']} unfinished, "
+              f"run p50 {jobs.get('duration_p50')}s p99 {jobs.get('duration_p99')}s, "
+              f"queued p50 {jobs.get('queue_wait_p50')}s p99 {jobs.get('queue_wait_p99')}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clusters", type=int, default=10, help="clusters deployed before the load starts")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint weights, from {', '.join(ENDPOINTS)}")
+    parser.add_argument("--latency", default="", help="seconds per fake tool run, e.g. terraform=1,ansible-playbook=0.2")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of playbook runs that fail")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drain", type=float, default=120, help="seconds to wait for deploy jobs")
+    parser.add_argument("--label", default=None, help="name stored with the run")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="jsonl file runs are appended to")
+    parser.add_argument("--baseline", default=None, help="label of the run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    mix = parse_pairs(args.mix, float, ENDPOINTS)
+    latency = parse_pairs(args.latency, float, TOOLS)
+
+    with tempfile.TemporaryDirectory(prefix="bench_api_") as root:
+        scratch_env(root, latency, args.fail_rate)
+        import requests
+        import db_provisioner_backend as backend
+
+        # The deploy's ipify lookup is the one outbound call not made through a tool
+        class PublicIP:
+            text = "203.0.113.10\n"
+        requests.get = lambda *a, **k: PublicIP()
+
+        load, saturation, deploy_jobs, elapsed = asyncio.run(run_load(backend, args, mix))
+        backend.jobs.executor.shutdown(wait=True)
+
+    endpoints, total = endpoint_summary(load, elapsed)
+    run = {
+        "run_at": datetime.utcnow().isoformat(),
+        "label": args.label,
+        "revision": git_revision(),
+        "config": {
+            "clients": args.clients,
+            "seconds": args.seconds,
+            "clusters": args.clusters,
+            "mix": mix,
+            "latency": latency,
+            "fail_rate": args.fail_rate,
+            "seed": args.seed,
+        },
+        "elapsed": round(elapsed, 3),
+        "endpoints": endpoints,
+        "total": total,
+        "saturation": saturation,
+        "deploy_jobs": deploy_jobs,
+    }
+    report(run)
+
+    runs = load_runs(args.results)
+    if args.baseline:
+        baseline = next((r for r in reversed(runs) if r["label"] == args.baseline), None)
+        if baseline is None:
+            print(f"No stored run labelled '{args.baseline}' in {args.results}")
+    else:
+        baseline = next((r for r in reversed(runs) if r["config"] == run["config"]), None)
+    regressions = compare(baseline, run, args.threshold) if baseline else []
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        with open(args.results, "a") as f:
+            f.write(json.dumps(run) + "\n")
+        print(f"Stored in {args.results}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(f"Regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
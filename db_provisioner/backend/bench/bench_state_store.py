@@ -0,0 +1,140 @@
+# Micro-benchmark for the clusters.db access layer.
+#
+# Simulates concurrent API load against a scratch database: reader threads do the
+# per-request cluster lookup every endpoint performs, writer threads do the inserts
+# and updates that deploy/start perform. It runs once with the old pattern
+# (sqlite3.connect per call, rollback journal) and once through StateStore.
+#
+#   python bench/bench_state_store.py --readers 16 --writers 4 --seconds 5
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state_store import StateStore  # noqa: E402
+
+SEED_CLUSTERS = 500
+
+
+class LegacyAccess:
+    # The per-request connect/execute/close pattern the handlers used before StateStore.
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, name):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT deployment_dir, platform FROM clusters WHERE cluster_name=?", (name,))
+        row = cursor.fetchone()
+        conn.close()
+        return row
+
+    def write(self, name, ip):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute("UPDATE clusters SET server_public_ip=? WHERE cluster_name=?", (ip, name))
+        conn.commit()
+        conn.close()
+
+
+class StoreAccess:
+    def __init__(self, path):
+        self.store = StateStore(path)
+
+    def read(self, name):
+        return self.store.get_cluster(name, ("deployment_dir", "platform"))
+
+    def write(self, name, ip):
+        self.store.update_cluster(name, server_public_ip=ip)
+
+
+def seed(path):
+    store = StateStore(path)
+    store.migrate()
+    with store.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO clusters (cluster_name, platform, status, instance_count, deployment_dir) VALUES (?, 'ec2', 'completed', 1, ?)",
+            [(f"bench-{i}", f"/tmp/bench-{i}") for i in range(SEED_CLUSTERS)],
+        )
+    store.close()
+
+
+def run(access, readers, writers, seconds):
+    latencies = {"read": [], "write": []}
+    errors = []
+    stop = time.monotonic() + seconds
+
+    def worker(kind, seed_offset):
+        local = []
+        i = seed_offset
+        while time.monotonic() < stop:
+            name = f"bench-{i % SEED_CLUSTERS}"
+            start = time.perf_counter()
+            try:
+                if kind == "read":
+                    access.read(name)
+                else:
+                    access.write(name, f"10.0.{i % 255}.{i % 7}")
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            local.append(time.perf_counter() - start)
+            i += 7
+        latencies[kind].extend(local)
+
+    threads = [threading.Thread(target=worker, args=("read", n)) for n in range(readers)]
+    threads += [threading.Thread(target=worker, args=("write", n)) for n in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors
+
+
+def summarize(label, latencies, errors, seconds):
+    print(f"== {label}")
+    for kind, values in latencies.items():
+        if not values:
+            continue
+        values.sort()
+        p50 = statistics.median(values) * 1000
+        p99 = values[int(len(values) * 0.99) - 1] * 1000
+        print(f"  {kind:5s} {len(values) / seconds:10.0f} ops/s   p50 {p50:7.3f} ms   p99 {p99:7.3f} ms")
+    if errors:
+        print(f"  errors: {len(errors)} (e.g. {errors[0]})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        seed(legacy_path)
+        # seeding went through StateStore, which switched the file to WAL; put the
+        # legacy copy back on the default rollback journal
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+        store_path = os.path.join(tmp, "store.db")
+        seed(store_path)
+
+        latencies, errors = run(LegacyAccess(legacy_path), args.readers, args.writers, args.seconds)
+        summarize("connect-per-call, rollback journal", latencies, errors, args.seconds)
+
+        latencies, errors = run(StoreAccess(store_path), args.readers, args.writers, args.seconds)
+        summarize("StateStore, thread-local WAL connections", latencies, errors, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# /status latency with cold and warm SSH connections.
+#
+# Runs against a cluster that is already deployed and recorded in clusters.db, going
+# through the app in-process. Each cold round first closes the cluster's SSH masters
+# so the probe pays for the handshake; each warm round reuses the masters the
+# previous probe left behind. refresh=true makes every request run the playbook.
+#
+#   python bench/bench_status.py my-cluster --rounds 10
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx  # noqa: E402
+
+import db_provisioner_backend as backend  # noqa: E402
+from ssh_mux import inventory_hosts  # noqa: E402
+
+
+async def probe(client, cluster_name):
+    start = time.perf_counter()
+    response = await client.get(f"/status/{cluster_name}", params={"refresh": "true"})
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return elapsed, response.json().get("is_running")
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(f"  {label:5} p50 {statistics.median(timings) * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms   max {timings[-1] * 1000:8.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cluster_name")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    row = backend.store.get_cluster(args.cluster_name, ("deployment_dir",))
+    if not row:
+        sys.exit(f"Cluster '{args.cluster_name}' not found in clusters.db")
+    hosts = inventory_hosts(os.path.join(row[0], "ansible", "inventory", "inventory.ini"))
+    print(f"{args.cluster_name}: {len(hosts)} hosts, control dir {backend.ssh_mux.control_dir}")
+
+    cold, warm = [], []
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for _ in range(args.rounds):
+            await backend.ssh_mux.close_hosts(hosts)
+            elapsed, status = await probe(client, args.cluster_name)
+            cold.append(elapsed)
+            elapsed, status = await probe(client, args.cluster_name)
+            warm.append(elapsed)
+
+    print(f"== /status/{args.cluster_name} ({args.rounds} rounds, last status {status})")
+    report("cold", cold)
+    report("warm", warm)
+    print(f"  warm/cold p50 {statistics.median(warm) / statistics.median(cold):.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
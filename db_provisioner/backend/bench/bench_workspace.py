@@ -0,0 +1,96 @@
+# Deployment workspace benchmark: time, disk and inodes per cluster directory.
+#
+# Lays out N cluster directories the way the render phase of /deploy does, once with
+# the old full copies (shutil.copytree of templates/ansible and the terraform module)
+# and once through TemplateStore + TerraformWorkspace. The terraform workspace is
+# pre-seeded with a fake lock file so no terraform binary is needed.
+#
+#   python bench/bench_workspace.py --clusters 200
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from template_store import TemplateStore  # noqa: E402
+from tf_workspace import LOCK_FILE, TerraformWorkspace  # noqa: E402
+
+ANSIBLE_TEMPLATES = os.path.join(BACKEND_DIR, "templates", "ansible")
+TF_MODULE_TEMPLATE = os.path.join(BACKEND_DIR, "templates", "terraform", "modules", "postgres_ha")
+
+
+def legacy_layout(cluster_dir):
+    shutil.copytree(ANSIBLE_TEMPLATES, os.path.join(cluster_dir, "ansible"), dirs_exist_ok=True)
+    shutil.copytree(TF_MODULE_TEMPLATE, os.path.join(cluster_dir, "terraform", "modules", "postgres_ha"), dirs_exist_ok=True)
+
+
+def store_layout(templates, workspace):
+    def layout(cluster_dir):
+        templates.link(os.path.join(cluster_dir, "ansible"), templates.snapshot())
+        workspace.prepare(os.path.join(cluster_dir, "terraform", "modules", "postgres_ha"))
+    return layout
+
+
+def seed_workspace(workspace):
+    module_dir = os.path.join(workspace.cache_root, "modules", f"{workspace.name}-{workspace.fingerprint()}")
+    os.makedirs(module_dir)
+    for name in workspace.template_files():
+        shutil.copy2(os.path.join(workspace.template_dir, name), module_dir)
+    with open(os.path.join(module_dir, LOCK_FILE), "w") as f:
+        f.write("# bench\n")
+
+
+def disk_usage(path):
+    # Allocated bytes and number of inodes, not following symlinks
+    total, inodes = 0, 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            st = os.lstat(os.path.join(root, name))
+            total += st.st_blocks * 512
+            inodes += 1
+    return total, inodes
+
+
+def run(label, layout, root, clusters):
+    timings = []
+    for i in range(clusters):
+        cluster_dir = os.path.join(root, f"bench-{i}")
+        start = time.perf_counter()
+        layout(cluster_dir)
+        timings.append(time.perf_counter() - start)
+
+    total, inodes = disk_usage(root)
+    timings.sort()
+    print(f"== {label}")
+    print(f"  layout   p50 {statistics.median(timings) * 1000:7.2f} ms   p99 {timings[int(len(timings) * 0.99) - 1] * 1000:7.2f} ms")
+    print(f"  per cluster {total / clusters / 1024:8.1f} KiB   {inodes / clusters:6.1f} inodes")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clusters", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_root = os.path.join(tmp, "legacy")
+        run("full copy per cluster", legacy_layout, legacy_root, args.clusters)
+
+        templates = TemplateStore(ANSIBLE_TEMPLATES, os.path.join(tmp, "template_store"))
+        workspace = TerraformWorkspace(TF_MODULE_TEMPLATE, os.path.join(tmp, "terraform_cache"))
+        seed_workspace(workspace)
+        store_root = os.path.join(tmp, "store")
+        run("template store links", store_layout(templates, workspace), store_root, args.clusters)
+
+        shared, shared_inodes = disk_usage(templates.store_root)
+        cache, cache_inodes = disk_usage(workspace.cache_root)
+        print(f"  shared (once) {(shared + cache) / 1024:8.1f} KiB   {shared_inodes + cache_inodes} inodes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# Stand-ins for terraform, ansible-playbook, ansible and aws, used by bench_api.py.
+#
+# bench_api.py puts one shim per tool on PATH that runs "fake_tools.py <tool> <args>".
+# Each tool sleeps BENCH_LATENCY_<TOOL> seconds (ANSIBLE_PLAYBOOK for ansible-playbook)
+# spread over its output lines, and prints output shaped like the real tool's from
+# the files in fixtures/. Instances created by terraform apply are recorded under
+# BENCH_FAKE_STATE, so aws describe-instances finds them afterwards.
+# BENCH_FAIL_RATE is the fraction of ansible-playbook runs that fail.
+
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# Resources in terraform_apply.txt besides the per-node ones
+SHARED_RESOURCES = 9
+
+
+def latency(tool):
+    return float(os.environ.get(f"BENCH_LATENCY_{tool.upper().replace('-', '_')}", "0"))
+
+
+def paced(lines, seconds):
+    pause = seconds / max(1, len(lines))
+    for line in lines:
+        time.sleep(pause)
+        print(line, flush=True)
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+def state_path(*parts):
+    path = os.path.join(os.environ.get("BENCH_FAKE_STATE", "/tmp/bench_fake_state"), *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def instance_id(name):
+    return "i-" + hashlib.sha1(name.encode()).hexdigest()[:17]
+
+
+def addresses(iid):
+    h = hashlib.sha1(iid.encode()).digest()
+    return f"198.51.{h[0]}.{h[1] or 1}", f"10.0.1.{h[2] % 250 + 4}"
+
+
+def flag(args, name):
+    return args[args.index(name) + 1] if name in args and args.index(name) + 1 < len(args) else None
+
+
+def inventory_hosts(path):
+    # Hosts of the non-:vars groups, in order
+    hosts, group = [], None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(("#", ";")):
+                continue
+            if line.startswith("["):
+                group = line
+            elif group is None or ":" not in group:
+                hosts.append(line.split()[0])
+    return list(dict.fromkeys(hosts))
+
+
+#### terraform ####
+
+def read_tfvars():
+    values = {}
+    with open("terraform.tfvars") as f:
+        for line in f:
+            key, sep, value = line.partition("=")
+            if sep:
+                values[key.strip()] = value.strip().strip('"')
+    return values
+
+
+def terraform(args):
+    command = args[0] if args else ""
+    if command == "init":
+        os.makedirs(os.path.join(".terraform", "providers"), exist_ok=True)
+        if not os.path.exists(".terraform.lock.hcl"):
+            with open(".terraform.lock.hcl", "w") as f:
+                f.write('provider "registry.terraform.io/hashicorp/aws" {\n  version = "5.54.1"\n}\n')
+        paced([
+            "Initializing provider plugins...",
+            "- Reusing previous version of hashicorp/aws from the dependency lock file",
+            "- Using hashicorp/aws v5.54.1 from the shared cache directory",
+            "Terraform has been successfully initialized!",
+        ], latency("terraform"))
+        return 0
+
+    if command == "apply":
+        tfvars = read_tfvars()
+        cluster = tfvars["cluster_name"]
+        nodes = []
+        for index in range(int(tfvars.get("instance_count", "1"))):
+            name = f"{cluster}-node-{index + 1}"
+            iid = instance_id(name)
+            public_ip, private_ip = addresses(iid)
+            nodes.append({"index": index, "name": name, "instance_id": iid, "public_ip": public_ip, "private_ip": private_ip})
+            with open(state_path("instances", iid), "w") as f:
+                json.dump({"name": name, "ami": tfvars.get("ami"), "instance_type": tfvars.get("instance_type")}, f)
+
+        # local_file.ansible_inventory, same layout as inventory.ini.tpl
+        inventory = os.path.join("..", "..", "..", "ansible", "inventory", "inventory.ini")
+        os.makedirs(os.path.dirname(inventory), exist_ok=True)
+        with open(inventory, "w") as f:
+            f.write("[postgresql]\n")
+            for node in nodes:
+                f.write(
+                    f"{node['name']} ansible_host={node['public_ip']} ansible_user=rocky "
+                    f"ansible_ssh_private_key_file=~/.ssh/ha-postgres-key private_ip={node['private_ip']}\n"
+                )
+            f.write("\n[all:vars]\nansible_python_interpreter=/usr/bin/python3\n")
+        with open("terraform.tfstate", "w") as f:
+            json.dump({"version": 4, "outputs": {"instance_ids": {
+                "value": [node["instance_id"] for node in nodes], "type": ["list", "string"],
+            }}}, f)
+
+        lines = []
+        for line in fixture("terraform_apply.txt").splitlines():
+            if line.startswith("@each "):
+                lines += [line[len("@each "):].format(**node) for node in nodes]
+            else:
+                lines.append(line.format(resource_count=SHARED_RESOURCES + 2 * len(nodes)))
+        paced(lines, latency("terraform"))
+        return 0
+
+    if command == "output":
+        try:
+            with open("terraform.tfstate") as f:
+                outputs = json.load(f)["outputs"]
+        except FileNotFoundError:
+            outputs = {}
+        print(json.dumps({name: {"sensitive": False, **output} for name, output in outputs.items()}))
+        return 0
+
+    if command == "destroy":
+        if os.path.exists("terraform.tfstate"):
+            os.remove("terraform.tfstate")
+        paced(["Destroy complete! Resources: 0 destroyed."], latency("terraform"))
+        return 0
+
+    print(f"fake terraform: {command} is not supported", file=sys.stderr)
+    return 1
+
+
+#### ansible ####
+
+def emit(event, **fields):
+    print(json.dumps({"event": event, "time": time.time(), **fields}), flush=True)
+
+
+def ansible_playbook(args):
+    playbook = next((arg for arg in args if arg.endswith(".yml")), "")
+    hosts = inventory_hosts(flag(args, "-i"))
+    limit = flag(args, "--limit")
+    if limit:
+        hosts = [host for host in hosts if host in limit.split(",")]
+    playbooks = json.loads(fixture("playbooks.json"))
+    tasks = playbooks.get(os.path.basename(playbook), playbooks["default"])
+    fail = random.random() < float(os.environ.get("BENCH_FAIL_RATE", "0"))
+    pause = latency("ansible-playbook") / max(1, len(tasks))
+
+    emit("play_start", play=os.path.basename(playbook))
+    for number, task in enumerate(tasks, start=1):
+        emit("task_start", task=task["name"], action="command")
+        time.sleep(pause)
+        for host in hosts:
+            status, result = task.get("status", "ok"), task["result"]
+            if fail and number == len(tasks):
+                status, result = "failed", {"changed": False, "msg": "bench: injected failure"}
+            emit("host_result", task=task["name"], host=host, status=status, changed=result.get("changed", False),
+                 ignored=False, duration=round(pause, 3), result=result)
+    summary = {"ok": len(tasks) - fail, "changed": 0, "unreachable": 0, "failures": int(fail), "skipped": 0}
+    emit("stats", hosts={host: summary for host in hosts})
+    return 2 if fail else 0
+
+
+def ansible(args):
+    # Ad-hoc modules print "host | SUCCESS => {...}" per host
+    pattern = args[0] if args and not args[0].startswith("-") else "all"
+    hosts = inventory_hosts(flag(args, "-i"))
+    if pattern not in ("all", "postgresql"):
+        hosts = [host for host in hosts if host in pattern.split(",")]
+    paced(
+        [f"{host} | SUCCESS => {json.dumps({'changed': False, 'ping': 'pong'}, indent=4)}" for host in hosts],
+        latency("ansible"),
+    )
+    return 0
+
+
+#### aws ####
+
+def aws(args):
+    if args[:2] != ["ec2", "describe-instances"]:
+        print("{}")
+        return 0
+    filters = json.loads(flag(args, "--filters") or "[]")
+    ids = set()
+    for entry in filters:
+        if entry["Name"] == "instance-id":
+            ids.update(entry["Values"])
+        elif entry["Name"] == "tag:Name":
+            ids.update(instance_id(name) for name in entry["Values"])
+
+    template = fixture("describe_instances.json")
+    reservations = []
+    for iid in sorted(ids):
+        try:
+            with open(state_path("instances", iid)) as f:
+                instance = json.load(f)
+        except FileNotFoundError:
+            continue
+        public_ip, private_ip = addresses(iid)
+        values = {
+            "__AMI__": instance["ami"] or "ami-0a73e96a849c232cc",
+            "__INSTANCE_ID__": iid,
+            "__INSTANCE_TYPE__": instance["instance_type"] or "t3.medium",
+            "__PRIVATE_IP__": private_ip,
+            "__PRIVATE_DNS__": private_ip.replace(".", "-"),
+            "__PUBLIC_IP__": public_ip,
+            "__PUBLIC_DNS__": public_ip.replace(".", "-"),
+            "__NAME__": instance["name"],
+            "__RESERVATION__": iid[2:],
+        }
+        reservations.append(json.loads(re.sub("|".join(values), lambda m: values[m.group(0)], template)))
+    time.sleep(latency("aws"))
+    print(json.dumps({"Reservations": reservations}, indent=4))
+    return 0
+
+
+TOOLS = {"terraform": terraform, "ansible-playbook": ansible_playbook, "ansible": ansible, "aws": aws}
+
+if __name__ == "__main__":
+    sys.exit(TOOLS[sys.argv[1]](sys.argv[2:]))
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class ClusterBusy(Exception):
+    def __init__(self, cluster_name, holder, waited):
+        super().__init__(f"Cluster '{cluster_name}' is busy ({holder} in progress); gave up after {waited:.0f}s")
+        self.cluster_name = cluster_name
+        self.holder = holder
+
+
+class _ClusterLock:
+    def __init__(self):
+        self.holder = None  # operation holding the lock
+        self.held_since = None
+        self.waiters = deque()  # (future, operation), first come first served
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def metrics(self):
+        return {
+            "holder": self.holder,
+            "held_seconds": round(time.monotonic() - self.held_since, 3) if self.holder else None,
+            "waiting": sum(1 for fut, _ in self.waiters if not fut.done()),
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "timeouts": self.timeouts,
+            "wait_time_avg": round(self.wait_total / self.contended, 4) if self.contended else 0.0,
+            "wait_time_max": round(self.wait_max, 4),
+        }
+
+
+class ClusterLocks:
+    # Per-cluster coordination for operations that run playbooks or SQL on a cluster.
+    #
+    # exclusive(): one mutating operation per cluster at a time. Waiters are served
+    # strictly in arrival order (the lock is handed to the next waiter on release, so
+    # newcomers cannot barge in) and give up with ClusterBusy after max_wait seconds.
+    #
+    # coalesce(): identical read operations in flight share one execution; callers
+    # arriving while it runs get the same result (or exception).
+    def __init__(self, max_wait=120):
+        self.max_wait = max_wait
+        self._locks = {}
+        self._inflight = {}
+        self._reads = {}  # operation -> {"started": n, "coalesced": n}
+
+    @asynccontextmanager
+    async def exclusive(self, cluster_name, operation):
+        await self._acquire(cluster_name, operation)
+        try:
+            yield
+        finally:
+            self._release(cluster_name)
+
+    async def _acquire(self, cluster_name, operation):
+        lock = self._locks.setdefault(cluster_name, _ClusterLock())
+        if lock.holder is None and not lock.waiters:
+            self._grant(lock, operation)
+            return
+
+        lock.contended += 1
+        fut = asyncio.get_running_loop().create_future()
+        lock.waiters.append((fut, operation))
+        start = time.monotonic()
+        try:
+            # _release() hands the lock over by resolving the future
+            await asyncio.wait_for(fut, self.max_wait)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                return  # handed over just as the wait ran out
+            lock.timeouts += 1
+            raise ClusterBusy(cluster_name, lock.holder, time.monotonic() - start)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Cancelled after _release() handed the lock over: pass it on
+                self._release(cluster_name)
+            raise
+        finally:
+            waited = time.monotonic() - start
+            lock.wait_total += waited
+            lock.wait_max = max(lock.wait_max, waited)
+
+    def _grant(self, lock, operation):
+        lock.holder = operation
+        lock.held_since = time.monotonic()
+        lock.acquired += 1
+
+    def _release(self, cluster_name):
+        lock = self._locks[cluster_name]
+        while lock.waiters:
+            fut, operation = lock.waiters.popleft()
+            if not fut.done():  # skip waiters that timed out or were cancelled
+                self._grant(lock, operation)
+                fut.set_result(None)
+                return
+        lock.holder = None
+        lock.held_since = None
+
+    async def coalesce(self, cluster_name, operation, fn):
+        # fn: coroutine function without arguments, run at most once per (cluster, operation) at a time
+        key = (cluster_name, operation)
+        counters = self._reads.setdefault(operation, {"started": 0, "coalesced": 0})
+        task = self._inflight.get(key)
+        if task is None:
+            counters["started"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            counters["coalesced"] += 1
+        # shield: one caller going away must not cancel the run the others wait on
+        return await asyncio.shield(task)
+
+    def forget(self, cluster_name):
+        lock = self._locks.get(cluster_name)
+        if lock and lock.holder is None and not lock.waiters:
+            del self._locks[cluster_name]
+
+    def stats(self):
+        return {
+            "max_wait": self.max_wait,
+            "clusters": {name: lock.metrics() for name, lock in self._locks.items()},
+            "reads": self._reads,
+            "reads_in_flight": len(self._inflight),
+        }
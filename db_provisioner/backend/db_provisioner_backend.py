@@ -1,19 +1,61 @@
+import asyncio
+import base64
 import os
 import shutil
 import subprocess
-import sqlite3
+import tempfile
 import requests
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, StringConstraints
+from typing import Annotated
 from jinja2 import Environment, FileSystemLoader
-from datetime import datetime
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager, contextmanager
 import re
 import ast
 import json
 import yaml
 
-app = FastAPI()
+from jobs import ACTIVE_STATES, JobManager
+from ansible_events import PlaybookEvents, PlaybookFailed, callback_env, loop_results
+from aws_throttle import RateLimiter, call_with_backoff
+from cluster_locks import ClusterBusy, ClusterLocks
+from deploy_profile import DeployProfiler, job_spans, percentile
+from deploy_scheduler import DeployScheduler
+from ec2_inventory import EC2Inventory
+from health_cache import HealthCache
+from log_stream import follow_log, run_async, run_streaming
+import metrics
+from pg_direct import SQL_ERRORS, DirectSQL, DirectSQLUnavailable, grant_privileges, role_options
+from pg_pools import PoolRegistry, PoolTimeout
+from role_fingerprints import ROLE_TAGS, RoleFingerprints, plan as plan_roles
+from ssh_mux import SSHMultiplexer, inventory_hosts
+from state_store import StateStore
+from template_store import TemplateStore
+from tf_workspace import TerraformWorkspace
+from warm_pool import WarmPool, parse_specs
+
+@asynccontextmanager
+async def lifespan(app):
+    for route in app.routes:
+        for method in getattr(route, "methods", None) or ():
+            metrics.HTTP_REQUEST_SECONDS.register(method, route.path)
+    health_cache.start()
+    pool_registry.start()
+    terraform_workspace.start()
+    warm_pool.start()
+    yield
+    await warm_pool.stop()
+    await health_cache.stop()
+    await pool_registry.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.exception_handler(ClusterBusy)
+async def cluster_busy_handler(request, exc):
+    return JSONResponse(status_code=409, content={"detail": str(exc)}, headers={"Retry-After": "5"})
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,7 +63,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Link", "X-Next-Cursor"],
 )
+# Added last so it wraps everything else, CORS included
+app.add_middleware(metrics.MetricsMiddleware)
 
 class DeployRequest(BaseModel):
     cluster_name: str
@@ -35,6 +80,9 @@ class DeployRequest(BaseModel):
     allowed_ip_2: str = None
     pod_count: int = None
 
+class DeployBatchRequest(BaseModel):
+    deployments: list[DeployRequest]
+
 class CreateDBRequest(BaseModel):
     cluster_name: str
     db_name: str
@@ -66,6 +114,39 @@ class RemoveUserRequest(BaseModel):
     cluster_name: str
     username: str
 
+# Database and role names the bulk endpoints accept; the playbooks quote them too
+PGName = Annotated[str, StringConstraints(pattern=r"^[A-Za-z_][A-Za-z0-9_$-]{0,62}$")]
+
+class BulkDatabasesRequest(BaseModel):
+    databases: list[PGName]
+
+class BulkUser(BaseModel):
+    username: PGName
+    password: str
+    roles: list[str] = []
+
+class BulkGrant(BaseModel):
+    username: PGName
+    database: PGName
+    privileges: list[str] = ["ALL"]
+
+class BulkUsersRequest(BaseModel):
+    users: list[BulkUser] = []
+    grants: list[BulkGrant] = []
+
+class StatusBatchRequest(BaseModel):
+    cluster_names: list[str]
+    refresh: bool = False
+
+class ScaleRequest(BaseModel):
+    cluster_name: str
+    instance_count: int = None  # EC2 clusters
+    pod_count: int = None  # Kubernetes clusters
+
+class ConvergeRequest(BaseModel):
+    force: bool = False  # run every role whatever the fingerprints say
+    upgrade_templates: bool = False  # re-link to the current templates first
+
 OS_AMI_USER_MAPPING = {
     "ami-0a73e96a849c232cc": "rocky",
     "ami-0c2b8ca1dad447f8a": "ubuntu",
@@ -75,54 +156,188 @@ OS_AMI_USER_MAPPING = {
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
-DEPLOYMENTS_DIR = os.path.join(BASE_DIR, "deployments")
-db_path = os.path.join(BASE_DIR, "clusters.db")
+DEPLOYMENTS_DIR = os.environ.get("DB_PROVISIONER_DEPLOYMENTS_DIR", os.path.join(BASE_DIR, "deployments"))
+db_path = os.environ.get("DB_PROVISIONER_DB_PATH", os.path.join(BASE_DIR, "clusters.db"))
 env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
 
-def init_db():
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS clusters (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            cluster_name TEXT,
-            platform TEXT,
-            status TEXT,
-            instance_count INTEGER,
-            ami TEXT,
-            instance_type TEXT,
-            data_volume_size INTEGER,
-            postgresql_version TEXT,
-            allowed_ip_1 TEXT,
-            allowed_ip_2 TEXT,
-            server_public_ip TEXT,
-            public_ip_1 TEXT,
-            public_ip_2 TEXT,
-            public_ip_3 TEXT,
-            public_ip_4 TEXT,
-            public_ip_5 TEXT,
-            public_ip_6 TEXT,
-            public_ip_7 TEXT,
-            public_ip_8 TEXT,
-            public_ip_9 TEXT,
-            private_ip_1 TEXT,
-            private_ip_2 TEXT,
-            private_ip_3 TEXT,
-            private_ip_4 TEXT,
-            private_ip_5 TEXT,
-            private_ip_6 TEXT,
-            private_ip_7 TEXT,
-            private_ip_8 TEXT,
-            private_ip_9 TEXT,
-            deployment_dir TEXT,
-            timestamp TEXT,
-            pod_count INTEGER
-        )
-    """)
-    conn.commit()
-    conn.close()
+store = StateStore(db_path)
+store.migrate()
+
+# Long-running provisioning work is handed to this bounded executor so request threads stay free
+DEPLOY_WORKERS = int(os.environ.get("DB_PROVISIONER_DEPLOY_WORKERS", "4"))
+DEPLOY_PHASES = ["render", "terraform_init", "terraform_apply", "terraform_output", "describe_instances", "register"]
+# A deploy served from the warm pool only renames the instance and applies the cluster's settings
+WARM_DEPLOY_PHASES = ["render", "terraform_apply", "configure", "describe_instances", "register"]
+for phase in DEPLOY_PHASES + ["configure"]:
+    metrics.JOB_PHASE_SECONDS.register("deploy", phase)
+for phase in DEPLOY_PHASES:
+    metrics.JOB_PHASE_SECONDS.register("warm_pool", phase)
+SCALE_OUT_PHASES = ["render", "terraform_apply", "describe_instances", "configure", "register"]
+SCALE_IN_PHASES = ["render", "leave", "terraform_apply", "describe_instances", "configure", "register"]
+SCALE_POD_PHASES = ["render", "configure", "register"]
+for phase in SCALE_IN_PHASES:
+    metrics.JOB_PHASE_SECONDS.register("scale", phase)
+CONVERGE_PHASES = ["render", "plan", "configure", "register"]
+for phase in CONVERGE_PHASES:
+    metrics.JOB_PHASE_SECONDS.register("converge", phase)
+jobs = JobManager(store, max_workers=DEPLOY_WORKERS)
+jobs.recover()
+
+# POST /deploy/batch: global and per-platform concurrency ("ec2=20,kubernetes=4")
+BATCH_CONCURRENCY = int(os.environ.get("DB_PROVISIONER_BATCH_CONCURRENCY", "10"))
+BATCH_PLATFORM_LIMITS = {
+    platform.strip(): int(limit)
+    for platform, _, limit in (
+        entry.partition("=") for entry in os.environ.get("DB_PROVISIONER_BATCH_PLATFORM_LIMITS", "").split(",") if entry
+    )
+}
+deploy_scheduler = DeployScheduler(jobs, max_concurrent=BATCH_CONCURRENCY, platform_limits=BATCH_PLATFORM_LIMITS)
 
-init_db()
+# Shared by every deploy: paces terraform applies and AWS CLI calls
+aws_limiter = RateLimiter(
+    rate=float(os.environ.get("DB_PROVISIONER_AWS_RATE", "2")),
+    burst=int(os.environ.get("DB_PROVISIONER_AWS_BURST", "5")),
+)
+
+pool_registry = PoolRegistry(
+    user=os.environ.get("DB_PROVISIONER_PG_USER", "postgres"),
+    password=os.environ.get("DB_PROVISIONER_PG_PASSWORD", "postgres"),
+    max_per_cluster=int(os.environ.get("DB_PROVISIONER_POOL_MAX_PER_CLUSTER", "5")),
+    max_total=int(os.environ.get("DB_PROVISIONER_POOL_MAX_TOTAL", "100")),
+    max_pools=int(os.environ.get("DB_PROVISIONER_POOL_MAX_CLUSTERS", "200")),
+    idle_timeout=float(os.environ.get("DB_PROVISIONER_POOL_IDLE_TIMEOUT", "300")),
+    acquire_timeout=float(os.environ.get("DB_PROVISIONER_POOL_ACQUIRE_TIMEOUT", "10")),
+)
+direct_sql = DirectSQL(pool_registry, enabled=os.environ.get("DB_PROVISIONER_DIRECT_SQL") == "1")
+
+template_store = TemplateStore(
+    os.path.join(TEMPLATE_DIR, "ansible"),
+    os.environ.get("DB_PROVISIONER_TEMPLATE_STORE", os.path.join(BASE_DIR, "template_store")),
+)
+
+terraform_workspace = TerraformWorkspace(
+    os.path.join(TEMPLATE_DIR, "terraform", "modules", "postgres_ha"),
+    os.environ.get("DB_PROVISIONER_TF_CACHE_DIR", os.path.join(BASE_DIR, "terraform_cache")),
+)
+
+# ControlPersist masters reused by every ansible run; sockets live outside BASE_DIR
+# because their paths must stay under the ~100 character unix socket limit
+ssh_mux = SSHMultiplexer(
+    os.environ.get("DB_PROVISIONER_SSH_CONTROL_DIR", os.path.join(tempfile.gettempdir(), "db_provisioner_ssh")),
+    persist=int(os.environ.get("DB_PROVISIONER_SSH_PERSIST", "600")),
+    pipelining=os.environ.get("DB_PROVISIONER_ANSIBLE_PIPELINING", "1") == "1",
+)
+
+# One mutating operation (playbook, SQL or terraform) per cluster at a time; callers
+# queue in arrival order for at most this long before getting a 409
+cluster_locks = ClusterLocks(max_wait=float(os.environ.get("DB_PROVISIONER_LOCK_MAX_WAIT", "120")))
+
+# Per-command timeouts (seconds) for handlers that run commands on the event loop
+PLAYBOOK_TIMEOUT = float(os.environ.get("DB_PROVISIONER_PLAYBOOK_TIMEOUT", "900"))
+TERRAFORM_TIMEOUT = float(os.environ.get("DB_PROVISIONER_TERRAFORM_TIMEOUT", "1800"))
+AWS_TIMEOUT = float(os.environ.get("DB_PROVISIONER_AWS_TIMEOUT", "60"))
+
+# Instance addresses and states, batched across callers and cached for a short TTL.
+# DB_PROVISIONER_EC2_ENDPOINT points it at a mock EC2 endpoint for testing.
+ec2_inventory = EC2Inventory(
+    region=os.environ.get("DB_PROVISIONER_AWS_REGION"),
+    endpoint_url=os.environ.get("DB_PROVISIONER_EC2_ENDPOINT"),
+    ttl=float(os.environ.get("DB_PROVISIONER_EC2_TTL", "30")),
+    batch_window=float(os.environ.get("DB_PROVISIONER_EC2_BATCH_WINDOW", "0.05")),
+    limiter=aws_limiter,
+    timeout=AWS_TIMEOUT,
+)
+
+# Seconds before cached host facts are gathered again (0: only when cleared)
+FACT_CACHE_TIMEOUT = int(os.environ.get("DB_PROVISIONER_FACT_CACHE_TIMEOUT", "86400"))
+
+# Standby standalone instances, "ami:instance_type:version[:volume_size]=count,..."; empty
+# disables the pool. volume_size defaults to the data_volume_size a /deploy gets when it
+# gives none (0), since a deploy only claims an instance of exactly its size. They are
+# built with this placeholder allowed IP, replaced on claim.
+warm_pool = WarmPool(
+    store,
+    parse_specs(
+        os.environ.get("DB_PROVISIONER_WARM_POOL", ""),
+        default_volume_size=DeployRequest.model_fields["data_volume_size"].default,
+    ),
+    build=lambda entry_id, spec: jobs.submit(
+        "warm_pool", warm_instance_name(entry_id), run_warm_build, entry_id, spec, phases=DEPLOY_PHASES
+    ),
+    destroy=lambda entry_id: jobs.submit("warm_pool_destroy", warm_instance_name(entry_id), run_warm_destroy, entry_id),
+    interval=float(os.environ.get("DB_PROVISIONER_WARM_POOL_INTERVAL", "60")),
+    retry_after=float(os.environ.get("DB_PROVISIONER_WARM_POOL_RETRY_AFTER", "600")),
+)
+warm_pool.recover()
+WARM_POOL_ALLOWED_IP = os.environ.get("DB_PROVISIONER_WARM_POOL_ALLOWED_IP", "127.0.0.1/32")
+
+# Per host and role fingerprints of what site.yml last applied
+role_fingerprints = RoleFingerprints()
+
+# Rows per page of /clusters and /standalone_clusters when no limit is given, and the most allowed
+CLUSTER_PAGE_SIZE = int(os.environ.get("DB_PROVISIONER_CLUSTER_PAGE_SIZE", "500"))
+CLUSTER_PAGE_MAX = 1000
+
+async def run_playbook(cmd, deployment_dir, log_name="operations", check=True, **kwargs):
+    # Every playbook prints jsonl_events lines, parsed as they arrive; returns the
+    # PlaybookEvents and raises PlaybookFailed on a non-zero exit when check is set
+    events = PlaybookEvents()
+    log_path = cluster_log(deployment_dir, log_name)
+    result = await run_async(
+        cmd, log_path, env=callback_env(ansible_env(deployment_dir)), check=False, on_line=events.feed,
+        timeout=PLAYBOOK_TIMEOUT, **kwargs
+    )
+    events.returncode = result.returncode
+    playbook = next((os.path.basename(arg) for arg in cmd if arg.endswith(".yml")), cmd[0])
+    timings = []
+    for t in events.timings():
+        if t["duration"] is not None:
+            metrics.ANSIBLE_TASK_SECONDS.observe(t["duration"], playbook, t["task"])
+            timings.append(f"{t['task']} {t['duration']:.2f}s")
+    if timings:
+        with open(log_path, "a") as f:
+            f.write(f"# task timings: {', '.join(timings)}\n")
+    if check and result.returncode != 0:
+        raise PlaybookFailed(result.returncode, cmd, events)
+    return events
+
+def ansible_env(deployment_dir):
+    # Lets the cluster's ansible.cfg (roles_path into the template store) apply
+    # whatever the working directory, e.g. terraform's local-exec provisioner.
+    # Facts are cached per cluster and only gathered for hosts not in the cache: the
+    # deploy fills it, /start clears it, everything else reuses it.
+    return ssh_mux.env({
+        **os.environ,
+        "ANSIBLE_CONFIG": os.path.join(deployment_dir, "ansible", "ansible.cfg"),
+        "ANSIBLE_GATHERING": "smart",
+        "ANSIBLE_CACHE_PLUGIN": "jsonfile",
+        "ANSIBLE_CACHE_PLUGIN_CONNECTION": fact_cache_dir(deployment_dir),
+        "ANSIBLE_CACHE_PLUGIN_TIMEOUT": str(FACT_CACHE_TIMEOUT),
+    })
+
+def fact_cache_dir(deployment_dir):
+    return os.path.join(deployment_dir, "facts")
+
+def clear_fact_cache(deployment_dir):
+    shutil.rmtree(fact_cache_dir(deployment_dir), ignore_errors=True)
+
+def cluster_log(deployment_dir, name="operations"):
+    return os.path.join(deployment_dir, "logs", f"{name}.log")
+
+@contextmanager
+def private_vars_file(directory, values):
+    # Secrets go to ansible-playbook as "-e @file" rather than on the command line
+    # (and so the operations log); the file is readable by this user only
+    fd, path = tempfile.mkstemp(dir=directory, suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(values, f)
+        yield path
+    finally:
+        os.remove(path)
+
+def job_log(job):
+    return cluster_log(os.path.join(DEPLOYMENTS_DIR, job["cluster_name"]), job["id"])
 
 @app.get("/os-options")
 def get_os_options():
@@ -132,36 +347,99 @@ def get_os_options():
 def get_pg_versions():
     return ["14", "15", "16"]
 
+def encode_cursor(row_id):
+    return base64.urlsafe_b64encode(f"id:{row_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        kind, _, value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().partition(":")
+        if kind == "id":
+            return int(value)
+    except ValueError:
+        pass
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def etag_matches(if_none_match, etag):
+    # Weak comparison, as If-None-Match requires
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def list_clusters_page(request, if_none_match, standalone_only, cursor, limit, order, **filters):
+    # The list body stays a plain array; the next page's cursor goes in X-Next-Cursor
+    # and a Link rel="next" header. The ETag is the clusters change counter, read
+    # before the query so a concurrent write can only make it stale, never too new.
+    if not 1 <= limit <= CLUSTER_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {CLUSTER_PAGE_MAX}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+
+    etag = f'W/"{store.table_version("clusters")}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    created_after = filters.pop("created_after")
+    if created_after is not None:
+        # timestamp is stored as naive UTC ISO text
+        if created_after.tzinfo is not None:
+            created_after = created_after.astimezone(timezone.utc).replace(tzinfo=None)
+        created_after = created_after.isoformat()
+
+    rows = store.list_clusters_page(
+        limit,
+        after_id=decode_cursor(cursor) if cursor else None,
+        descending=order == "desc",
+        standalone_only=standalone_only,
+        created_after=created_after,
+        **filters,
+    )
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["id"])
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+
+    content = [
+        {"name": row["cluster_name"], "status": row["status"], "timestamp": row["timestamp"], "platform": row["platform"]}
+        for row in rows
+    ]
+    return JSONResponse(content=content, headers=headers)
+
 @app.get("/clusters")
-def list_clusters():
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT cluster_name, status, timestamp, platform FROM clusters")
-    rows = cursor.fetchall()
-    conn.close()
-    return [{"name": name, "status": status, "timestamp": ts, "platform": platform} for name, status, ts, platform in rows]
+def list_clusters(
+    request: Request,
+    platform: str = None,
+    status: str = None,
+    version: str = None,
+    created_after: datetime = None,
+    cursor: str = None,
+    limit: int = CLUSTER_PAGE_SIZE,
+    order: str = "asc",
+    if_none_match: str = Header(None),
+):
+    return list_clusters_page(
+        request, if_none_match, False, cursor, limit, order,
+        platform=platform, status=status, postgresql_version=version, created_after=created_after,
+    )
+
+def cluster_endpoint(platform, public_ip):
+    if platform == "kubernetes":
+        return public_ip, 30036  # nodePort hardcoded in service
+    return public_ip, 5432
 
 @app.get("/clusters/{cluster_name}/connection_info")
 def get_connection_info(cluster_name: str):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT cluster_name, platform, public_ip_1
-        FROM clusters
-        WHERE cluster_name=?
-    """, (cluster_name,))
-    row = cursor.fetchone()
-    conn.close()
+    row = store.get_cluster(cluster_name, ("cluster_name", "platform"), with_primary_ip=True)
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
 
     cluster_name, platform, public_ip = row
 
-    port = 5432
-    host = public_ip
+    host, port = cluster_endpoint(platform, public_ip)
     if platform == "kubernetes":
-        port = 30036  # nodePort hardcoded in service
         connection_string = f'PGPASSWORD=postgres psql -h {public_ip} -p {port} -U postgres -d postgres'
     else:
         connection_string = f'PGPASSWORD=postgres psql -h {public_ip} -p {port} -U postgres -d postgres'
@@ -178,132 +456,839 @@ def get_connection_info(cluster_name: str):
     }
 
 
-@app.post("/deploy")
+@app.post("/deploy", status_code=202)
 def deploy_cluster(request: DeployRequest):
-    if request.instance_count > 9:
-        raise HTTPException(status_code=400, detail="Maximum 9 instances allowed.")
+    claim_cluster_name(request)
+    spec = warm_pool.key_for(request)
+    warm_entry = warm_pool.claim(spec, request.cluster_name) if spec else None
+    if warm_entry:
+        job_id = jobs.submit("deploy", request.cluster_name, run_deploy, request, warm_entry, phases=WARM_DEPLOY_PHASES)
+        warm_pool.refill_soon(jobs.executor)
+    else:
+        job_id = jobs.submit("deploy", request.cluster_name, run_deploy, request, phases=DEPLOY_PHASES)
+    return {
+        "job_id": job_id,
+        "cluster_name": request.cluster_name,
+        "status": "queued",
+        "warm_pool": warm_entry["id"] if warm_entry else None,
+    }
+
+@app.post("/deploy/batch", status_code=202)
+def deploy_batch(request: DeployBatchRequest):
+    accepted, rejected = [], []
+    for item in request.deployments:
+        try:
+            claim_cluster_name(item)
+        except HTTPException as e:
+            rejected.append({"cluster_name": item.cluster_name, "status_code": e.status_code, "detail": e.detail})
+            continue
+        accepted.append(item)
+    if not accepted:
+        raise HTTPException(status_code=400, detail={"message": "No deployment could be queued", "rejected": rejected})
+
+    batch_id, job_ids = deploy_scheduler.submit_batch(
+        "deploy",
+        [(item.cluster_name, item.platform, run_deploy, (item,)) for item in accepted],
+        phases=DEPLOY_PHASES,
+    )
+    return {
+        "batch_id": batch_id,
+        "jobs": [{"job_id": job_id, "cluster_name": item.cluster_name} for job_id, item in zip(job_ids, accepted)],
+        "rejected": rejected,
+    }
+
+@app.get("/deploy/batch/{batch_id}")
+def get_deploy_batch(batch_id: str):
+    progress = deploy_scheduler.progress(batch_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return progress
+
+@app.get("/deploy/scheduler")
+def get_deploy_scheduler():
+    return deploy_scheduler.stats()
+
+@app.get("/deploy/timeline")
+def get_deploy_timeline_summary(include_failed: bool = False):
+    # p50/p95 per phase across every recorded deploy, slowest first
+    durations = {}
+    deploys = set()
+    for row in store.deploy_phase_durations(None if include_failed else "succeeded"):
+        durations.setdefault((row["phase"], row["parent"]), []).append(row["duration"])
+        deploys.add(row["job_id"])
+
+    phases = [
+        {
+            "phase": phase,
+            "parent": parent,
+            "count": len(values),
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "max": values[-1],
+        }
+        for (phase, parent), values in durations.items()
+    ]
+    phases.sort(key=lambda p: p["p95"], reverse=True)
+    return {"deploys": len(deploys), "phases": phases}
+
+@app.get("/clusters/{cluster_name}/timeline")
+def get_cluster_timeline(cluster_name: str):
+    rows = store.deploy_timeline(cluster_name)
+    if not rows:
+        raise HTTPException(status_code=404, detail="No deploy timeline recorded for this cluster")
+
+    origin = datetime.fromisoformat(rows[0]["started_at"])
+    phases = []
+    for row in rows:
+        offset = (datetime.fromisoformat(row["started_at"]) - origin).total_seconds()
+        phases.append({
+            "phase": row["phase"],
+            "parent": row["parent"],
+            "offset_seconds": round(offset, 3),
+            "duration": row["duration"],
+        })
+    return {
+        "cluster_name": cluster_name,
+        "job_id": rows[0]["job_id"],
+        "total_seconds": round(max(p["offset_seconds"] + p["duration"] for p in phases), 3),
+        "phases": phases,
+    }
+
+def claim_cluster_name(request: DeployRequest):
+    if request.instance_count < 1:
+        raise HTTPException(status_code=400, detail="At least 1 instance is required.")
 
     cluster_dir = os.path.join(DEPLOYMENTS_DIR, request.cluster_name)
-    if os.path.exists(cluster_dir):
+    os.makedirs(cluster_dir, exist_ok=True)
+    try:
+        # Creating the ansible directory claims the name, so two concurrent requests cannot both
+        # enqueue it. logs/ may outlive a failed attempt and does not count.
+        os.mkdir(os.path.join(cluster_dir, "ansible"))
+    except FileExistsError:
         raise HTTPException(status_code=409, detail="Cluster already exists.")
 
-    os.makedirs(cluster_dir, exist_ok=True)
 
+def render_cluster_config(tfvars_path, groupvars_path, cluster_name, platform, instance_count, pod_count,
+                          postgresql_version, ami, instance_type, data_volume_size, allowed_ip_1, allowed_ip_2,
+                          server_public_ip):
+    # terraform.tfvars and group_vars/all.yml; written by the deploy and again by /scale
+    ssh_user = OS_AMI_USER_MAPPING.get(ami, "rocky")
+
+    # Determine the EC2 instance count
+    ec2_instance_count = 1 if platform == "kubernetes" else instance_count
+    k8s_node_count = pod_count if platform == "kubernetes" else None
+
+    tf_template = env.get_template("terraform/terraform.tfvars.j2")
+    with open(tfvars_path, "w") as f:
+        f.write(tf_template.render(
+            cluster_name=cluster_name,
+            instance_count=ec2_instance_count,
+            postgres_version=postgresql_version,
+            ami=ami,
+            instance_type=instance_type,
+            data_volume_size=data_volume_size,
+            ssh_user=ssh_user,
+            key_name="ha-postgres-key",
+            public_key_path="~/.ssh/ha-postgres-key.pub",
+            allowed_ip_1=allowed_ip_1,
+            allowed_ip_2=allowed_ip_2,
+            server_public_ip=server_public_ip,
+            platform=platform,
+            pod_count=pod_count,
+            k8s_node_count=k8s_node_count
+        ))
+
+    groupvars_template = env.get_template("ansible/group_vars/all.yml")
+    with open(groupvars_path, "w") as f:
+        f.write(groupvars_template.render(
+            cluster_name=cluster_name,
+            postgresql_version=postgresql_version,
+            instance_count=instance_count,
+            allowed_ips=[allowed_ip_1, allowed_ip_2],
+            server_public_ip=server_public_ip,
+            platform=platform,
+            pod_count=pod_count if platform == "kubernetes" else None,
+            k8s_node_count=k8s_node_count
+        ))
+
+def terraform_instance_ids(tf_module_dir):
+    output_result = subprocess.run(
+        ["terraform", "output", "-json"], cwd=tf_module_dir,
+        capture_output=True, text=True, check=True
+    )
+    tf_outputs = json.loads(output_result.stdout)
+    instance_ids = tf_outputs.get("instance_ids", {}).get("value", [])
+    if not instance_ids:
+        raise RuntimeError("Terraform reported no instances.")
+    return instance_ids
+
+def describe_nodes(instance_ids):
+    # Concurrent deploys share one describe call; instance ids are in node order (count.index)
+    instances = ec2_inventory.lookup(instance_ids=instance_ids)["instances"]
+    return [
+        {
+            "node_index": index,
+            "instance_id": instance_id,
+            "public_ip": (instances.get(instance_id) or {}).get("public_ip"),
+            "private_ip": (instances.get(instance_id) or {}).get("private_ip"),
+        }
+        for index, instance_id in enumerate(instance_ids, start=1)
+    ]
+
+def forget_instances(cluster_name):
+    # Drops a cluster's cached instances after start/stop changed their state or address
+    nodes = store.list_nodes(cluster_name)
+    ec2_inventory.invalidate(
+        instance_ids=[node["instance_id"] for node in nodes if node["instance_id"]],
+        names=[node_name(cluster_name, node["node_index"]) for node in nodes] or [node_name(cluster_name, 1)],
+    )
+
+def lookup_node(cluster_name, node_index, instance_id=None):
+    # By instance id, or by Name tag for clusters deployed before ids were recorded
+    if instance_id:
+        return ec2_inventory.lookup(instance_ids=[instance_id])["instances"].get(instance_id)
+    name = node_name(cluster_name, node_index)
+    return ec2_inventory.lookup(names=[name])["names"].get(name)
+
+def current_fingerprints(cluster, deployment_dir, template_version):
+    ansible_dir = os.path.join(deployment_dir, "ansible")
+    if template_version:
+        roles_dir = os.path.join(template_store.path(template_version), "roles")
+    else:
+        roles_dir = os.path.join(ansible_dir, "roles")
+    return role_fingerprints.compute(
+        cluster, roles_dir,
+        os.path.join(ansible_dir, "group_vars", "all.yml"),
+        os.path.join(ansible_dir, "inventory", "inventory.ini"),
+        fact_cache_dir(deployment_dir),
+    )
+
+def record_fingerprints(cluster_name, cluster, deployment_dir, template_version, applied=None):
+    # After a successful site.yml run; applied is {host: roles} for a partial run,
+    # None when every role ran on every host. Never fails the caller: a missing
+    # fingerprint only means the role runs again next time.
     try:
+        current = current_fingerprints(cluster, deployment_dir, template_version)
+        rows = [
+            (host, role, fingerprint)
+            for host, roles in current.items() if applied is None or host in applied
+            for role, fingerprint in roles.items()
+            if fingerprint and (applied is None or role in applied[host])
+        ]
+        store.record_role_fingerprints(cluster_name, rows, datetime.utcnow().isoformat())
+    except Exception as e:
+        print(f"Could not record role fingerprints for {cluster_name}: {e}")
+
+def render_request_config(request: DeployRequest, cluster_dir, server_public_ip):
+    render_cluster_config(
+        os.path.join(cluster_dir, "terraform", "modules", "postgres_ha", "terraform.tfvars"),
+        os.path.join(cluster_dir, "ansible", "group_vars", "all.yml"),
+        cluster_name=request.cluster_name,
+        platform=request.platform,
+        instance_count=request.instance_count,
+        pod_count=request.pod_count,
+        postgresql_version=request.postgresql_version,
+        ami=request.ami,
+        instance_type=request.instance_type,
+        data_volume_size=request.data_volume_size,
+        allowed_ip_1=request.allowed_ip_1,
+        allowed_ip_2=request.allowed_ip_2,
+        server_public_ip=server_public_ip,
+    )
+
+def provision(job, request: DeployRequest, cluster_dir, log_path, profile):
+    # Everything from templates to instance addresses; returns (nodes, template_version,
+    # server_public_ip). The caller tears down after a failure.
+    with job.phase("render"):
         internet_ip = requests.get("https://api.ipify.org").text.strip()
-        ansible_dst = os.path.join(cluster_dir, "ansible")
         tf_module_dst = os.path.join(cluster_dir, "terraform", "modules", "postgres_ha")
-        tfvars_path = os.path.join(tf_module_dst, "terraform.tfvars")
-        groupvars_path = os.path.join(ansible_dst, "group_vars", "all.yml")
 
-        shutil.copytree(os.path.join(TEMPLATE_DIR, "ansible"), ansible_dst, dirs_exist_ok=True)
-        shutil.copytree(os.path.join(TEMPLATE_DIR, "terraform", "modules", "postgres_ha"), tf_module_dst, dirs_exist_ok=True)
+        template_version = template_store.snapshot()
+        template_store.link(os.path.join(cluster_dir, "ansible"), template_version)
+        terraform_workspace.prepare(tf_module_dst)
+        render_request_config(request, cluster_dir, internet_ip)
+
+    with job.phase("terraform_init"):
+        run_streaming(["terraform", "init", "-input=false"], log_path, cwd=tf_module_dst, env=terraform_workspace.env())
+    with job.phase("terraform_apply"):
+        # Re-running apply after a throttled attempt picks up where it stopped
+        call_with_backoff(
+            lambda: run_streaming(
+                ["terraform", "apply", "-auto-approve"], log_path,
+                cwd=tf_module_dst, env=ansible_env(cluster_dir), on_line=profile.feed,
+            ),
+            aws_limiter,
+        )
+
+    with job.phase("terraform_output"):
+        instance_ids = terraform_instance_ids(tf_module_dst)
 
-        tf_template = env.get_template("terraform/terraform.tfvars.j2")
-        ssh_user = OS_AMI_USER_MAPPING.get(request.ami, "rocky")
+    with job.phase("describe_instances"):
+        nodes = describe_nodes(instance_ids)
+    return nodes, template_version, internet_ip
 
-        # Determine the EC2 instance count
-        ec2_instance_count = 1 if request.platform == "kubernetes" else request.instance_count
-        k8s_node_count = request.pod_count if request.platform == "kubernetes" else None
+def adopt_warm_instance(job, request: DeployRequest, entry, cluster_dir, log_path, profile):
+    # Takes over a warm pool instance: its terraform state moves into the cluster's
+    # directory, then only what depends on the cluster is applied again. Same return
+    # value as provision().
+    pool_dir = entry["deployment_dir"]
+    pool_name = warm_instance_name(entry["id"])
+    tf_module_dst = os.path.join(cluster_dir, "terraform", "modules", "postgres_ha")
+    ansible_dst = os.path.join(cluster_dir, "ansible")
 
-        with open(tfvars_path, "w") as f:
-            f.write(tf_template.render(
+    with job.phase("render"):
+        internet_ip = requests.get("https://api.ipify.org").text.strip()
+        os.rename(os.path.join(pool_dir, "terraform"), os.path.join(cluster_dir, "terraform"))
+        # Cached facts are per inventory hostname, which changes with the cluster name
+        if os.path.isdir(fact_cache_dir(pool_dir)):
+            os.rename(fact_cache_dir(pool_dir), fact_cache_dir(cluster_dir))
+            cached = os.path.join(fact_cache_dir(cluster_dir), node_name(pool_name, 1))
+            if os.path.exists(cached):
+                os.rename(cached, os.path.join(fact_cache_dir(cluster_dir), node_name(request.cluster_name, 1)))
+        # The templates the instance was built with
+        template_store.link(ansible_dst, entry["template_version"])
+        render_request_config(request, cluster_dir, internet_ip)
+
+    with job.phase("terraform_apply"):
+        # Name tag, security group rules for the allowed IPs and the inventory. The
+        # instance wait, disk mount and run_ansible resources are already applied.
+        targets = ["-target=aws_instance.postgres_nodes", "-target=aws_security_group.postgres_sg", "-target=local_file.ansible_inventory"]
+        call_with_backoff(
+            lambda: run_streaming(
+                ["terraform", "apply", "-auto-approve", "-input=false", *targets], log_path,
+                cwd=tf_module_dst, env=ansible_env(cluster_dir), on_line=profile.feed,
+            ),
+            aws_limiter,
+        )
+
+    with job.phase("configure"):
+        # pgBackRest stanza in archive_command and pg_hba entries for the allowed IPs
+        asyncio.run(run_playbook(
+            ["ansible-playbook", "-i", os.path.join(ansible_dst, "inventory", "inventory.ini"),
+             os.path.join(ansible_dst, "site.yml"), "--tags", "postgres"],
+            cluster_dir, log_name=job.job_id,
+        ))
+
+    with job.phase("describe_instances"):
+        ec2_inventory.invalidate(instance_ids=[entry["instance_id"]])
+        nodes = describe_nodes([entry["instance_id"]])
+    return nodes, entry["template_version"], internet_ip
+
+def remove_deployment_files(deployment_dir):
+    # Keep logs/ so the run can still be read back through /jobs/{id}/logs
+    for entry in os.listdir(deployment_dir):
+        if entry != "logs":
+            shutil.rmtree(os.path.join(deployment_dir, entry), ignore_errors=True)
+
+def destroy_deployment(deployment_dir, log_path):
+    tf_exec_dir = os.path.join(deployment_dir, "terraform", "modules", "postgres_ha")
+    try:
+        if os.path.exists(tf_exec_dir):
+            run_streaming(["terraform", "destroy", "-auto-approve"], log_path, cwd=tf_exec_dir, check=False)
+    except Exception as tf_err:
+        print(f"Terraform destroy failed during cleanup: {tf_err}")
+    remove_deployment_files(deployment_dir)
+
+def run_deploy(job, request: DeployRequest, warm_entry=None):
+    cluster_dir = os.path.join(DEPLOYMENTS_DIR, request.cluster_name)
+    log_path = cluster_log(cluster_dir, job.job_id)
+    # Terraform resources and ansible roles, from the apply output
+    profile = DeployProfiler()
+
+    try:
+        if warm_entry:
+            nodes, template_version, internet_ip = adopt_warm_instance(job, request, warm_entry, cluster_dir, log_path, profile)
+        else:
+            nodes, template_version, internet_ip = provision(job, request, cluster_dir, log_path, profile)
+        first_public_ip = nodes[0]["public_ip"]
+
+        with job.phase("register"):
+            inventory_path = os.path.join(cluster_dir, "ansible", "inventory", "inventory.ini")
+            if not os.path.exists(inventory_path):
+                raise RuntimeError("Generated inventory not found.")
+
+            pod_count = int(request.pod_count) if request.pod_count is not None else None
+
+            store.insert_cluster(
                 cluster_name=request.cluster_name,
-                instance_count=ec2_instance_count,
-                postgres_version=request.postgresql_version,
+                platform=request.platform,
+                instance_count=request.instance_count,
+                status="completed",
+                timestamp=datetime.utcnow().isoformat(),
+                deployment_dir=cluster_dir,
                 ami=request.ami,
                 instance_type=request.instance_type,
                 data_volume_size=request.data_volume_size,
-                ssh_user=ssh_user,
-                key_name="ha-postgres-key",
-                public_key_path="~/.ssh/ha-postgres-key.pub",
+                postgresql_version=request.postgresql_version,
                 allowed_ip_1=request.allowed_ip_1,
                 allowed_ip_2=request.allowed_ip_2,
                 server_public_ip=internet_ip,
-                platform=request.platform,
-                pod_count=request.pod_count,
-                k8s_node_count=k8s_node_count
-            ))
+                pod_count=pod_count,
+                template_version=template_version,
+                nodes=nodes
+            )
+            if warm_entry:
+                remove_deployment_files(warm_entry["deployment_dir"])
+                warm_pool.release(warm_entry["id"])
+            # Every role has run on every node: site.yml in full, or for a warm pool
+            # instance at build time plus the postgres role just now
+            record_fingerprints(
+                request.cluster_name,
+                {"platform": request.platform, "instance_count": request.instance_count, "pod_count": pod_count},
+                cluster_dir, template_version,
+            )
 
-        groupvars_template = env.get_template("ansible/group_vars/all.yml")
-        with open(groupvars_path, "w") as f:
-            f.write(groupvars_template.render(
-                cluster_name=request.cluster_name,
-                postgresql_version=request.postgresql_version,
-                instance_count=request.instance_count,
-                allowed_ips=[request.allowed_ip_1, request.allowed_ip_2],
-                server_public_ip=internet_ip,
-                platform=request.platform,
-                pod_count=request.pod_count if request.platform == "kubernetes" else None,
-                k8s_node_count=k8s_node_count
-            ))
+        return {"cluster_name": request.cluster_name, "public_ip": first_public_ip, "warm_pool": bool(warm_entry)}
+
+    except Exception as e:
+        destroy_deployment(cluster_dir, log_path)
+        if warm_entry:
+            if os.path.exists(os.path.join(warm_entry["deployment_dir"], "terraform")):
+                # Failed before taking the instance over; it stays listed for DELETE /warm_pool/{id}
+                store.update_warm_instance(warm_entry["id"], status="failed", error=f"Claim by {request.cluster_name} failed: {e}")
+            else:
+                warm_pool.release(warm_entry["id"])
+        raise RuntimeError(f"Provisioning failed: {str(e)}") from e
 
-        subprocess.run(["terraform", "init"], cwd=tf_module_dst, check=True)
-        subprocess.run(["terraform", "apply", "-auto-approve"], cwd=tf_module_dst, check=True)
+    finally:
+        try:
+            store.insert_deploy_phases(
+                request.cluster_name, job.job_id, job_spans(job.phases) + profile.spans("terraform_apply")
+            )
+        except Exception as e:
+            print(f"Could not record the deploy timeline: {e}")
+
+
+def warm_instance_name(entry_id):
+    return f"warm-{entry_id}"
+
+def run_warm_build(job, entry_id, spec):
+    # A standalone deploy under the entry's placeholder name, not registered as a cluster
+    ami, instance_type, postgresql_version, data_volume_size = spec
+    name = warm_instance_name(entry_id)
+    pool_dir = os.path.join(DEPLOYMENTS_DIR, name)
+    log_path = cluster_log(pool_dir, job.job_id)
+    store.update_warm_instance(entry_id, deployment_dir=pool_dir)
+    request = DeployRequest(
+        cluster_name=name, platform="ec2", instance_count=1, postgresql_version=postgresql_version, ami=ami,
+        instance_type=instance_type, data_volume_size=data_volume_size,
+        allowed_ip_1=WARM_POOL_ALLOWED_IP, allowed_ip_2=WARM_POOL_ALLOWED_IP,
+    )
+    try:
+        nodes, template_version, _ = provision(job, request, pool_dir, log_path, DeployProfiler())
+        with job.phase("register"):
+            node = nodes[0]
+            warm_pool.built(
+                entry_id, template_version=template_version, instance_id=node["instance_id"],
+                public_ip=node["public_ip"], private_ip=node["private_ip"],
+            )
+    except Exception as e:
+        destroy_deployment(pool_dir, log_path)
+        warm_pool.build_failed(entry_id, spec, str(e))
+        raise RuntimeError(f"Warm pool build failed: {str(e)}") from e
+    return {"entry_id": entry_id, "instance_id": node["instance_id"], "public_ip": node["public_ip"]}
+
+def run_warm_destroy(job, entry_id):
+    entry = store.get_warm_instance(entry_id)
+    pool_dir = entry["deployment_dir"] or os.path.join(DEPLOYMENTS_DIR, warm_instance_name(entry_id))
+    if os.path.isdir(pool_dir):
+        destroy_deployment(pool_dir, cluster_log(pool_dir, job.job_id))
+    warm_pool.release(entry_id)
+    return {"entry_id": entry_id, "instance_id": entry["instance_id"]}
+
+@app.get("/warm_pool")
+def get_warm_pool():
+    entries = [
+        {key: row[key] for key in (
+            "id", "pool_key", "status", "instance_id", "public_ip", "job_id", "claimed_by", "error",
+            "created_at", "ready_at",
+        )}
+        for row in store.list_warm_instances()
+    ]
+    return {**warm_pool.stats(), "entries": entries}
+
+@app.delete("/warm_pool/{entry_id}", status_code=202)
+def destroy_warm_instance(entry_id: str):
+    # Ready or failed entries only; refill() builds a replacement if the spec is short
+    if not store.get_warm_instance(entry_id):
+        raise HTTPException(status_code=404, detail="Warm pool entry not found")
+    if not store.claim_warm_instance(None, entry_id=entry_id, statuses=("ready", "failed"), status="destroying"):
+        raise HTTPException(status_code=409, detail="Warm pool entry is being built, claimed or destroyed")
+    job_id = warm_pool.destroy(entry_id)
+    store.update_warm_instance(entry_id, job_id=job_id)
+    return {"job_id": job_id, "entry_id": entry_id}
+
+# Jobs that hold a cluster lock, kept referenced until they finish
+locked_jobs = set()
+
+async def submit_locked(cluster_name, kind, fn, *args, phases=()):
+    # Submits a job that holds the cluster's exclusive lock from start to finish.
+    # Returns its id once the lock is held, or raises ClusterBusy like any other
+    # mutating call on a busy cluster.
+    loop = asyncio.get_running_loop()
+    started = loop.create_future()
+
+    async def hold():
+        try:
+            async with cluster_locks.exclusive(cluster_name, kind):
+                finished = loop.create_future()
+                job_id = jobs.create(kind, cluster_name)
+                jobs.start(
+                    job_id, fn, *args, phases=phases,
+                    on_done=lambda _: loop.call_soon_threadsafe(finished.set_result, None),
+                )
+                started.set_result(job_id)
+                await finished
+        except Exception as e:
+            if started.done():
+                raise
+            started.set_exception(e)
+
+    task = asyncio.create_task(hold())
+    locked_jobs.add(task)
+    task.add_done_callback(locked_jobs.discard)
+    return await started
+
+def node_name(cluster_name, node_index):
+    # Inventory hostname, as written by inventory.ini.tpl
+    return f"{cluster_name}-node-{node_index}"
+
+@app.post("/scale", status_code=202)
+async def scale_cluster(request: ScaleRequest):
+    row = store.get_cluster(request.cluster_name, ("platform", "instance_count", "pod_count"))
+    if not row:
+        raise HTTPException(status_code=404, detail="Cluster not found")
 
-        output_result = subprocess.run(
-            ["terraform", "output", "-json"], cwd=tf_module_dst,
-            capture_output=True, text=True, check=True
+    platform, instance_count, pod_count = row
+    if platform == "kubernetes":
+        field, current, target, phases = "pod_count", pod_count or 1, request.pod_count, SCALE_POD_PHASES
+    else:
+        field, current, target = "instance_count", instance_count, request.instance_count
+        phases = SCALE_OUT_PHASES if (target or 0) > current else SCALE_IN_PHASES
+    if target is None:
+        raise HTTPException(status_code=400, detail=f"{field} is required for {platform} clusters")
+    # Single nodes and single pods have no Patroni cluster to grow; that takes a redeploy
+    if current < 2 or target < 2:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Only HA clusters can be scaled in place ({field} must stay above 1, currently {current})",
+        )
+    if target == current:
+        return JSONResponse(
+            status_code=200,
+            content={"cluster_name": request.cluster_name, "message": f"Cluster already has {field}={current}."},
         )
-        tf_outputs = json.loads(output_result.stdout)
-        instance_ids = tf_outputs.get("instance_ids", {}).get("value", [])
-        first_instance_id = instance_ids[0]
-
-        aws_cli_cmd = [
-            "aws", "ec2", "describe-instances",
-            "--instance-ids", first_instance_id,
-            "--query", "Reservations[0].Instances[0].PublicIpAddress",
-            "--output", "text"
-        ]
-        result = subprocess.run(aws_cli_cmd, capture_output=True, text=True, check=True)
-        first_public_ip = result.stdout.strip()
-
-        pod_count = int(request.pod_count) if request.pod_count is not None else None
-
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO clusters (
-                cluster_name, platform, instance_count, status, timestamp,
-                deployment_dir, ami, instance_type, data_volume_size,
-                postgresql_version, allowed_ip_1, allowed_ip_2,
-                server_public_ip, pod_count, public_ip_1
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            request.cluster_name, request.platform, request.instance_count,
-            "completed", datetime.utcnow().isoformat(), cluster_dir,
-            request.ami, request.instance_type, request.data_volume_size,
-            request.postgresql_version, request.allowed_ip_1, request.allowed_ip_2,
-            internet_ip, pod_count, first_public_ip
-        ))
 
-        conn.commit()
-        conn.close()
+    job_id = await submit_locked(request.cluster_name, "scale", run_scale, request.cluster_name, target, phases=phases)
+    return {"job_id": job_id, "cluster_name": request.cluster_name, "status": "queued", field: target, "previous": current}
 
-        inventory_path = os.path.join(ansible_dst, "inventory", "inventory.ini")
-        if not os.path.exists(inventory_path):
-            raise HTTPException(status_code=500, detail="Generated inventory not found.")
+# Everything render_cluster_config needs besides the cluster name
+CLUSTER_CONFIG_COLUMNS = (
+    "platform", "instance_count", "pod_count", "postgresql_version", "ami", "instance_type",
+    "data_volume_size", "allowed_ip_1", "allowed_ip_2", "server_public_ip",
+)
+
+def run_scale(job, cluster_name, target):
+    # Runs in a job thread while /scale holds the cluster lock. Node count and node
+    # rows in clusters.db only change once everything else has worked, so a failed
+    # scale can be retried with the same count: terraform and the membership
+    # playbook skip what an earlier attempt already did.
+    row = store.get_cluster(cluster_name, ("deployment_dir", *CLUSTER_CONFIG_COLUMNS))
+    if not row:
+        raise RuntimeError("Cluster not found")
+    cluster = dict(row)
+    deployment_dir = cluster["deployment_dir"]
+    ansible_dir = os.path.join(deployment_dir, "ansible")
+    inventory_file = os.path.join(ansible_dir, "inventory", "inventory.ini")
+    site_playbook = os.path.join(ansible_dir, "site.yml")
+    tf_module_dir = os.path.join(deployment_dir, "terraform", "modules", "postgres_ha")
+    kubernetes = cluster["platform"] == "kubernetes"
+
+    def playbook(*args):
+        asyncio.run(run_playbook(["ansible-playbook", "-i", inventory_file, *args], deployment_dir, log_name=job.job_id))
+
+    with job.phase("render"):
+        # Newer templates carry the tags and membership playbook used below
+        template_version = template_store.snapshot()
+        template_store.link(ansible_dir, template_version)
+        settings = {column: cluster[column] for column in cluster if column != "deployment_dir"}
+        settings["pod_count" if kubernetes else "instance_count"] = target
+        render_cluster_config(
+            os.path.join(tf_module_dir, "terraform.tfvars"),
+            os.path.join(ansible_dir, "group_vars", "all.yml"),
+            cluster_name=cluster_name,
+            **settings,
+        )
+
+    if kubernetes:
+        # One k3s node; the Patroni StatefulSet and HAProxy backends follow pod_count
+        previous = cluster["pod_count"]
+        with job.phase("configure"):
+            playbook(site_playbook, "--tags", "k8s_scale")
+        with job.phase("register"):
+            store.update_cluster(cluster_name, pod_count=target, template_version=template_version)
+            health_cache.invalidate(cluster_name)
+        return {"cluster_name": cluster_name, "pod_count": target, "previous": previous}
+
+    current = cluster["instance_count"]
+    keeper = node_name(cluster_name, 1)
+    joining = [node_name(cluster_name, i) for i in range(current + 1, target + 1)]
+    leaving = [node_name(cluster_name, i) for i in range(target + 1, current + 1)]
+    staying = [node_name(cluster_name, i) for i in range(1, min(current, target) + 1)]
+    leaving_ips = [n["public_ip"] for n in store.list_nodes(cluster_name) if n["node_index"] > target]
+
+    if leaving:
+        with job.phase("leave"):
+            # Stop Patroni and etcd there and drop them from etcd while the hosts are still in the inventory
+            playbook(os.path.join(ansible_dir, "scale_members.yml"), "-e", json.dumps({"etcd_member_host": keeper, "leaving": leaving}))
+
+    with job.phase("terraform_apply"):
+        # Only the instances (and their disk mounts) being added or removed, plus the
+        # inventory; run_ansible would re-run site.yml on every node, so it is left out.
+        # mount_disks pulls in wait_for_instance, whose 300 s sleep is keyed on the
+        # instance id, so only new nodes wait for EC2 init (clusters deployed from
+        # templates before that change still wait on every scale).
+        changed = range(min(current, target), max(current, target))
+        targets = [f"-target=aws_instance.postgres_nodes[{i}]" for i in changed]
+        targets += [f"-target=null_resource.mount_disks[{i}]" for i in changed]
+        targets.append("-target=local_file.ansible_inventory")
+        log_path = cluster_log(deployment_dir, job.job_id)
+        call_with_backoff(
+            lambda: run_streaming(
+                ["terraform", "apply", "-auto-approve", "-input=false", *targets], log_path,
+                cwd=tf_module_dir, env=ansible_env(deployment_dir),
+            ),
+            aws_limiter,
+        )
+
+    with job.phase("describe_instances"):
+        nodes = describe_nodes(terraform_instance_ids(tf_module_dir))
+        if len(nodes) != target:
+            raise RuntimeError(f"Terraform reports {len(nodes)} instances, expected {target}")
+
+    with job.phase("configure"):
+        if joining:
+            playbook(os.path.join(ansible_dir, "scale_members.yml"), "-e", json.dumps({"etcd_member_host": keeper, "joining": joining}))
+            playbook(site_playbook, "--limit", ",".join(joining), "-e", "etcd_initial_cluster_state=existing")
+        # HAProxy backends and Patroni's pg_hba/etcd hosts list every node
+        playbook(site_playbook, "--limit", ",".join(staying), "--tags", "haproxy,patroni_config")
+
+    with job.phase("register"):
+        store.replace_nodes(cluster_name, nodes, instance_count=target, template_version=template_version)
+        if leaving:
+            store.delete_role_fingerprints(cluster_name, leaving)
+        # New nodes got all of site.yml, the others the whole haproxy role
+        record_fingerprints(
+            cluster_name, {**cluster, "instance_count": target}, deployment_dir, template_version,
+            applied={**{host: ["haproxy"] for host in staying}, **{host: list(ROLE_TAGS) for host in joining}},
+        )
+        health_cache.invalidate(cluster_name)
+        pool_registry.invalidate(cluster_name)
+        if leaving_ips:
+            asyncio.run(ssh_mux.close_hosts(leaving_ips))
+
+    return {"cluster_name": cluster_name, "instance_count": target, "previous": current, "nodes": nodes}
 
-    except Exception as e:
-        tf_exec_dir = os.path.join(cluster_dir, "terraform", "modules", "postgres_ha")
-        try:
-            if os.path.exists(tf_exec_dir):
-                subprocess.run(["terraform", "destroy", "-auto-approve"], cwd=tf_exec_dir, check=False)
-        except Exception as tf_err:
-            print(f"Terraform destroy failed during cleanup: {tf_err}")
 
-        shutil.rmtree(cluster_dir, ignore_errors=True)
-        raise HTTPException(status_code=500, detail=f"Provisioning failed: {str(e)}")
+@app.get("/clusters/{cluster_name}/converge/plan")
+def get_converge_plan(cluster_name: str, force: bool = False):
+    # What POST /clusters/{name}/converge would run against the current rendered config
+    row = store.get_cluster(cluster_name, ("deployment_dir", "platform", "instance_count", "pod_count", "template_version"))
+    if not row:
+        raise HTTPException(status_code=404, detail="Cluster not found")
+    current = current_fingerprints(dict(row), row["deployment_dir"], row["template_version"])
+    runs = plan_roles(current, store.role_fingerprints(cluster_name), force=force)
+    planned = {host for hosts, _ in runs for host in hosts}
+    return {
+        "cluster_name": cluster_name,
+        "runs": [{"hosts": hosts, "roles": roles} for hosts, roles in runs],
+        "unchanged_hosts": [host for host in current if host not in planned],
+    }
+
+@app.post("/clusters/{cluster_name}/converge", status_code=202)
+async def converge_cluster(cluster_name: str, request: ConvergeRequest):
+    if not store.get_cluster(cluster_name, ("cluster_name",)):
+        raise HTTPException(status_code=404, detail="Cluster not found")
+    job_id = await submit_locked(
+        cluster_name, "converge", run_converge, cluster_name, request.force, request.upgrade_templates,
+        phases=CONVERGE_PHASES,
+    )
+    return {"job_id": job_id, "cluster_name": cluster_name, "status": "queued"}
+
+def run_converge(job, cluster_name, force, upgrade_templates):
+    # Re-renders the cluster's config and runs site.yml for the roles whose
+    # fingerprint changed, one run per group of hosts needing the same roles
+    row = store.get_cluster(cluster_name, ("deployment_dir", "template_version", *CLUSTER_CONFIG_COLUMNS))
+    if not row:
+        raise RuntimeError("Cluster not found")
+    cluster = dict(row)
+    deployment_dir = cluster["deployment_dir"]
+    ansible_dir = os.path.join(deployment_dir, "ansible")
+    inventory_file = os.path.join(ansible_dir, "inventory", "inventory.ini")
+    template_version = cluster["template_version"]
+
+    with job.phase("render"):
+        if upgrade_templates:
+            template_version = template_store.snapshot()
+            template_store.link(ansible_dir, template_version)
+        render_cluster_config(
+            os.path.join(deployment_dir, "terraform", "modules", "postgres_ha", "terraform.tfvars"),
+            os.path.join(ansible_dir, "group_vars", "all.yml"),
+            cluster_name=cluster_name,
+            **{column: cluster[column] for column in CLUSTER_CONFIG_COLUMNS},
+        )
+
+    with job.phase("plan"):
+        current = current_fingerprints(cluster, deployment_dir, template_version)
+        runs = plan_roles(current, store.role_fingerprints(cluster_name), force=force)
+
+    with job.phase("configure"):
+        for hosts, roles in runs:
+            asyncio.run(run_playbook(
+                ["ansible-playbook", "-i", inventory_file, os.path.join(ansible_dir, "site.yml"),
+                 "--limit", ",".join(hosts), "--tags", ",".join(ROLE_TAGS[role] for role in roles)],
+                deployment_dir, log_name=job.job_id,
+            ))
+            record_fingerprints(cluster_name, cluster, deployment_dir, template_version, applied={host: roles for host in hosts})
+
+    with job.phase("register"):
+        if template_version != cluster["template_version"]:
+            store.update_cluster(cluster_name, template_version=template_version)
+        health_cache.invalidate(cluster_name)
+
+    planned = {host for hosts, _ in runs for host in hosts}
+    return {
+        "cluster_name": cluster_name,
+        "template_version": template_version,
+        "runs": [{"hosts": hosts, "roles": roles} for hosts, roles in runs],
+        "unchanged_hosts": [host for host in current if host not in planned],
+    }
+
+@app.get("/templates")
+def list_template_versions():
+    usage = {row["template_version"]: row["clusters"] for row in store.template_versions()}
+    return {
+        "current": template_store.fingerprint(),
+        "versions": [{"version": v, "clusters": usage.get(v, 0)} for v in template_store.versions()],
+        "unversioned_clusters": usage.get(None, 0),
+    }
+
+@app.post("/clusters/{cluster_name}/templates/upgrade")
+async def upgrade_cluster_templates(cluster_name: str):
+    # Re-links the cluster's ansible directory to the current templates (also converts
+    # clusters that still carry a full copy)
+    row = store.get_cluster(cluster_name, ("deployment_dir", "template_version"))
+    if not row:
+        raise HTTPException(status_code=404, detail="Cluster not found")
+
+    deployment_dir, previous = row
+    # Not while a playbook is reading the directory
+    async with cluster_locks.exclusive(cluster_name, "templates_upgrade"):
+        # Hashing the template tree and relinking are file I/O; keep them off the loop
+        version = await asyncio.to_thread(template_store.snapshot)
+        await asyncio.to_thread(template_store.link, os.path.join(deployment_dir, "ansible"), version)
+        store.update_cluster(cluster_name, template_version=version)
+    return {"cluster_name": cluster_name, "previous_version": previous, "template_version": version}
+
+@app.get("/pools/metrics")
+async def get_pool_metrics():
+    return pool_registry.metrics()
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/ssh/connections")
+def get_ssh_connections():
+    return ssh_mux.stats()
+
+@app.get("/ec2/inventory")
+def get_ec2_inventory():
+    return ec2_inventory.stats()
+
+@app.get("/locks/stats")
+async def get_lock_stats():
+    return cluster_locks.stats()
+
+@app.get("/jobs")
+def list_jobs(cluster_name: str = None, limit: int = 50):
+    return jobs.list(cluster_name=cluster_name, limit=limit)
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/logs")
+def get_job_logs(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    log_path = job_log(job)
+    if not os.path.exists(log_path):
+        raise HTTPException(status_code=404, detail="No log output for this job yet")
+    return FileResponse(log_path, media_type="text/plain")
+
+
+@app.get("/jobs/{job_id}/logs/stream")
+def stream_job_logs(job_id: str, last_event_id: int = Header(0)):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    def is_active():
+        return jobs.get(job_id)["status"] in ACTIVE_STATES
+
+    return StreamingResponse(
+        follow_log(job_log(job), is_active, skip_lines=last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+#### Direct SQL ####
+# With DB_PROVISIONER_DIRECT_SQL=1 (and asyncpg installed) database and user operations
+# talk to the cluster endpoint directly; if it cannot be reached they fall back to Ansible.
+
+async def direct_sql_call(cluster_name, operation, *args, error):
+    if not direct_sql.enabled:
+        raise DirectSQLUnavailable("direct SQL disabled")
+
+    row = store.get_cluster(cluster_name, ("platform",), with_primary_ip=True)
+    if not row:
+        raise HTTPException(status_code=404, detail="Cluster not found")
+
+    host, port = cluster_endpoint(*row)
+    try:
+        return await operation(cluster_name, host, port, *args)
+    except PoolTimeout as e:
+        # Every connection to this cluster is busy; queueing on Ansible would only make it worse
+        raise HTTPException(status_code=503, detail=str(e))
+    except DirectSQLUnavailable as e:
+        print(f"Direct SQL unavailable for {cluster_name}, falling back to Ansible: {e}")
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SQL_ERRORS as e:
+        raise HTTPException(status_code=500, detail=f"{error}: {e}")
 
 
 #### Create Database ####
 @app.post("/create_database")
-def create_database(request: CreateDBRequest):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT deployment_dir, platform FROM clusters WHERE cluster_name=?", (request.cluster_name,))
-    row = cursor.fetchone()
-    conn.close()
+async def create_database(request: CreateDBRequest):
+    async with cluster_locks.exclusive(request.cluster_name, "create_database"):
+        try:
+            await direct_sql_call(request.cluster_name, direct_sql.create_database, request.db_name, error="Failed to create database")
+            return {"message": f"Database '{request.db_name}' created successfully"}
+        except DirectSQLUnavailable:
+            return await create_database_with_ansible(request)
+
+async def create_database_with_ansible(request: CreateDBRequest):
+    row = store.get_cluster(request.cluster_name, ("deployment_dir", "platform"))
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
@@ -320,12 +1305,12 @@ def create_database(request: CreateDBRequest):
             raise HTTPException(status_code=500, detail="Kubernetes create DB playbook not found")
 
         try:
-            subprocess.run([
+            await run_playbook([
                 "ansible-playbook",
                 k8s_playbook, "-i", inventory,
                 "-e", f"db_name={request.db_name}",
                 "-e", f"cluster_name={request.cluster_name}"
-            ], check=True)
+            ], deployment_dir)
             return {"message": f"[Kubernetes] Database '{request.db_name}' created successfully"}
         except subprocess.CalledProcessError as e:
             raise HTTPException(status_code=500, detail=f"[K8s] Failed to create database: {e}")
@@ -338,23 +1323,30 @@ def create_database(request: CreateDBRequest):
             raise HTTPException(status_code=500, detail="create_database.yml not found")
 
         try:
-            subprocess.run([
+            await run_playbook([
                 "ansible-playbook",
                 "-i", inventory,
                 playbook,
                 "-e", f"db_name={request.db_name}"
-            ], check=True)
+            ], deployment_dir)
             return {"message": f"Database '{request.db_name}' created successfully"}
         except subprocess.CalledProcessError as e:
             raise HTTPException(status_code=500, detail=f"Failed to create database: {e}")
 
 @app.get("/clusters/{cluster_name}/databases")
-def list_databases(cluster_name: str):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT deployment_dir, platform FROM clusters WHERE cluster_name=?", (cluster_name,))
-    row = cursor.fetchone()
-    conn.close()
+async def list_databases(cluster_name: str):
+    # Concurrent requests for the same cluster share one query or playbook run
+    return await cluster_locks.coalesce(cluster_name, "list_databases", lambda: fetch_databases(cluster_name))
+
+async def fetch_databases(cluster_name: str):
+    try:
+        rows = await direct_sql_call(cluster_name, direct_sql.list_databases, error="Failed to list databases")
+        return {"databases": [row["name"] for row in rows], "details": rows}
+    except DirectSQLUnavailable:
+        return await list_databases_with_ansible(cluster_name)
+
+async def list_databases_with_ansible(cluster_name: str):
+    row = store.get_cluster(cluster_name, ("deployment_dir", "platform"))
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
@@ -362,41 +1354,44 @@ def list_databases(cluster_name: str):
     deployment_dir, platform = row
     ansible_dir = os.path.join(deployment_dir, "ansible")
 
+    # The debug task that prints the list
     if platform == "kubernetes":
         playbook = os.path.join(ansible_dir, "list_databases_k8s.yml")
         inventory = os.path.join(ansible_dir, "inventory", "inventory.ini")
         cmd = ["ansible-playbook", "-i", inventory, playbook]
+        list_task = "Show database list"
     else:
         inventory = os.path.join(ansible_dir, "inventory", "inventory.ini")
         playbook = os.path.join(ansible_dir, "list_databases.yml")
         cmd = ["ansible-playbook", "-i", inventory, playbook]
+        list_task = "Print for backend"
 
     if not os.path.exists(playbook):
         raise HTTPException(status_code=500, detail="List databases playbook not found")
 
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-
-        
-        match = re.search(r'"msg":\s*\[(.*?)\]', result.stdout, re.DOTALL)
-        if match:
-            db_lines = "[" + match.group(1).strip() + "]"
-            try:
-                databases = json.loads(db_lines)
-                return {"databases": databases}
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=500, detail="Failed to parse database list from playbook output.")
-        return {"databases": []}
+        events = await run_playbook(cmd, deployment_dir)
     except subprocess.CalledProcessError as e:
         raise HTTPException(status_code=500, detail="Failed to list databases: " + e.stderr.strip())
 
+    # Every node reports the same databases; merge in case a replica lags behind
+    databases = {}
+    for result in events.task(list_task).values():
+        if isinstance(result.msg, list):
+            databases.update(dict.fromkeys(name.strip() for name in result.msg if name.strip()))
+    return {"databases": list(databases)}
+
 @app.post("/drop_database")
-def drop_database(request: DropDBRequest):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT deployment_dir, platform FROM clusters WHERE cluster_name=?", (request.cluster_name,))
-    row = cursor.fetchone()
-    conn.close()
+async def drop_database(request: DropDBRequest):
+    async with cluster_locks.exclusive(request.cluster_name, "drop_database"):
+        try:
+            await direct_sql_call(request.cluster_name, direct_sql.drop_database, request.db_name, error="Failed to drop database")
+            return {"message": f"Database '{request.db_name}' dropped successfully"}
+        except DirectSQLUnavailable:
+            return await drop_database_with_ansible(request)
+
+async def drop_database_with_ansible(request: DropDBRequest):
+    row = store.get_cluster(request.cluster_name, ("deployment_dir", "platform"))
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
@@ -410,12 +1405,12 @@ def drop_database(request: DropDBRequest):
         if not os.path.exists(k8s_playbook):
             raise HTTPException(status_code=500, detail="drop_database_k8s.yml not found")
         try:
-            subprocess.run([
+            await run_playbook([
                 "ansible-playbook",
                 k8s_playbook,
                 "-i", inventory,
                 "-e", f"db_name={request.db_name}"
-            ], check=True)
+            ], deployment_dir)
             return {"message": f"[K8s] Database '{request.db_name}' dropped successfully"}
         except subprocess.CalledProcessError:
             raise HTTPException(status_code=500, detail="[K8s] Failed to drop database")
@@ -427,23 +1422,25 @@ def drop_database(request: DropDBRequest):
             raise HTTPException(status_code=500, detail="Ansible drop_database.yml not found")
 
         try:
-            subprocess.run([
+            await run_playbook([
                 "ansible-playbook",
                 "-i", inventory,
                 playbook,
                 "-e", f"db_name={request.db_name}"
-            ], check=True)
+            ], deployment_dir)
             return {"message": f"Database '{request.db_name}' dropped successfully"}
         except subprocess.CalledProcessError:
             raise HTTPException(status_code=500, detail="Failed to drop database")
 
 @app.post("/decommission")
-def decommission_standalone(request: DecommissionRequest):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT instance_count, deployment_dir, platform FROM clusters WHERE cluster_name=?", (request.cluster_name,))
-    row = cursor.fetchone()
-    conn.close()
+async def decommission_standalone(request: DecommissionRequest):
+    async with cluster_locks.exclusive(request.cluster_name, "decommission"):
+        result = await decommission_standalone_locked(request)
+    cluster_locks.forget(request.cluster_name)
+    return result
+
+async def decommission_standalone_locked(request: DecommissionRequest):
+    row = await asyncio.to_thread(store.get_cluster, request.cluster_name, ("instance_count", "deployment_dir", "platform"))
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
@@ -452,6 +1449,7 @@ def decommission_standalone(request: DecommissionRequest):
 
     instance_count, deployment_dir, platform = row
     ansible_dir = os.path.join(deployment_dir, "ansible")
+    ssh_hosts = inventory_hosts(os.path.join(ansible_dir, "inventory", "inventory.ini"))
 
     if platform == "kubernetes":
         try:
@@ -461,15 +1459,14 @@ def decommission_standalone(request: DecommissionRequest):
             
             ###Run cleanup
             if os.path.exists(k8s_cleanup):
-                subprocess.run(["ansible-playbook","-i", inventory, k8s_cleanup], check=True)
+                await run_playbook(["ansible-playbook","-i", inventory, k8s_cleanup], deployment_dir)
 
-            shutil.rmtree(deployment_dir, ignore_errors=True)
+            await asyncio.to_thread(shutil.rmtree, deployment_dir, ignore_errors=True)
 
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM clusters WHERE cluster_name=?", (request.cluster_name,))
-            conn.commit()
-            conn.close()
+            await asyncio.to_thread(store.delete_cluster, request.cluster_name)
+            health_cache.invalidate(request.cluster_name)
+            pool_registry.invalidate(request.cluster_name)
+            await ssh_mux.close_hosts(ssh_hosts)
 
             return {"message": f"Kubernetes cluster '{request.cluster_name}' decommissioned successfully"}
         except subprocess.CalledProcessError as e:
@@ -483,26 +1480,33 @@ def decommission_standalone(request: DecommissionRequest):
             raise HTTPException(status_code=500, detail="Terraform path not found")
 
         try:
-            subprocess.run(["terraform", "destroy", "-auto-approve"], cwd=tf_exec_dir, check=True)
-            shutil.rmtree(deployment_dir, ignore_errors=True)
+            await run_async(["terraform", "destroy", "-auto-approve"], cluster_log(deployment_dir), cwd=tf_exec_dir, timeout=TERRAFORM_TIMEOUT)
+            await asyncio.to_thread(shutil.rmtree, deployment_dir, ignore_errors=True)
 
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM clusters WHERE cluster_name=?", (request.cluster_name,))
-            conn.commit()
-            conn.close()
+            await asyncio.to_thread(store.delete_cluster, request.cluster_name)
+            health_cache.invalidate(request.cluster_name)
+            pool_registry.invalidate(request.cluster_name)
+            await ssh_mux.close_hosts(ssh_hosts)
 
             return {"message": f"Cluster '{request.cluster_name}' decommissioned successfully"}
         except subprocess.CalledProcessError as e:
             raise HTTPException(status_code=500, detail="Terraform destroy failed")
 
 @app.post("/add_user")
-def add_user(request: AddUserRequest):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT deployment_dir, platform FROM clusters WHERE cluster_name=?", (request.cluster_name,))
-    row = cursor.fetchone()
-    conn.close()
+async def add_user(request: AddUserRequest):
+    async with cluster_locks.exclusive(request.cluster_name, "add_user"):
+        try:
+            await direct_sql_call(
+                request.cluster_name, direct_sql.create_user,
+                request.database, request.username, request.password, request.roles,
+                error="Failed to add user"
+            )
+            return {"message": f"User '{request.username}' added successfully"}
+        except DirectSQLUnavailable:
+            return await add_user_with_ansible(request)
+
+async def add_user_with_ansible(request: AddUserRequest):
+    row = store.get_cluster(request.cluster_name, ("deployment_dir", "platform"))
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
@@ -526,24 +1530,28 @@ def add_user(request: AddUserRequest):
     cmd += [
         playbook,
         "-e", f"db_user={request.username}",
-        "-e", f"db_pass={request.password}",
         "-e", f"db_roles={','.join(request.roles)}",
         "-e", f"db_name={request.database}"
     ]
 
     try:
-        subprocess.run(cmd, check=True)
+        with private_vars_file(ansible_dir, {"db_pass": request.password}) as vars_file:
+            await run_playbook(cmd + ["-e", f"@{vars_file}"], deployment_dir)
         return {"message": f"User '{request.username}' added successfully"}
     except subprocess.CalledProcessError:
         raise HTTPException(status_code=500, detail="Failed to add user")
 
 @app.post("/remove_user")
-def remove_user(request: RemoveUserRequest):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT deployment_dir, platform FROM clusters WHERE cluster_name=?", (request.cluster_name,))
-    row = cursor.fetchone()
-    conn.close()
+async def remove_user(request: RemoveUserRequest):
+    async with cluster_locks.exclusive(request.cluster_name, "remove_user"):
+        try:
+            await direct_sql_call(request.cluster_name, direct_sql.drop_user, request.username, error="Failed to remove user")
+            return {"message": f"User '{request.username}' removed successfully"}
+        except DirectSQLUnavailable:
+            return await remove_user_with_ansible(request)
+
+async def remove_user_with_ansible(request: RemoveUserRequest):
+    row = store.get_cluster(request.cluster_name, ("deployment_dir", "platform"))
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
@@ -570,43 +1578,142 @@ def remove_user(request: RemoveUserRequest):
     ]
 
     try:
-        subprocess.run(cmd, check=True)
+        await run_playbook(cmd, deployment_dir)
         return {"message": f"User '{request.username}' removed successfully"}
     except subprocess.CalledProcessError:
         raise HTTPException(status_code=500, detail="Failed to remove user")
 
 
+#### Bulk Databases and Users ####
+# A whole batch goes through one SQL session, or one ansible-playbook run when direct
+# SQL is unavailable, and every item gets its own result.
+
+@app.post("/clusters/{cluster_name}/databases/bulk")
+async def create_databases_bulk(cluster_name: str, request: BulkDatabasesRequest):
+    db_names = list(dict.fromkeys(request.databases))
+    if not db_names:
+        raise HTTPException(status_code=400, detail="No databases given")
+
+    async with cluster_locks.exclusive(cluster_name, "create_databases_bulk"):
+        try:
+            results = await direct_sql_call(cluster_name, direct_sql.create_databases, db_names, error="Failed to create databases")
+        except DirectSQLUnavailable:
+            results = await create_databases_bulk_with_ansible(cluster_name, db_names)
+    return bulk_summary(results)
+
+async def create_databases_bulk_with_ansible(cluster_name, db_names):
+    outcome = await run_bulk_playbook(cluster_name, "create_databases_bulk", {"databases": db_names}, {
+        "Create databases": len(db_names),
+    })
+    return [{"name": name, **result} for name, result in zip(db_names, outcome["Create databases"])]
+
+@app.post("/clusters/{cluster_name}/users/bulk")
+async def apply_users_bulk(cluster_name: str, request: BulkUsersRequest):
+    users = [{"username": u.username, "password": u.password, "roles": u.roles} for u in request.users]
+    grants = [{"username": g.username, "database": g.database, "privileges": g.privileges} for g in request.grants]
+    if not users and not grants:
+        raise HTTPException(status_code=400, detail="No users or grants given")
+
+    async with cluster_locks.exclusive(cluster_name, "apply_users_bulk"):
+        try:
+            results = await direct_sql_call(cluster_name, direct_sql.apply_users, users, grants, error="Failed to apply users")
+        except DirectSQLUnavailable:
+            results = await apply_users_bulk_with_ansible(cluster_name, users, grants)
+    return bulk_summary(results)
+
+async def apply_users_bulk_with_ansible(cluster_name, users, grants):
+    try:
+        for user in users:
+            user["roles"] = role_options(user["roles"])
+        for grant in grants:
+            grant["privileges"] = grant_privileges(grant["privileges"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    outcome = await run_bulk_playbook(cluster_name, "manage_users_bulk", {"users": users, "grants": grants}, {
+        "Create users": len(users),
+        "Grant database privileges": len(grants),
+    })
+    results = [
+        {"kind": "user", "name": user["username"], **result}
+        for user, result in zip(users, outcome["Create users"])
+    ]
+    for grant, result in zip(grants, outcome["Grant database privileges"]):
+        if result["status"] in ("created", "exists"):
+            result["status"] = "granted"
+        results.append({"kind": "grant", "name": f"{grant['username']}@{grant['database']}", **result})
+    return results
+
+def bulk_summary(results):
+    summary = {}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    return {"results": results, "summary": summary}
+
+async def run_bulk_playbook(cluster_name, playbook_name, extra_vars, tasks):
+    # tasks: {looped task name: item count}. Returns {task name: [result per item]}.
+    row = store.get_cluster(cluster_name, ("deployment_dir", "platform"))
+    if not row:
+        raise HTTPException(status_code=404, detail="Cluster not found")
+
+    deployment_dir, platform = row
+    ansible_dir = os.path.join(deployment_dir, "ansible")
+    inventory = os.path.join(ansible_dir, "inventory", "inventory.ini")
+    if platform == "kubernetes":
+        playbook_name += "_k8s"
+    playbook = os.path.join(ansible_dir, f"{playbook_name}.yml")
+    if not os.path.exists(playbook):
+        # Clusters deployed before the bulk playbooks existed
+        shutil.copy2(os.path.join(TEMPLATE_DIR, "ansible", f"{playbook_name}.yml"), playbook)
+
+    with private_vars_file(ansible_dir, extra_vars) as vars_file:
+        events = await run_playbook(
+            ["ansible-playbook", "-i", inventory, playbook, "-e", f"@{vars_file}"],
+            deployment_dir,
+            check=False,
+        )
+
+    if events.returncode != 0 and not any(events.task(name) for name in tasks):
+        # Failed before reaching the looped tasks (unreachable hosts, bad inventory, ...)
+        raise HTTPException(status_code=500, detail=f"{playbook_name} failed (exit status {events.returncode}): {events.error()}")
+    return {name: loop_results(events, name, count) for name, count in tasks.items()}
+
+
 @app.get("/standalone_clusters")
-def list_standalone_clusters():
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT cluster_name, status, timestamp, platform 
-        FROM clusters 
-        WHERE instance_count = 1
-    """)
-    rows = cursor.fetchall()
-    conn.close()
-    return [{"name": name, "status": status, "timestamp": ts, "platform": platform} for name, status, ts, platform in rows]
-
-
-def is_ec2_server_running(inventory_file: str) -> bool:
+def list_standalone_clusters(
+    request: Request,
+    platform: str = None,
+    status: str = None,
+    version: str = None,
+    created_after: datetime = None,
+    cursor: str = None,
+    limit: int = CLUSTER_PAGE_SIZE,
+    order: str = "asc",
+    if_none_match: str = Header(None),
+):
+    return list_clusters_page(
+        request, if_none_match, True, cursor, limit, order,
+        platform=platform, status=status, postgresql_version=version, created_after=created_after,
+    )
+
+
+async def is_ec2_server_running(inventory_file: str) -> bool:
     try:
-        result = subprocess.run(
+        result = await run_async(
             ["ansible", "-i", inventory_file, "all", "-m", "ping"],
-            capture_output=True, text=True, check=True
+            env=ssh_mux.env(), timeout=PLAYBOOK_TIMEOUT, capture_limit=64 * 1024
         )
-        return "SUCCESS" in result.stdout
+        return "SUCCESS" in result.output
     except subprocess.CalledProcessError:
         return False
 
 @app.post("/stop")
-def stop_cluster(request: StopRequest):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT deployment_dir, platform FROM clusters WHERE cluster_name=?", (request.cluster_name,))
-    row = cursor.fetchone()
-    conn.close()
+async def stop_cluster(request: StopRequest):
+    async with cluster_locks.exclusive(request.cluster_name, "stop"):
+        return await stop_cluster_locked(request)
+
+async def stop_cluster_locked(request: StopRequest):
+    row = await asyncio.to_thread(store.get_cluster, request.cluster_name, ("deployment_dir", "platform"))
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
@@ -624,7 +1731,7 @@ def stop_cluster(request: StopRequest):
 
             k8s_stop_pod = os.path.join(ansible_dir, "stop_postgres_pod.yml")
             if os.path.exists(k8s_stop_pod):
-                subprocess.run(["ansible-playbook","-i", inventory_file, k8s_stop_pod], check=True)
+                await run_playbook(["ansible-playbook","-i", inventory_file, k8s_stop_pod], deployment_dir)
                 messages.append("PostgreSQL pod stopped.")
             else:
                 messages.append("Pod stop playbook not found.")
@@ -633,7 +1740,8 @@ def stop_cluster(request: StopRequest):
             if request.stop_server:
                 stop_server_playbook = os.path.join(ansible_dir, "stop_server.yml")
                 if os.path.exists(stop_server_playbook):
-                    subprocess.run(["ansible-playbook", "-i", inventory_file, stop_server_playbook], check=True)
+                    await run_playbook(["ansible-playbook", "-i", inventory_file, stop_server_playbook], deployment_dir)
+                    await asyncio.to_thread(forget_instances, request.cluster_name)
                     messages.append("EC2 server stopped.")
                 else:
                     messages.append("Server stop playbook not found.")
@@ -645,7 +1753,7 @@ def stop_cluster(request: StopRequest):
 
             stop_pg_playbook = os.path.join(ansible_dir, "stop_instance.yml")
             if os.path.exists(stop_pg_playbook):
-                subprocess.run(["ansible-playbook", "-i", inventory_file, stop_pg_playbook], check=True)
+                await run_playbook(["ansible-playbook", "-i", inventory_file, stop_pg_playbook], deployment_dir)
                 messages.append("PostgreSQL service stopped.")
             else:
                 messages.append("PostgreSQL service stop playbook not found.")
@@ -654,31 +1762,51 @@ def stop_cluster(request: StopRequest):
             if request.stop_server:
                 stop_server_playbook = os.path.join(ansible_dir, "stop_server.yml")
                 if os.path.exists(stop_server_playbook):
-                    subprocess.run(["ansible-playbook", "-i", inventory_file, stop_server_playbook], check=True)
+                    await run_playbook(["ansible-playbook", "-i", inventory_file, stop_server_playbook], deployment_dir)
+                    await asyncio.to_thread(forget_instances, request.cluster_name)
                     messages.append("EC2 server stopped.")
                 else:
                     messages.append("Server stop playbook not found.")
 
+        health_cache.invalidate(request.cluster_name)
+        pool_registry.invalidate(request.cluster_name)
         return {"message": " | ".join(messages) if messages else "No actions performed."}
 
     except subprocess.CalledProcessError as e:
         raise HTTPException(status_code=500, detail=f"Stop operation failed: {str(e)}")
 
+def set_inventory_host(inventory_file, cluster_tag, new_ip):
+    # Update ansible_host IP in inventory.ini
+    with open(inventory_file, "r") as f:
+        lines = f.readlines()
+
+    with open(inventory_file, "w") as f:
+        updated = False
+        for line in lines:
+            if f"{cluster_tag}-node-1" in line and "ansible_host=" in line:
+                # Use regex to replace the ansible_host IP only
+                new_line = re.sub(r"(ansible_host=)(\S+)", f"\\g<1>{new_ip}", line)
+                f.write(new_line)
+                updated = True
+            else:
+                f.write(line)
+        if not updated:
+            f.write(f"{cluster_tag}-node-1 ansible_host={new_ip} ansible_user=rocky ansible_ssh_private_key_file=~/.ssh/ha-postgres-key\n")
+
 @app.post("/start")
-def start_cluster(request: StartRequest):
-    import subprocess
-    import re
+async def start_cluster(request: StartRequest):
+    async with cluster_locks.exclusive(request.cluster_name, "start"):
+        return await start_cluster_locked(request)
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT deployment_dir, platform, public_ip_1, cluster_name FROM clusters WHERE cluster_name=?", (request.cluster_name,))
-    row = cursor.fetchone()
-    conn.close()
+async def start_cluster_locked(request: StartRequest):
+    row = await asyncio.to_thread(
+        store.get_cluster, request.cluster_name, ("deployment_dir", "platform", "cluster_name"), with_primary_ip=True
+    )
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
 
-    deployment_dir, platform, old_ip, cluster_tag = row
+    deployment_dir, platform, cluster_tag, old_ip = row
     ansible_dir = os.path.join(deployment_dir, "ansible")
     inventory_file = os.path.join(ansible_dir, "inventory", "inventory.ini")
     messages = []
@@ -687,152 +1815,179 @@ def start_cluster(request: StartRequest):
         # start ec2 server
         start_server_playbook = os.path.join(ansible_dir, "start_server.yml")
         if os.path.exists(start_server_playbook):
-            subprocess.run(["ansible-playbook", "-i", inventory_file, start_server_playbook], check=True)
+            await run_playbook(["ansible-playbook", "-i", inventory_file, start_server_playbook], deployment_dir)
             messages.append("EC2 server started.")
         else:
             raise HTTPException(status_code=500, detail="start_server.yml not found.")
 
-        # Get updated IP using AWS CLI
-        aws_cmd = [
-            "aws", "ec2", "describe-instances",
-            "--filters", f"Name=tag:Name,Values={cluster_tag}-node-1",
-            "--query", "Reservations[*].Instances[*].PublicIpAddress",
-            "--output", "text"
-        ]
-        new_ip = subprocess.check_output(aws_cmd, text=True).strip()
-
-        # Update ansible_host IP in inventory.ini
-        with open(inventory_file, "r") as f:
-            lines = f.readlines()
-
-        with open(inventory_file, "w") as f:
-            updated = False
-            for line in lines:
-                if f"{cluster_tag}-node-1" in line and "ansible_host=" in line:
-                    # Use regex to replace the ansible_host IP only
-                    new_line = re.sub(r"(ansible_host=)(\S+)", f"\\1{new_ip}", line)
-                    f.write(new_line)
-                    updated = True
-                else:
-                    f.write(line)
-            if not updated:
-                f.write(f"{cluster_tag}-node-1 ansible_host={new_ip} ansible_user=rocky ansible_ssh_private_key_file=~/.ssh/ha-postgres-key\n")
-
+        # Get the new public IP; concurrent starts share one describe call
+        await asyncio.to_thread(forget_instances, request.cluster_name)
+        nodes = await asyncio.to_thread(store.list_nodes, request.cluster_name)
+        first_node = next((node for node in nodes if node["node_index"] == 1), None)
+        instance = await asyncio.to_thread(
+            lookup_node, cluster_tag, 1, first_node["instance_id"] if first_node else None
+        )
+        new_ip = (instance or {}).get("public_ip")
+        if not new_ip:
+            raise HTTPException(status_code=500, detail=f"No public IP found for {cluster_tag}-node-1")
 
+        await asyncio.to_thread(set_inventory_host, inventory_file, cluster_tag, new_ip)
 
         # Step 4: Update database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE clusters
-            SET public_ip_1=?
-            WHERE cluster_name=?
-        """, (new_ip, request.cluster_name))
-        conn.commit()
-        conn.close()
+        await asyncio.to_thread(store.update_node, request.cluster_name, 1, public_ip=new_ip)
+        if old_ip and old_ip != new_ip:
+            # The old address can go to another instance; don't keep a master to it
+            await ssh_mux.close_host(old_ip)
+        # Re-gathered by the first play below
+        await asyncio.to_thread(clear_fact_cache, deployment_dir)
 
         # Step 5: Start PostgreSQL
         if platform == "kubernetes":
             pod_playbook = os.path.join(ansible_dir, "start_postgres_pod.yml")
             if os.path.exists(pod_playbook):
-                subprocess.run(["ansible-playbook", "-i", inventory_file, pod_playbook], check=True)
+                await run_playbook(["ansible-playbook", "-i", inventory_file, pod_playbook], deployment_dir)
                 messages.append("PostgreSQL pod started.")
             else:
                 raise HTTPException(status_code=500, detail="start_postgres_pod.yml not found.")
         else:
             service_playbook = os.path.join(ansible_dir, "start_instance.yml")
             if os.path.exists(service_playbook):
-                subprocess.run(["ansible-playbook", "-i", inventory_file, service_playbook], check=True)
+                await run_playbook(["ansible-playbook", "-i", inventory_file, service_playbook], deployment_dir)
                 messages.append("PostgreSQL service started.")
             else:
                 raise HTTPException(status_code=500, detail="start_instance.yml not found.")
 
+        health_cache.invalidate(request.cluster_name)
+        pool_registry.invalidate(request.cluster_name)
         return {"message": " | ".join(messages)}
 
     except subprocess.CalledProcessError as e:
         raise HTTPException(status_code=500, detail=f"Start operation failed: {str(e)}")
 
+STATUS_COLUMNS = (
+    "cluster_name", "platform", "status", "instance_count", "pod_count",
+    "postgresql_version", "deployment_dir", "timestamp",
+)
+
 @app.get("/status/{cluster_name}")
-def get_cluster_status(cluster_name: str):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM clusters WHERE cluster_name = ?", (cluster_name,))
-    row = cursor.fetchone()
-    columns = [col[0] for col in cursor.description]
-    conn.close()
+async def get_cluster_status(cluster_name: str, refresh: bool = False):
+    row = store.get_cluster(cluster_name, STATUS_COLUMNS)
 
     if not row:
         raise HTTPException(status_code=404, detail="Cluster not found")
 
-    cluster = dict(zip(columns, row))
-    deployment_dir = cluster["deployment_dir"]
-    platform = cluster["platform"]
-    ansible_dir = os.path.join(deployment_dir, "ansible")
+    cluster = dict(row)
+    cluster["nodes"] = [dict(node) for node in store.list_nodes(cluster_name)]
 
-    def remove_warnings(output: str) -> str:
-        return "\n".join(
-            line for line in output.splitlines()
-            if not line.strip().startswith("[WARNING]")
-        )
+    entry, stale = await health_cache.get(cluster_name, force=refresh)
+    cluster.update(entry.value)
+    cluster["checked_at"] = entry.checked_at.isoformat()
+    cluster["age_seconds"] = round(entry.age(), 3)
+    cluster["stale"] = stale
+    return cluster
 
-    if platform == "kubernetes":
-        check_playbook = os.path.join(ansible_dir, "check_postgres_status_k8s.yml")
-        inventory_file = os.path.join(ansible_dir, "inventory", "inventory.ini")
 
-        if not os.path.exists(check_playbook) or not os.path.exists(inventory_file):
-            cluster["is_running"] = "unknown"
-            return cluster
+@app.get("/status")
+async def get_fleet_status(platform: str = None, refresh: bool = False):
+    names = [row["cluster_name"] for row in store.list_clusters() if platform in (None, row["platform"])]
+    return StreamingResponse(stream_fleet_status(names, refresh), media_type="application/json")
 
-        try:
-            result = subprocess.run(
-                ["ansible-playbook", "-i", inventory_file, check_playbook],
-                capture_output=True,
-                text=True
-            )
-            clean_stdout = remove_warnings(result.stdout)
-            match = re.search(r'db_status=([a-zA-Z]+)', clean_stdout)
-            if match:
-                cluster["is_running"] = match.group(1).lower()
-            else:
-                cluster["is_running"] = "unknown"
 
-            if result.returncode != 0:
-                cluster["ansible_error"] = result.stderr.strip() or clean_stdout.strip() or "K8s status playbook failed"
+@app.post("/status/batch")
+async def get_batch_status(request: StatusBatchRequest):
+    return StreamingResponse(stream_fleet_status(request.cluster_names, request.refresh), media_type="application/json")
 
-        except Exception as e:
-            cluster["is_running"] = "error"
-            cluster["ansible_error"] = str(e)
 
+async def stream_fleet_status(cluster_names, refresh):
+    # Emits a JSON array one element at a time, in the order the probes finish,
+    # so a slow host only delays its own entry.
+    yield "["
+    separator = ""
+    known = []
+    for cluster_name in dict.fromkeys(cluster_names):
+        if store.get_cluster(cluster_name, ("id",)):
+            known.append(cluster_name)
+        else:
+            yield separator + json.dumps({"cluster_name": cluster_name, "error": "Cluster not found"})
+            separator = ","
+
+    async for cluster_name, entry, stale in health_cache.get_many(known, force=refresh):
+        item = {
+            "cluster_name": cluster_name,
+            **entry.value,
+            "checked_at": entry.checked_at.isoformat(),
+            "age_seconds": round(entry.age(), 3),
+            "stale": stale,
+        }
+        yield separator + json.dumps(item)
+        separator = ","
+    yield "]"
+
+
+async def probe_cluster_status(cluster_name: str):
+    # Runs the status playbook; called by the health cache, never directly by a request
+    row = store.get_cluster(cluster_name, ("deployment_dir", "platform"))
+    if not row:
+        return {"is_running": "unknown", "ansible_error": "Cluster not found"}
+
+    deployment_dir, platform = row
+    ansible_dir = os.path.join(deployment_dir, "ansible")
+    inventory_file = os.path.join(ansible_dir, "inventory", "inventory.ini")
+
+    # The fact each node's status is read from
+    if platform == "kubernetes":
+        check_playbook = os.path.join(ansible_dir, "check_postgres_status_k8s.yml")
+        status_fact = "db_status"
+        if not os.path.exists(check_playbook) or not os.path.exists(inventory_file):
+            return {"is_running": "unknown"}
     else:
-        inventory_file = os.path.join(ansible_dir, "inventory", "inventory.ini")
         check_playbook = os.path.join(ansible_dir, "check_postgres_status.yml")
-
+        status_fact = "is_running"
         if not os.path.exists(check_playbook):
-            cluster["is_running"] = "unknown"
-            return cluster
+            return {"is_running": "unknown"}
 
-        try:
-            result = subprocess.run(
-                ["ansible-playbook", "-i", inventory_file, check_playbook],
-                capture_output=True,
-                text=True
-            )
-            clean_stdout = remove_warnings(result.stdout)
-            clean_stderr = remove_warnings(result.stderr)
-            stdout_lower = clean_stdout.lower()
-
-            if "is_running=true" in stdout_lower:
-                cluster["is_running"] = True
-            elif "is_running=false" in stdout_lower:
-                cluster["is_running"] = False
-            else:
-                cluster["is_running"] = "unknown"
+    try:
+        events = await run_playbook(
+            ["ansible-playbook", "-i", inventory_file, check_playbook],
+            deployment_dir, log_name="status",
+            check=False,
+        )
+    except Exception as e:
+        return {"is_running": "error", "ansible_error": str(e)}
+
+    node_status = []
+    values = events.facts(status_fact)
+    for host in sorted(events.hosts()):
+        node = {"host": host}
+        if host in values:
+            value = str(values[host]).lower()
+            node["is_running"] = value == "true" if status_fact == "is_running" else value
+        else:
+            failed = [r for r in events.results if r.host == host and r.status in ("failed", "unreachable")]
+            node["is_running"] = "unreachable" if any(r.status == "unreachable" for r in failed) else "unknown"
+            if failed:
+                node["error"] = failed[0].error()
+        node_status.append(node)
+
+    states = {node["is_running"] for node in node_status}
+    if not states:
+        is_running = "unknown"
+    elif len(states) == 1:
+        is_running = states.pop()
+    else:
+        # Nodes disagree, e.g. a replica is down; node_status says which
+        is_running = "partial"
 
-            if result.returncode != 0:
-                cluster["ansible_error"] = clean_stderr.strip() or clean_stdout.strip() or "Playbook failed"
+    cluster = {"is_running": is_running, "node_status": node_status}
+    if events.returncode != 0:
+        cluster["ansible_error"] = events.error()
+    return cluster
 
-        except Exception as e:
-            cluster["is_running"] = "error"
-            cluster["ansible_error"] = str(e)
 
-    return cluster
+health_cache = HealthCache(
+    probe_cluster_status,
+    ttl=float(os.environ.get("DB_PROVISIONER_HEALTH_TTL", "30")),
+    max_stale=float(os.environ.get("DB_PROVISIONER_HEALTH_MAX_STALE", "300")),
+    # Also the fan-out width of /status and /status/batch; each probe is one ansible-playbook process
+    concurrency=int(os.environ.get("DB_PROVISIONER_HEALTH_CONCURRENCY", "32")),
+)
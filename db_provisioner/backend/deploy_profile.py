@@ -0,0 +1,90 @@
+import math
+import re
+from datetime import datetime
+
+ANSI = re.compile(r"\x1b\[[0-9;]*m")
+# "aws_instance.postgres_nodes[0]: Creating..." / "...: Creation complete after 12s [id=...]"
+TF_START = re.compile(r"^([\w.-]+?)(?:\[[^\]]*\])?: (?:Creating|Modifying|Destroying)\.\.\.")
+TF_DONE = re.compile(r"^([\w.-]+?)(?:\[[^\]]*\])?: (?:Creation|Modifications|Destruction) complete after")
+# Default ansible callback, as printed by the run_ansible local-exec provisioner
+ANSIBLE_TASK = re.compile(r"\b(?:TASK|RUNNING HANDLER) \[([^\]]*)\]")
+ANSIBLE_BOUNDARY = re.compile(r"\bPLAY (?:\[|RECAP)")
+
+ANSIBLE_PARENT = "null_resource.run_ansible"
+
+
+class DeployProfiler:
+    # Turns terraform apply output into timeline spans while it streams past:
+    #
+    # - one span per terraform resource, from its first "Creating..." to its last
+    #   "complete" line (mount_disks[0..n] run in parallel and make one span)
+    # - one span per ansible role in site.yml, the time between its TASK headers and
+    #   the next header, summed over all of the role's tasks; tasks outside a role are
+    #   grouped as "gather_facts" and "tasks"
+    #
+    # Times are when the lines arrived, so they include terraform's output buffering.
+    def __init__(self):
+        self._resources = {}  # address -> [started, finished]
+        self._roles = {}  # role -> [started, seconds]
+        self._task = None  # (role, started)
+
+    def feed(self, line):
+        now = datetime.utcnow()
+        line = ANSI.sub("", line).strip()
+
+        match = TF_START.match(line)
+        if match:
+            self._resources.setdefault(match.group(1), [now, None])
+            return
+        match = TF_DONE.match(line)
+        if match:
+            self._resources.setdefault(match.group(1), [now, None])[1] = now
+            return
+
+        match = ANSIBLE_TASK.search(line)
+        if match:
+            self._close_task(now)
+            name = match.group(1)
+            if " : " in name:
+                role = name.split(" : ", 1)[0].strip()
+            else:
+                role = "gather_facts" if name == "Gathering Facts" else "tasks"
+            self._task = (role, now)
+        elif ANSIBLE_BOUNDARY.search(line):
+            self._close_task(now)
+
+    def _close_task(self, now):
+        if self._task:
+            role, started = self._task
+            entry = self._roles.setdefault(role, [started, 0.0])
+            entry[1] += (now - started).total_seconds()
+            self._task = None
+
+    def spans(self, parent):
+        # [{"phase", "parent", "started_at", "duration"}]; resources that never
+        # finished (failed applies) are left out
+        self._close_task(datetime.utcnow())
+        spans = []
+        for address, (started, finished) in self._resources.items():
+            if finished:
+                spans.append(_span(address, parent, started, (finished - started).total_seconds()))
+        for role, (started, seconds) in self._roles.items():
+            spans.append(_span(f"ansible:{role}", ANSIBLE_PARENT, started, seconds))
+        return sorted(spans, key=lambda span: span["started_at"])
+
+
+def _span(phase, parent, started, duration):
+    return {"phase": phase, "parent": parent, "started_at": started.isoformat(), "duration": round(duration, 3)}
+
+
+def job_spans(phases):
+    # The job's own phases (JobContext.phases), finished ones only
+    return [
+        {"phase": p["name"], "parent": None, "started_at": p["started_at"], "duration": p["duration"]}
+        for p in phases if p["duration"] is not None
+    ]
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an ascending list
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
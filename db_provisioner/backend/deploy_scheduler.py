@@ -0,0 +1,129 @@
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from jobs import ACTIVE_STATES
+
+
+class DeployScheduler:
+    # Runs batches of jobs under a global concurrency limit and per-platform limits.
+    #
+    # Batches take turns (round robin), so a large batch cannot hold back one submitted
+    # after it. Within a batch items start in order, except that an item whose
+    # platform is at its limit is passed over for the next one that can start.
+    def __init__(self, jobs, max_concurrent=10, platform_limits=None):
+        self.jobs = jobs
+        self.max_concurrent = max_concurrent
+        self.platform_limits = platform_limits or {}
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="batch")
+        self._lock = threading.Lock()
+        self._queues = OrderedDict()  # batch_id -> deque of pending items, next turn first
+        self._running = {}  # platform -> running jobs
+        self._total_running = 0
+
+    def submit_batch(self, kind, items, phases=()):
+        # items: (cluster_name, platform, fn, args). Returns (batch_id, job ids in item order).
+        batch_id = uuid.uuid4().hex
+        pending = deque()
+        for cluster_name, platform, fn, args in items:
+            job_id = self.jobs.create(kind, cluster_name, batch_id=batch_id)
+            pending.append((job_id, platform, fn, args, phases))
+        job_ids = [item[0] for item in pending]
+
+        with self._lock:
+            self._queues[batch_id] = pending
+            self._dispatch()
+        return batch_id, job_ids
+
+    def _limit(self, platform):
+        return self.platform_limits.get(platform, self.max_concurrent)
+
+    def _dispatch(self):
+        # Called with the lock held: start jobs until a limit is hit or nothing can start
+        while self._total_running < self.max_concurrent:
+            for batch_id, pending in self._queues.items():
+                item = self._take_startable(pending)
+                if item is None:
+                    continue
+                if pending:
+                    self._queues.move_to_end(batch_id)
+                else:
+                    del self._queues[batch_id]
+                self._start(item)
+                break
+            else:
+                return
+
+    def _take_startable(self, pending):
+        for item in pending:
+            platform = item[1]
+            if self._running.get(platform, 0) < self._limit(platform):
+                pending.remove(item)
+                return item
+        return None
+
+    def _start(self, item):
+        job_id, platform, fn, args, phases = item
+        self._running[platform] = self._running.get(platform, 0) + 1
+        self._total_running += 1
+        self.jobs.start(
+            job_id, fn, *args, phases=phases, executor=self.executor,
+            on_done=lambda _: self._finished(platform),
+        )
+
+    def _finished(self, platform):
+        with self._lock:
+            self._running[platform] -= 1
+            self._total_running -= 1
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "platform_limits": self.platform_limits,
+                "running": self._total_running,
+                "running_by_platform": {p: n for p, n in self._running.items() if n},
+                "queued": sum(len(pending) for pending in self._queues.values()),
+                "queued_batches": len(self._queues),
+            }
+
+    def progress(self, batch_id):
+        jobs = self.jobs.list_batch(batch_id)
+        if not jobs:
+            return None
+
+        counts = {}
+        for job in jobs:
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        done = {job["id"] for job in jobs if job["status"] not in ACTIVE_STATES}
+        # Finished jobs count as complete whatever their outcome
+        progress = sum(1.0 if job["id"] in done else job["progress"] or 0.0 for job in jobs) / len(jobs)
+
+        created = min(job["created_at"] for job in jobs)
+        if len(done) == len(jobs):
+            end = datetime.fromisoformat(max(job["finished_at"] or job["created_at"] for job in jobs))
+        else:
+            end = datetime.utcnow()
+
+        return {
+            "batch_id": batch_id,
+            "total": len(jobs),
+            "counts": counts,
+            "progress": round(progress, 3),
+            "done": len(done) == len(jobs),
+            "elapsed_seconds": round((end - datetime.fromisoformat(created)).total_seconds(), 3),
+            "jobs": [
+                {
+                    "job_id": job["id"],
+                    "cluster_name": job["cluster_name"],
+                    "status": job["status"],
+                    "phase": job["phase"],
+                    "progress": job["progress"],
+                    "error": job["error"],
+                }
+                for job in jobs
+            ],
+        }
@@ -0,0 +1,172 @@
+import json
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+
+from aws_throttle import call_with_backoff
+
+try:
+    import boto3
+    from botocore.config import Config
+except ImportError:  # optional; falls back to one aws CLI process per batch
+    boto3 = None
+
+# Filter values AWS accepts per filter in one request
+FILTER_CHUNK = 200
+# Which instance wins when several share a Name tag (a terminated one lingers for an hour)
+STATE_RANK = {"running": 0, "pending": 1, "stopping": 2, "stopped": 3, "shutting-down": 4, "terminated": 5}
+
+
+class EC2Inventory:
+    # Instance addresses and states from DescribeInstances, shared by the whole backend.
+    #
+    # Lookups arriving within batch_window of each other (deploy jobs, a burst of
+    # /start calls) are answered by one paginated describe call per kind of key:
+    # instance-id filters for instance ids, tag:Name filters for names. Filters
+    # rather than InstanceIds, so one unknown id doesn't fail the whole batch. Results,
+    # "not found" included, are cached for ttl seconds; start/stop invalidate the
+    # instances they touch.
+    #
+    # Uses boto3 when it is installed, otherwise the aws CLI. endpoint_url points
+    # either at a local mock EC2 (e.g. moto_server) for testing.
+    def __init__(self, region=None, endpoint_url=None, ttl=30, batch_window=0.05, limiter=None, timeout=60):
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self.limiter = limiter
+        self.timeout = timeout
+        self._cache = {}  # ("id" | "name", key) -> (expires, instance or None)
+        self._pending = {}  # keys waiting for the next batch -> Future
+        self._collecting = False
+        self._lock = threading.Lock()
+        self._client = None
+        self._counters = {"lookups": 0, "hits": 0, "batches": 0, "api_calls": 0, "keys_fetched": 0}
+
+    def lookup(self, instance_ids=(), names=()):
+        # {"instances": {instance_id: instance or None}, "names": {name: instance or None}}
+        keys = [("id", i) for i in instance_ids if i] + [("name", n) for n in names if n]
+        now = time.monotonic()
+        found, waiting = {}, {}
+        leader = False
+        with self._lock:
+            self._counters["lookups"] += len(keys)
+            for key in keys:
+                cached = self._cache.get(key)
+                if cached and cached[0] > now:
+                    self._counters["hits"] += 1
+                    found[key] = cached[1]
+                    continue
+                waiting[key] = self._pending.setdefault(key, Future())
+            if waiting and not self._collecting:
+                # This caller runs the batch for everyone who joins during the window
+                self._collecting = leader = True
+
+        if leader:
+            time.sleep(self.batch_window)
+            self._flush()
+        for key, future in waiting.items():
+            found[key] = future.result(self.timeout)
+        return {
+            "instances": {key: value for (kind, key), value in found.items() if kind == "id"},
+            "names": {key: value for (kind, key), value in found.items() if kind == "name"},
+        }
+
+    def invalidate(self, instance_ids=(), names=()):
+        with self._lock:
+            for key in [("id", i) for i in instance_ids] + [("name", n) for n in names]:
+                self._cache.pop(key, None)
+
+    def _flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._collecting = False
+            self._counters["batches"] += 1
+            self._counters["keys_fetched"] += len(batch)
+
+        try:
+            results = {}
+            ids = [key for kind, key in batch if kind == "id"]
+            names = [key for kind, key in batch if kind == "name"]
+            for instance in self._describe("instance-id", ids):
+                results[("id", instance["instance_id"])] = instance
+            for instance in self._describe("tag:Name", names):
+                current = results.get(("name", instance["name"]))
+                if current is None or STATE_RANK.get(instance["state"], 9) < STATE_RANK.get(current["state"], 9):
+                    results[("name", instance["name"])] = instance
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key in batch:
+                self._cache[key] = (expires, results.get(key))
+        for key, future in batch.items():
+            future.set_result(results.get(key))
+
+    def _describe(self, filter_name, values):
+        for start in range(0, len(values), FILTER_CHUNK):
+            filters = [{"Name": filter_name, "Values": values[start:start + FILTER_CHUNK]}]
+            reservations = self._describe_boto3(filters) if boto3 else self._describe_cli(filters)
+            for reservation in reservations:
+                for instance in reservation.get("Instances", []):
+                    yield _instance(instance)
+
+    def _describe_boto3(self, filters):
+        if self._client is None:
+            self._client = boto3.client(
+                "ec2", region_name=self.region, endpoint_url=self.endpoint_url,
+                config=Config(retries={"mode": "adaptive", "max_attempts": 5}),
+            )
+        reservations = []
+        for page in self._client.get_paginator("describe_instances").paginate(
+            Filters=filters, PaginationConfig={"PageSize": 1000}
+        ):
+            if self.limiter:
+                self.limiter.acquire()
+            self._count("api_calls")
+            reservations.extend(page.get("Reservations", []))
+        return reservations
+
+    def _describe_cli(self, filters):
+        # The CLI follows NextToken itself and prints every page as one document
+        cmd = ["aws", "ec2", "describe-instances", "--filters", json.dumps(filters), "--output", "json"]
+        if self.region:
+            cmd += ["--region", self.region]
+        if self.endpoint_url:
+            cmd += ["--endpoint-url", self.endpoint_url]
+        self._count("api_calls")
+        result = call_with_backoff(
+            lambda: subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=self.timeout),
+            self.limiter,
+        )
+        return json.loads(result.stdout or "{}").get("Reservations", [])
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "boto3" if boto3 else "aws-cli",
+                "endpoint_url": self.endpoint_url,
+                "ttl": self.ttl,
+                "batch_window": self.batch_window,
+                "cached": len(self._cache),
+                **self._counters,
+            }
+
+
+def _instance(raw):
+    tags = {tag["Key"]: tag["Value"] for tag in raw.get("Tags", [])}
+    return {
+        "instance_id": raw.get("InstanceId"),
+        "name": tags.get("Name"),
+        "state": raw.get("State", {}).get("Name"),
+        "public_ip": raw.get("PublicIpAddress"),
+        "private_ip": raw.get("PrivateIpAddress"),
+    }
@@ -0,0 +1,132 @@
+import asyncio
+import itertools
+import time
+from datetime import datetime
+
+
+class HealthEntry:
+    def __init__(self, value):
+        self.value = value
+        self.checked_at = datetime.utcnow()
+        self.checked_monotonic = time.monotonic()
+        self.last_read = time.monotonic()
+
+    def age(self):
+        return time.monotonic() - self.checked_monotonic
+
+
+class HealthCache:
+    # Per-cluster cache of status probe results with stale-while-revalidate reads.
+    #
+    # - younger than ttl: served as is
+    # - older than ttl but younger than max_stale: served immediately, flagged stale,
+    #   and a refresh is started in the background
+    # - missing or older than max_stale: the caller waits for a fresh probe
+    #
+    # The background loop keeps entries that are being read warm and forgets clusters
+    # nobody has asked about for idle_evict seconds. All probes, foreground or
+    # background, share one semaphore, and concurrent refreshes of the same cluster
+    # are collapsed into a single probe. probe is a coroutine function.
+    #
+    # invalidate() (after /start, /stop, ...) bumps the cluster's generation: a probe
+    # that was already running when it was called still answers the callers waiting
+    # on it, but its result is not cached, and later reads start a new probe.
+    def __init__(self, probe, ttl=30, max_stale=300, concurrency=32, refresh_interval=5, idle_evict=600):
+        self.probe = probe
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.concurrency = concurrency
+        self.refresh_interval = refresh_interval
+        self.idle_evict = idle_evict
+        # Created on the running loop (start() or the first probe), not at import time
+        self._semaphore = None
+        self._entries = {}
+        self._inflight = {}
+        self._generations = {}
+        self._counter = itertools.count(1)
+        self._task = None
+
+    async def get(self, cluster_name, force=False):
+        entry = self._entries.get(cluster_name)
+        if entry and not force:
+            entry.last_read = time.monotonic()
+            age = entry.age()
+            if age < self.ttl:
+                return entry, False
+            if age < self.max_stale:
+                self._refresh_in_background(cluster_name)
+                return entry, True
+        return await self._refresh(cluster_name), False
+
+    async def get_many(self, cluster_names, force=False):
+        # Fans out over every cluster at once (the shared semaphore is the only limit)
+        # and yields (cluster_name, entry, stale) in completion order.
+        async def one(cluster_name):
+            entry, stale = await self.get(cluster_name, force=force)
+            return cluster_name, entry, stale
+
+        for result in asyncio.as_completed([one(name) for name in cluster_names]):
+            yield await result
+
+    def invalidate(self, cluster_name):
+        # May be called from job threads; next() on a count is atomic
+        self._generations[cluster_name] = next(self._counter)
+        self._entries.pop(cluster_name, None)
+        self._inflight.pop(cluster_name, None)
+
+    def _refresh_in_background(self, cluster_name):
+        if cluster_name not in self._inflight:
+            asyncio.ensure_future(self._refresh(cluster_name))
+
+    async def _refresh(self, cluster_name):
+        inflight = self._inflight.get(cluster_name)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._probe(cluster_name))
+            self._inflight[cluster_name] = inflight
+            inflight.add_done_callback(lambda done: self._forget_inflight(cluster_name, done))
+        return await asyncio.shield(inflight)
+
+    def _forget_inflight(self, cluster_name, task):
+        # invalidate() may already have replaced it with a newer probe
+        if self._inflight.get(cluster_name) is task:
+            del self._inflight[cluster_name]
+
+    async def _probe(self, cluster_name):
+        generation = self._generations.get(cluster_name)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            value = await self.probe(cluster_name)
+        entry = HealthEntry(value)
+        if self._generations.get(cluster_name) != generation:
+            return entry  # invalidated while probing: the result predates the change
+        previous = self._entries.get(cluster_name)
+        if previous:
+            entry.last_read = previous.last_read
+        self._entries[cluster_name] = entry
+        return entry
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            now = time.monotonic()
+            for cluster_name, entry in list(self._entries.items()):
+                if now - entry.last_read > self.idle_evict:
+                    self._entries.pop(cluster_name, None)
+                elif entry.age() >= self.ttl:
+                    self._refresh_in_background(cluster_name)
+
+    def start(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,155 @@
+import json
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+
+ACTIVE_STATES = ("queued", "running")
+
+
+class JobContext:
+    # Handed to every job function so it can report which phase it is in.
+    def __init__(self, manager, job_id, planned_phases, kind=None):
+        self.manager = manager
+        self.job_id = job_id
+        self.kind = kind
+        self.planned_phases = list(planned_phases)
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        entry = {
+            "name": name, "started_at": datetime.utcnow().isoformat(), "finished_at": None, "duration": None,
+            "status": "running",
+        }
+        self.phases.append(entry)
+        self.manager._update(self.job_id, phase=name, phases=json.dumps(self.phases))
+        start = time.monotonic()
+        try:
+            yield entry
+        except BaseException:
+            entry["status"] = "failed"
+            raise
+        else:
+            entry["status"] = "ok"
+        finally:
+            entry["finished_at"] = datetime.utcnow().isoformat()
+            entry["duration"] = round(time.monotonic() - start, 3)
+            metrics.JOB_PHASE_SECONDS.observe(entry["duration"], self.kind, name)
+            self.manager._update(
+                self.job_id,
+                phases=json.dumps(self.phases),
+                progress=self._progress(),
+            )
+
+    def _progress(self):
+        if not self.planned_phases:
+            return 0.0
+        # Failed phases don't count: a job that fails keeps the progress of its last good phase
+        done = {p["name"] for p in self.phases if p["status"] == "ok"}
+        return round(len(done & set(self.planned_phases)) / len(self.planned_phases), 3)
+
+
+class JobManager:
+    def __init__(self, store, max_workers=4):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def recover(self):
+        # Anything still queued or running belonged to a previous process; the
+        # executor that owned it is gone, so record that instead of leaving it hanging.
+        self.store.execute(
+            "UPDATE jobs SET status='interrupted', finished_at=? WHERE status IN (?, ?)",
+            (datetime.utcnow().isoformat(),) + ACTIVE_STATES,
+        )
+
+    def submit(self, kind, cluster_name, fn, *args, phases=()):
+        job_id = self.create(kind, cluster_name)
+        self.start(job_id, fn, *args, phases=phases)
+        return job_id
+
+    def create(self, kind, cluster_name, batch_id=None):
+        # Records a queued job without running it; see start()
+        job_id = uuid.uuid4().hex
+        self.store.execute("""
+            INSERT INTO jobs (id, kind, cluster_name, batch_id, status, phase, progress, phases, created_at)
+            VALUES (?, ?, ?, ?, 'queued', NULL, 0, '[]', ?)
+        """, (job_id, kind, cluster_name, batch_id, datetime.utcnow().isoformat()))
+        return job_id
+
+    def start(self, job_id, fn, *args, phases=(), executor=None, on_done=None):
+        # executor defaults to the manager's own; on_done(job_id) runs when the job ends
+        (executor or self.executor).submit(self._run, job_id, list(phases), fn, args, on_done)
+
+    def _run(self, job_id, phases, fn, args, on_done=None):
+        try:
+            self._execute(job_id, phases, fn, args)
+        finally:
+            if on_done:
+                on_done(job_id)
+
+    def _execute(self, job_id, phases, fn, args):
+        kind = self.store.fetch_one("SELECT kind FROM jobs WHERE id=?", (job_id,))["kind"]
+        self._update(job_id, status="running", started_at=datetime.utcnow().isoformat())
+        ctx = JobContext(self, job_id, phases, kind)
+        try:
+            with metrics.JOBS_RUNNING.track(kind):
+                result = fn(ctx, *args)
+        except Exception as e:
+            traceback.print_exc()
+            metrics.JOBS_FINISHED.inc(kind, "failed")
+            self._update(
+                job_id,
+                status="failed",
+                error=str(getattr(e, "detail", e)),
+                finished_at=datetime.utcnow().isoformat(),
+            )
+            return
+        metrics.JOBS_FINISHED.inc(kind, "succeeded")
+        self._update(
+            job_id,
+            status="succeeded",
+            progress=1.0,
+            result=json.dumps(result),
+            finished_at=datetime.utcnow().isoformat(),
+        )
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{column}=?" for column in fields)
+        self.store.execute(f"UPDATE jobs SET {assignments} WHERE id=?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        row = self.store.fetch_one("SELECT * FROM jobs WHERE id=?", (job_id,))
+        return _job_to_dict(row) if row else None
+
+    def list(self, cluster_name=None, limit=50):
+        if cluster_name:
+            rows = self.store.fetch_all(
+                "SELECT * FROM jobs WHERE cluster_name=? ORDER BY created_at DESC LIMIT ?",
+                (cluster_name, limit),
+            )
+        else:
+            rows = self.store.fetch_all("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [_job_to_dict(row) for row in rows]
+
+    def list_batch(self, batch_id):
+        rows = self.store.fetch_all("SELECT * FROM jobs WHERE batch_id=? ORDER BY created_at", (batch_id,))
+        return [_job_to_dict(row) for row in rows]
+
+
+def _job_to_dict(row):
+    job = dict(row)
+    job["phases"] = json.loads(job["phases"] or "[]")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+
+    started = job["started_at"]
+    if started:
+        end = datetime.fromisoformat(job["finished_at"]) if job["finished_at"] else datetime.utcnow()
+        job["elapsed_seconds"] = round((end - datetime.fromisoformat(started)).total_seconds(), 3)
+    else:
+        job["elapsed_seconds"] = None
+    return job
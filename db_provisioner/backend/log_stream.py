@@ -0,0 +1,273 @@
+import asyncio
+import os
+import signal
+import subprocess
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+# How many trailing lines of output are kept in memory for error messages
+TAIL_LINES = 50
+FOLLOW_POLL_INTERVAL = 0.5
+KEEPALIVE_INTERVAL = 15
+READ_CHUNK = 64 * 1024
+# Longest line held in memory; longer output (progress bars, blobs without newlines)
+# is passed on in pieces of this size. Large enough for jsonl_events result lines.
+MAX_LINE = 1024 * 1024
+# Seconds between SIGTERM and SIGKILL when a command is timed out or cancelled
+KILL_GRACE = 5
+
+
+class StreamResult:
+    def __init__(self, returncode, tail, output=""):
+        self.returncode = returncode
+        self.tail = tail
+        self.output = output
+
+
+class CommandTimeout(subprocess.CalledProcessError):
+    # A CalledProcessError so callers that already handle command failures cover timeouts too
+    def __init__(self, cmd, timeout, output):
+        super().__init__(-signal.SIGKILL, cmd, output=output, stderr=output)
+        self.timeout = timeout
+
+    def __str__(self):
+        return f"Command '{self.cmd}' timed out after {self.timeout}s"
+
+
+def split_lines(pending, chunk):
+    # (lines, rest) of pending + chunk. Complete lines keep their newline; a line
+    # longer than MAX_LINE is cut into MAX_LINE pieces wherever the read boundaries
+    # fall, so the same output always splits the same way and pending stays bounded.
+    *complete, pending = (pending + chunk).split(b"\n")
+    lines = []
+    for line in complete:
+        while len(line) > MAX_LINE:
+            lines.append(line[:MAX_LINE])
+            line = line[MAX_LINE:]
+        lines.append(line + b"\n")
+    while len(pending) > MAX_LINE:
+        lines.append(pending[:MAX_LINE])
+        pending = pending[MAX_LINE:]
+    return lines, pending
+
+
+def redact(cmd):
+    # The command as written to logs: values of "-e key=value" extra vars are masked,
+    # inline JSON/YAML extra vars entirely; "-e @file" is kept
+    shown = []
+    for previous, arg in zip([None] + list(cmd[:-1]), cmd):
+        if previous in ("-e", "--extra-vars") and not arg.startswith("@"):
+            if arg.lstrip().startswith(("{", "[")):
+                arg = "***"
+            else:
+                arg = " ".join(f"{pair.partition('=')[0]}=***" if "=" in pair else pair for pair in arg.split(" "))
+        shown.append(arg)
+    return " ".join(shown)
+
+
+@contextmanager
+def _command_metrics(cmd):
+    # Wall time and in-flight count per tool; non-zero exits are counted where the
+    # exit status is known
+    tool = os.path.basename(cmd[0])
+    start = time.perf_counter()
+    metrics.SUBPROCESS_IN_FLIGHT.inc(tool)
+    try:
+        yield
+    except CommandTimeout:
+        metrics.SUBPROCESS_FAILURES.inc(tool, "timeout")
+        raise
+    except asyncio.CancelledError:
+        metrics.SUBPROCESS_FAILURES.inc(tool, "cancelled")
+        raise
+    except OSError:
+        metrics.SUBPROCESS_FAILURES.inc(tool, "spawn")
+        raise
+    finally:
+        metrics.SUBPROCESS_IN_FLIGHT.dec(tool)
+        metrics.SUBPROCESS_SECONDS.observe(time.perf_counter() - start, tool)
+
+
+def run_streaming(cmd, log_path, cwd=None, env=None, check=True, on_line=None):
+    with _command_metrics(cmd):
+        return _run_streaming(cmd, log_path, cwd, env, check, on_line)
+
+
+def _run_streaming(cmd, log_path, cwd, env, check, on_line):
+    # Reads the command's combined stdout/stderr line by line as it is produced,
+    # appending each line to log_path. Only the last TAIL_LINES lines stay in memory.
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    tail = deque(maxlen=TAIL_LINES)
+
+    with open(log_path, "a", buffering=1) as log:
+        log.write(f"$ {redact(cmd)}\n")
+        with subprocess.Popen(
+            cmd, cwd=cwd, env=env, text=True, bufsize=1,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        ) as proc:
+            for line in iter(lambda: proc.stdout.readline(MAX_LINE), ""):
+                log.write(line)
+                tail.append(line)
+                if on_line:
+                    on_line(line)
+            returncode = proc.wait()
+        log.write(f"# exit status {returncode}\n")
+    if returncode != 0:
+        metrics.SUBPROCESS_FAILURES.inc(os.path.basename(cmd[0]), "exit")
+
+    output = "".join(tail)
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=output, stderr=output)
+    return StreamResult(returncode, output)
+
+
+class _Output:
+    def __init__(self, log, on_line, capture_limit):
+        self.log = log
+        self.on_line = on_line
+        self.capture_limit = capture_limit
+        self.tail = deque(maxlen=TAIL_LINES)
+        self.captured = []
+        self.captured_size = 0
+
+    def line(self, raw):
+        line = raw.decode(errors="replace")
+        if self.log:
+            self.log.write(line)
+        self.tail.append(line)
+        if self.captured_size < self.capture_limit:
+            kept = line[:self.capture_limit - self.captured_size]
+            self.captured.append(kept)
+            self.captured_size += len(kept)
+        if self.on_line:
+            self.on_line(line)
+
+
+async def run_async(cmd, log_path=None, cwd=None, env=None, check=True, on_line=None, timeout=None, capture_limit=0):
+    with _command_metrics(cmd):
+        return await _run_async(cmd, log_path, cwd, env, check, on_line, timeout, capture_limit)
+
+
+async def _run_async(cmd, log_path, cwd, env, check, on_line, timeout, capture_limit):
+    # asyncio counterpart of run_streaming, for handlers running on the event loop.
+    # The command gets its own process group so a timeout or cancellation also takes
+    # down what it spawned (ansible forks, terraform providers). With capture_limit
+    # the first capture_limit characters of output are returned in result.output.
+    log = None
+    if log_path:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        log = open(log_path, "a", buffering=1)
+        log.write(f"$ {redact(cmd)}\n")
+    out = _Output(log, on_line, capture_limit)
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, cwd=cwd, env=env, start_new_session=True,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        )
+
+        async def pump():
+            pending = b""
+            while True:
+                chunk = await proc.stdout.read(READ_CHUNK)
+                if not chunk:
+                    break
+                lines, pending = split_lines(pending, chunk)
+                for raw in lines:
+                    out.line(raw)
+            if pending:
+                out.line(pending)
+            return await proc.wait()
+
+        try:
+            returncode = await asyncio.wait_for(pump(), timeout)
+        except asyncio.TimeoutError:
+            await _terminate(proc)
+            if log:
+                log.write(f"# timed out after {timeout}s\n")
+            raise CommandTimeout(cmd, timeout, "".join(out.tail))
+        except asyncio.CancelledError:
+            await _terminate(proc)
+            if log:
+                log.write("# cancelled\n")
+            raise
+        if log:
+            log.write(f"# exit status {returncode}\n")
+    finally:
+        if log:
+            log.close()
+
+    if returncode != 0:
+        metrics.SUBPROCESS_FAILURES.inc(os.path.basename(cmd[0]), "exit")
+    output = "".join(out.tail)
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=output, stderr=output)
+    return StreamResult(returncode, output, "".join(out.captured))
+
+
+async def _terminate(proc):
+    if proc.returncode is not None:
+        return
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(proc.wait(), KILL_GRACE)
+            return
+        except asyncio.TimeoutError:
+            continue
+
+
+async def follow_log(log_path, is_active, skip_lines=0):
+    # Server-Sent Events generator that tails log_path until is_active() turns
+    # false and the file has been read to the end. is_active (which may query the
+    # job store) and the file reads run in worker threads, off the event loop.
+    while not await asyncio.to_thread(os.path.exists, log_path):
+        if not await asyncio.to_thread(is_active):
+            yield "event: end\ndata: no log output\n\n"
+            return
+        await asyncio.sleep(FOLLOW_POLL_INTERVAL)
+
+    line_no = 0
+    idle = 0.0
+    pending = b""
+    writer_done = False
+    with open(log_path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, READ_CHUNK)
+            if chunk:
+                # A partial last line stays pending until the rest of it is written
+                lines, pending = split_lines(pending, chunk)
+                idle = 0.0
+                for raw in lines:
+                    line_no += 1
+                    if line_no > skip_lines:
+                        yield _event(line_no, raw)
+                continue
+
+            if writer_done:
+                if pending:
+                    line_no += 1
+                    if line_no > skip_lines:
+                        yield _event(line_no, pending)
+                yield "event: end\ndata: done\n\n"
+                return
+            if not await asyncio.to_thread(is_active):
+                # The writer is done; one more pass reads whatever landed after the last read
+                writer_done = True
+                continue
+
+            await asyncio.sleep(FOLLOW_POLL_INTERVAL)
+            idle += FOLLOW_POLL_INTERVAL
+            if idle >= KEEPALIVE_INTERVAL:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+
+
+def _event(line_no, raw):
+    return f"id: {line_no}\ndata: {raw.decode(errors='replace').rstrip()}\n\n"
@@ -0,0 +1,225 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; wide enough for sub-millisecond SQLite reads and half-hour terraform applies
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800,
+)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 5)
+
+REGISTRY = []
+
+
+class _Metric:
+    # Every thread writes to its own shard ({label values: row}), so recording never
+    # takes a lock or races another writer; render() adds the shards up. Label sets
+    # registered up front are pre-allocated in each shard and exported even at zero.
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), labelsets=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registered = [tuple(labels) for labels in labelsets]
+        if not self.labelnames:
+            self._registered = [()]
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def register(self, *labels):
+        if labels not in self._registered:
+            self._registered.append(labels)
+
+    def _row(self, labels):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # First write from this thread
+            shard = {labels: self._new_row() for labels in self._registered}
+            self._local.shard = shard
+            with self._shards_lock:
+                self._shards.append(shard)
+        row = shard.get(labels)
+        if row is None:
+            row = shard[labels] = self._new_row()
+        return row
+
+    def _merged(self):
+        merged = {labels: self._new_row() for labels in self._registered}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for labels, row in list(shard.items()):
+                total = merged.setdefault(labels, self._new_row())
+                for i, value in enumerate(row):
+                    total[i] += value
+        return merged
+
+    def _labels(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, row in sorted(self._merged().items()):
+            lines.extend(self._samples(labels, row))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_row(self):
+        return [0.0]
+
+    def inc(self, *labels, amount=1):
+        self._row(labels)[0] += amount
+
+    def _samples(self, labels, row):
+        return [f"{self.name}{self._labels(labels)} {_number(row[0])}"]
+
+
+class Gauge(Counter):
+    # Summed across threads like a counter, so inc() and dec() may run on different threads
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self._row(labels)[0] -= amount
+
+    @contextmanager
+    def track(self, *labels):
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), labelsets=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, labelsets)
+
+    def _new_row(self):
+        # A count per bucket, one for +Inf, then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, *labels):
+        row = self._row(labels)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _samples(self, labels, row):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), row):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _number(bound)
+            samples.append(f"{self.name}_bucket{self._labels(labels, [('le', le)])} {cumulative}")
+        samples.append(f"{self.name}_sum{self._labels(labels)} {_number(row[-1])}")
+        samples.append(f"{self.name}_count{self._labels(labels)} {cumulative}")
+        return samples
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render():
+    # Prometheus text exposition format 0.0.4
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+TOOLS = ("terraform", "ansible-playbook", "ansible", "aws", "ssh")
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to complete a request, by route template.", ("method", "route"),
+)
+HTTP_RESPONSES = Counter(
+    "http_responses_total", "Responses by route and status class (2xx, 4xx, 5xx).", ("method", "route", "status"),
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled.")
+
+SUBPROCESS_SECONDS = Histogram(
+    "subprocess_duration_seconds", "Wall time of external commands, by tool.", ("tool",),
+    labelsets=[(tool,) for tool in TOOLS],
+)
+SUBPROCESS_FAILURES = Counter(
+    "subprocess_failures_total", "External commands that exited non-zero, timed out or were cancelled.",
+    ("tool", "reason"),
+)
+SUBPROCESS_IN_FLIGHT = Gauge(
+    "subprocesses_in_flight", "External commands running.", ("tool",), labelsets=[(tool,) for tool in TOOLS],
+)
+
+AWS_THROTTLE_RETRIES = Counter(
+    "aws_throttle_retries_total", "AWS commands retried after the API throttled them, by tool.", ("tool",),
+    labelsets=[("terraform",), ("aws",)],
+)
+
+ANSIBLE_TASK_SECONDS = Histogram(
+    "ansible_task_duration_seconds", "Slowest host's time per playbook task (Gathering Facts included).",
+    ("playbook", "task"),
+)
+
+JOB_PHASE_SECONDS = Histogram("job_phase_duration_seconds", "Time per job phase, e.g. deploy terraform_apply.", ("kind", "phase"))
+JOBS_RUNNING = Gauge("jobs_running", "Background jobs running.", ("kind",))
+JOBS_FINISHED = Counter("jobs_finished_total", "Background jobs finished, by outcome.", ("kind", "status"))
+
+SQLITE_SECONDS = Histogram(
+    "sqlite_query_duration_seconds", "clusters.db reads (single statements) and write transactions.",
+    ("operation",), labelsets=[("read",), ("write",)], buckets=FAST_BUCKETS,
+)
+
+
+class MetricsMiddleware:
+    # ASGI middleware recording latency, status and in-flight count per route template
+    # (not per path, so /status/{cluster_name} is one series)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"], route)
+            HTTP_RESPONSES.inc(scope["method"], route, f"{status['code'] // 100}xx")
@@ -0,0 +1,287 @@
+import logging
+import time
+from datetime import datetime
+
+# Schema changes for clusters.db, applied in order. The applied version is kept in
+# PRAGMA user_version and each step is also recorded in schema_migrations.
+# Never edit a migration that has shipped; append a new one instead.
+
+LEGACY_NODE_SLOTS = 9
+
+log = logging.getLogger(__name__)
+
+
+def _initial(conn):
+    # The original single-table layout. IF NOT EXISTS so databases created before
+    # migrations existed are adopted as version 1 unchanged.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS clusters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cluster_name TEXT,
+            platform TEXT,
+            status TEXT,
+            instance_count INTEGER,
+            ami TEXT,
+            instance_type TEXT,
+            data_volume_size INTEGER,
+            postgresql_version TEXT,
+            allowed_ip_1 TEXT,
+            allowed_ip_2 TEXT,
+            server_public_ip TEXT,
+            public_ip_1 TEXT,
+            public_ip_2 TEXT,
+            public_ip_3 TEXT,
+            public_ip_4 TEXT,
+            public_ip_5 TEXT,
+            public_ip_6 TEXT,
+            public_ip_7 TEXT,
+            public_ip_8 TEXT,
+            public_ip_9 TEXT,
+            private_ip_1 TEXT,
+            private_ip_2 TEXT,
+            private_ip_3 TEXT,
+            private_ip_4 TEXT,
+            private_ip_5 TEXT,
+            private_ip_6 TEXT,
+            private_ip_7 TEXT,
+            private_ip_8 TEXT,
+            private_ip_9 TEXT,
+            deployment_dir TEXT,
+            timestamp TEXT,
+            pod_count INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT,
+            cluster_name TEXT,
+            status TEXT,
+            phase TEXT,
+            progress REAL,
+            phases TEXT,
+            result TEXT,
+            error TEXT,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    """)
+
+
+def _cluster_nodes(conn):
+    # Move public_ip_N/private_ip_N into cluster_nodes and rebuild clusters without them.
+    slots = range(1, LEGACY_NODE_SLOTS + 1)
+    ip_columns = ", ".join(f"public_ip_{i}, private_ip_{i}" for i in slots)
+
+    # cluster_name was never unique. Rows that cannot move to the new table (all but
+    # the newest row of a name, and rows without a name) may still point at live
+    # infrastructure, so they are kept as they were in clusters_duplicates, to be
+    # reconciled by hand, rather than dropped.
+    displaced = """
+        cluster_name IS NULL OR id NOT IN (
+            SELECT MAX(id) FROM clusters WHERE cluster_name IS NOT NULL GROUP BY cluster_name
+        )
+    """
+    conn.execute(f"CREATE TABLE clusters_duplicates AS SELECT * FROM clusters WHERE {displaced}")
+    moved = conn.execute("SELECT id, cluster_name FROM clusters_duplicates ORDER BY cluster_name, id").fetchall()
+    if moved:
+        log.warning(
+            "clusters.db: moved %d duplicate or unnamed cluster rows to clusters_duplicates: %s",
+            len(moved), ", ".join(f"{name or '<no name>'} (id {row_id})" for row_id, name in moved),
+        )
+    conn.execute(f"DELETE FROM clusters WHERE {displaced}")
+
+    nodes = []
+    for row in conn.execute(f"SELECT id, {ip_columns} FROM clusters"):
+        cluster_id, ips = row[0], row[1:]
+        for i in slots:
+            public_ip, private_ip = ips[(i - 1) * 2], ips[(i - 1) * 2 + 1]
+            if public_ip or private_ip:
+                nodes.append((cluster_id, i, public_ip, private_ip))
+
+    conn.execute("""
+        CREATE TABLE clusters_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cluster_name TEXT NOT NULL,
+            platform TEXT,
+            status TEXT,
+            instance_count INTEGER,
+            ami TEXT,
+            instance_type TEXT,
+            data_volume_size INTEGER,
+            postgresql_version TEXT,
+            allowed_ip_1 TEXT,
+            allowed_ip_2 TEXT,
+            server_public_ip TEXT,
+            deployment_dir TEXT,
+            timestamp TEXT,
+            pod_count INTEGER
+        )
+    """)
+    conn.execute("""
+        INSERT INTO clusters_new (
+            id, cluster_name, platform, status, instance_count, ami, instance_type,
+            data_volume_size, postgresql_version, allowed_ip_1, allowed_ip_2,
+            server_public_ip, deployment_dir, timestamp, pod_count
+        )
+        SELECT
+            id, cluster_name, platform, status, instance_count, ami, instance_type,
+            data_volume_size, postgresql_version, allowed_ip_1, allowed_ip_2,
+            server_public_ip, deployment_dir, timestamp, pod_count
+        FROM clusters
+        WHERE cluster_name IS NOT NULL
+    """)
+    conn.execute("DROP TABLE clusters")
+    conn.execute("ALTER TABLE clusters_new RENAME TO clusters")
+
+    conn.execute("""
+        CREATE TABLE cluster_nodes (
+            cluster_id INTEGER NOT NULL REFERENCES clusters(id) ON DELETE CASCADE,
+            node_index INTEGER NOT NULL,
+            instance_id TEXT,
+            public_ip TEXT,
+            private_ip TEXT,
+            PRIMARY KEY (cluster_id, node_index)
+        ) WITHOUT ROWID
+    """)
+    conn.executemany(
+        "INSERT INTO cluster_nodes (cluster_id, node_index, public_ip, private_ip) VALUES (?, ?, ?, ?)",
+        nodes,
+    )
+
+    conn.execute("CREATE UNIQUE INDEX idx_clusters_name ON clusters (cluster_name)")
+    conn.execute("CREATE INDEX idx_clusters_instance_count ON clusters (instance_count)")
+    conn.execute("CREATE INDEX idx_jobs_cluster ON jobs (cluster_name, created_at)")
+    conn.execute("CREATE INDEX idx_jobs_status ON jobs (status)")
+
+
+def _template_version(conn):
+    # Which template store snapshot a cluster's ansible directory is linked to;
+    # NULL for clusters deployed with a full copy of the templates.
+    conn.execute("ALTER TABLE clusters ADD COLUMN template_version TEXT")
+
+
+def _job_batches(conn):
+    # Jobs submitted together through POST /deploy/batch share a batch_id
+    conn.execute("ALTER TABLE jobs ADD COLUMN batch_id TEXT")
+    conn.execute("CREATE INDEX idx_jobs_batch ON jobs (batch_id)")
+
+
+def _deploy_phases(conn):
+    # Deploy timeline: the job's phases plus terraform resources and ansible roles
+    # parsed from the apply output (parent says which step they ran under)
+    conn.execute("""
+        CREATE TABLE deploy_phases (
+            id INTEGER PRIMARY KEY,
+            cluster_name TEXT NOT NULL,
+            job_id TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            parent TEXT,
+            started_at TEXT,
+            duration REAL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_deploy_phases_cluster ON deploy_phases (cluster_name, started_at)")
+    conn.execute("CREATE INDEX idx_deploy_phases_job ON deploy_phases (job_id)")
+
+
+def _table_versions(conn):
+    # A counter per table, bumped by triggers on every write (from any process), so
+    # list endpoints can answer If-None-Match without running the list query
+    conn.execute("""
+        CREATE TABLE table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    # Start from the clock so a recreated clusters.db doesn't reissue old ETags
+    conn.execute("INSERT INTO table_versions (name, version) VALUES ('clusters', ?)", (int(time.time() * 1000),))
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER clusters_version_{event.lower()} AFTER {event} ON clusters
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'clusters';
+            END
+        """)
+    # Keyset pagination walks the primary key; these back the common filters
+    conn.execute("CREATE INDEX idx_clusters_platform ON clusters (platform)")
+    conn.execute("CREATE INDEX idx_clusters_status ON clusters (status)")
+
+
+def _warm_pool(conn):
+    # Standby instances built ahead of /deploy (see warm_pool.py); a row is deleted
+    # once its instance has been handed to a cluster or destroyed
+    conn.execute("""
+        CREATE TABLE warm_pool (
+            id TEXT PRIMARY KEY,
+            pool_key TEXT NOT NULL,
+            ami TEXT,
+            instance_type TEXT,
+            postgresql_version TEXT,
+            data_volume_size INTEGER,
+            status TEXT NOT NULL,
+            deployment_dir TEXT,
+            template_version TEXT,
+            instance_id TEXT,
+            public_ip TEXT,
+            private_ip TEXT,
+            job_id TEXT,
+            claimed_by TEXT,
+            error TEXT,
+            created_at TEXT,
+            ready_at TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX idx_warm_pool_key ON warm_pool (pool_key, status, created_at)")
+
+
+def _role_fingerprints(conn):
+    # What each role was last applied with on each host (see role_fingerprints.py)
+    conn.execute("""
+        CREATE TABLE role_fingerprints (
+            cluster_id INTEGER NOT NULL REFERENCES clusters(id) ON DELETE CASCADE,
+            host TEXT NOT NULL,
+            role TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            applied_at TEXT,
+            PRIMARY KEY (cluster_id, host, role)
+        ) WITHOUT ROWID
+    """)
+
+
+MIGRATIONS = [
+    (1, "initial", _initial),
+    (2, "cluster_nodes", _cluster_nodes),
+    (3, "template_version", _template_version),
+    (4, "job_batches", _job_batches),
+    (5, "deploy_phases", _deploy_phases),
+    (6, "table_versions", _table_versions),
+    (7, "warm_pool", _warm_pool),
+    (8, "role_fingerprints", _role_fingerprints),
+]
+
+
+def apply_migrations(store):
+    with store.transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TEXT
+            )
+        """)
+
+    for version, name, migrate in MIGRATIONS:
+        # Re-check inside the write transaction so concurrent workers starting
+        # against the same file apply each step exactly once.
+        with store.transaction() as conn:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current >= version:
+                continue
+            migrate(conn)
+            conn.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.utcnow().isoformat()),
+            )
+            conn.execute(f"PRAGMA user_version = {version}")
@@ -0,0 +1,169 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+try:
+    import asyncpg
+except ImportError:  # optional: without it every DB/user operation goes through Ansible
+    asyncpg = None
+
+# Role attributes accepted from AddUserRequest.roles; anything else is rejected rather
+# than pasted into SQL.
+ROLE_OPTIONS = {
+    "LOGIN", "NOLOGIN", "SUPERUSER", "NOSUPERUSER", "CREATEDB", "NOCREATEDB",
+    "CREATEROLE", "NOCREATEROLE", "INHERIT", "NOINHERIT", "REPLICATION",
+    "NOREPLICATION", "BYPASSRLS", "NOBYPASSRLS",
+}
+
+# Database-level privileges accepted in bulk grants
+GRANT_PRIVILEGES = {"ALL", "ALL PRIVILEGES", "CONNECT", "CREATE", "TEMPORARY", "TEMP"}
+
+# Same filter the list_databases playbooks apply
+LIST_DATABASES_SQL = """
+    SELECT d.datname AS name,
+           pg_catalog.pg_get_userbyid(d.datdba) AS owner,
+           pg_catalog.pg_encoding_to_char(d.encoding) AS encoding,
+           pg_catalog.pg_database_size(d.datname) AS size_bytes
+    FROM pg_catalog.pg_database d
+    WHERE d.datistemplate = false AND d.datname NOT IN ('postgres')
+    ORDER BY d.datname
+"""
+
+
+# Errors reported by the server for a statement (duplicate database, missing role, ...)
+SQL_ERRORS = (asyncpg.PostgresError,) if asyncpg is not None else ()
+
+
+class DirectSQLUnavailable(Exception):
+    # The cluster could not be reached over SQL; callers fall back to Ansible.
+    pass
+
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def role_options(roles):
+    options = [role.upper() for role in roles] or ["LOGIN"]
+    unknown = [role for role in options if role not in ROLE_OPTIONS]
+    if unknown:
+        raise ValueError(f"Unsupported role option(s): {', '.join(unknown)}")
+    return options
+
+
+def grant_privileges(privileges):
+    privileges = [privilege.upper() for privilege in privileges] or ["ALL"]
+    unknown = [privilege for privilege in privileges if privilege not in GRANT_PRIVILEGES]
+    if unknown:
+        raise ValueError(f"Unsupported privilege(s): {', '.join(unknown)}")
+    return privileges
+
+
+class DirectSQL:
+    # Operations take (cluster_name, host, port, ...); connections come from the
+    # per-cluster PoolRegistry.
+    def __init__(self, pools, enabled=True):
+        self.pools = pools
+        self.enabled = enabled and asyncpg is not None
+
+    @asynccontextmanager
+    async def connection(self, cluster_name, host, port, database="postgres"):
+        if not host:
+            raise DirectSQLUnavailable("cluster has no public address")
+        try:
+            async with self.pools.connection(cluster_name, host, port, database) as conn:
+                yield conn
+        except (OSError, asyncio.TimeoutError, asyncpg.CannotConnectNowError,
+                asyncpg.InvalidAuthorizationSpecificationError, asyncpg.InvalidPasswordError) as e:
+            raise DirectSQLUnavailable(str(e) or type(e).__name__) from e
+
+    async def create_database(self, cluster_name, host, port, db_name):
+        async with self.connection(cluster_name, host, port) as conn:
+            await conn.execute(f"CREATE DATABASE {quote_ident(db_name)}")
+
+    async def drop_database(self, cluster_name, host, port, db_name):
+        # Our own pooled sessions on that database would block the drop
+        await self.pools.close_database(cluster_name, db_name)
+        async with self.connection(cluster_name, host, port) as conn:
+            await conn.execute(f"DROP DATABASE IF EXISTS {quote_ident(db_name)}")
+
+    async def list_databases(self, cluster_name, host, port):
+        async with self.connection(cluster_name, host, port) as conn:
+            rows = await conn.fetch(LIST_DATABASES_SQL)
+        return [dict(row) for row in rows]
+
+    async def create_user(self, cluster_name, host, port, database, username, password, roles):
+        options = role_options(roles)
+        async with self.connection(cluster_name, host, port, database) as conn:
+            await conn.execute(
+                f"CREATE USER {quote_ident(username)} WITH PASSWORD {quote_literal(password)} {' '.join(options)}"
+            )
+
+    async def drop_user(self, cluster_name, host, port, username):
+        async with self.connection(cluster_name, host, port) as conn:
+            await conn.execute(f"DROP USER IF EXISTS {quote_ident(username)}")
+
+    async def create_databases(self, cluster_name, host, port, db_names):
+        # CREATE DATABASE cannot run inside a transaction block, so this is one
+        # statement per database over a single connection.
+        results = []
+        async with self.connection(cluster_name, host, port) as conn:
+            rows = await conn.fetch(
+                "SELECT datname FROM pg_catalog.pg_database WHERE datname = ANY($1::text[])", db_names
+            )
+            existing = {row["datname"] for row in rows}
+            for db_name in db_names:
+                if db_name in existing:
+                    results.append({"name": db_name, "status": "exists"})
+                    continue
+                try:
+                    await conn.execute(f"CREATE DATABASE {quote_ident(db_name)}")
+                    results.append({"name": db_name, "status": "created"})
+                except SQL_ERRORS as e:
+                    results.append({"name": db_name, "status": "failed", "error": str(e)})
+        return results
+
+    async def apply_users(self, cluster_name, host, port, users, grants):
+        # users: dicts with username, password, roles; grants: dicts with username,
+        # database, privileges. Everything runs in one transaction with a savepoint
+        # per item, so a failing item is reported without undoing the others.
+        # Existing users are left as they are (password and attributes untouched).
+        user_options = [role_options(user["roles"]) for user in users]
+        grant_privs = [grant_privileges(grant["privileges"]) for grant in grants]
+
+        results = []
+        async with self.connection(cluster_name, host, port) as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    "SELECT rolname FROM pg_catalog.pg_roles WHERE rolname = ANY($1::text[])",
+                    [user["username"] for user in users],
+                )
+                existing = {row["rolname"] for row in rows}
+                for user, options in zip(users, user_options):
+                    if user["username"] in existing:
+                        results.append({"kind": "user", "name": user["username"], "status": "exists"})
+                        continue
+                    sql = (
+                        f"CREATE USER {quote_ident(user['username'])} "
+                        f"WITH PASSWORD {quote_literal(user['password'])} {' '.join(options)}"
+                    )
+                    results.append(await self._apply_item(conn, "user", user["username"], sql, "created"))
+                for grant, privileges in zip(grants, grant_privs):
+                    sql = (
+                        f"GRANT {', '.join(privileges)} ON DATABASE {quote_ident(grant['database'])} "
+                        f"TO {quote_ident(grant['username'])}"
+                    )
+                    name = f"{grant['username']}@{grant['database']}"
+                    results.append(await self._apply_item(conn, "grant", name, sql, "granted"))
+        return results
+
+    async def _apply_item(self, conn, kind, name, sql, status):
+        try:
+            async with conn.transaction():
+                await conn.execute(sql)
+        except SQL_ERRORS as e:
+            return {"kind": kind, "name": name, "status": "failed", "error": str(e)}
+        return {"kind": kind, "name": name, "status": status}
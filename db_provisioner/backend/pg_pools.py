@@ -0,0 +1,307 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+try:
+    import asyncpg
+except ImportError:  # the registry is only used when direct SQL is enabled
+    asyncpg = None
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Connection:
+    def __init__(self, raw, database):
+        self.raw = raw
+        self.database = database
+        self.last_used = time.monotonic()
+
+
+class ClusterPool:
+    def __init__(self, cluster_name, host, port):
+        self.cluster_name = cluster_name
+        self.host = host
+        self.port = port
+        self.idle = {}  # database -> [_Connection], most recently used last
+        self.open = 0  # idle + in use + being opened
+        self.in_use = 0
+        self.invalidated = False
+        self.last_used = time.monotonic()
+        self.created = 0
+        self.closed = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.health_failures = 0
+
+    def idle_count(self):
+        return sum(len(conns) for conns in self.idle.values())
+
+    def take_idle(self, database):
+        conns = self.idle.get(database)
+        if conns:
+            return conns.pop()
+        return None
+
+    def pop_any_idle(self):
+        # Oldest idle connection across all databases
+        oldest_db = None
+        for database, conns in self.idle.items():
+            if conns and (oldest_db is None or conns[0].last_used < self.idle[oldest_db][0].last_used):
+                oldest_db = database
+        if oldest_db is None:
+            return None
+        return self.idle[oldest_db].pop(0)
+
+    def metrics(self):
+        return {
+            "host": self.host,
+            "port": self.port,
+            "open": self.open,
+            "in_use": self.in_use,
+            "idle": self.idle_count(),
+            "created": self.created,
+            "closed": self.closed,
+            "waits": self.waits,
+            "wait_time_total": round(self.wait_time_total, 4),
+            "wait_time_max": round(self.wait_time_max, 4),
+            "wait_time_avg": round(self.wait_time_total / self.waits, 4) if self.waits else 0.0,
+            "health_failures": self.health_failures,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+        }
+
+
+class PoolRegistry:
+    # Connection pools to managed clusters, keyed by cluster name.
+    #
+    # Limits: max_per_cluster open connections per cluster (across its databases),
+    # max_total open connections overall, and max_pools clusters with a pool. When a
+    # limit is hit an idle connection is closed to make room (same cluster first,
+    # then least recently used cluster); if nothing is idle the caller waits up to
+    # acquire_timeout. Connections idle longer than health_check_after are pinged
+    # before reuse; the reaper closes connections idle for idle_timeout and drops
+    # empty pools.
+    def __init__(self, user, password, max_per_cluster=5, max_total=100, max_pools=200,
+                 idle_timeout=300, health_check_after=30, acquire_timeout=10, connect_timeout=5,
+                 reap_interval=30):
+        self.user = user
+        self.password = password
+        self.max_per_cluster = max_per_cluster
+        self.max_total = max_total
+        self.max_pools = max_pools
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self.connect_timeout = connect_timeout
+        self.reap_interval = reap_interval
+        self._pools = OrderedDict()  # least recently used first
+        self._cond = asyncio.Condition()
+        self._total_open = 0
+        self._loop = None
+        self._reaper = None
+
+    @asynccontextmanager
+    async def connection(self, cluster_name, host, port, database="postgres"):
+        pool, conn = await self._acquire(cluster_name, host, port, database)
+        try:
+            yield conn.raw
+        finally:
+            await self._release(pool, conn)
+
+    async def _acquire(self, cluster_name, host, port, database):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            pool, conn = await self._reserve(cluster_name, host, port, database, deadline)
+            if conn is None:
+                try:
+                    raw = await asyncpg.connect(
+                        host=host, port=port, database=database,
+                        user=self.user, password=self.password,
+                        timeout=self.connect_timeout,
+                    )
+                except BaseException:
+                    await self._forget(pool)
+                    raise
+                pool.created += 1
+                return pool, _Connection(raw, database)
+
+            if time.monotonic() - conn.last_used > self.health_check_after:
+                try:
+                    await asyncio.wait_for(conn.raw.fetchval("SELECT 1"), self.connect_timeout)
+                except Exception:
+                    pool.health_failures += 1
+                    conn.raw.terminate()
+                    await self._forget(pool)
+                    continue
+            return pool, conn
+
+    async def _reserve(self, cluster_name, host, port, database, deadline):
+        # Returns (pool, idle connection) or (pool, None) with a slot reserved for a new one
+        async with self._cond:
+            pool = self._pool_for(cluster_name, host, port)
+            waited = None
+            while True:
+                conn = pool.take_idle(database)
+                if conn is not None:
+                    break
+                if pool.open < self.max_per_cluster and self._total_open < self.max_total:
+                    pool.open += 1
+                    self._total_open += 1
+                    break
+                if self._evict_idle(pool):
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"no connection to {cluster_name} available within {self.acquire_timeout}s")
+                if waited is None:
+                    waited = time.monotonic()
+                try:
+                    await asyncio.wait_for(self._cond.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                pool = self._pool_for(cluster_name, host, port)
+
+            if waited is not None:
+                wait = time.monotonic() - waited
+                pool.waits += 1
+                pool.wait_time_total += wait
+                pool.wait_time_max = max(pool.wait_time_max, wait)
+            pool.in_use += 1
+            pool.last_used = time.monotonic()
+            self._pools.move_to_end(cluster_name)
+            return pool, conn
+
+    async def _release(self, pool, conn):
+        async with self._cond:
+            pool.in_use -= 1
+            conn.last_used = pool.last_used = time.monotonic()
+            if pool.invalidated or conn.raw.is_closed():
+                conn.raw.terminate()
+                self._closed(pool)
+            else:
+                pool.idle.setdefault(conn.database, []).append(conn)
+            self._cond.notify_all()
+
+    async def _forget(self, pool):
+        # A reserved slot whose connection never materialised or failed its health check
+        async with self._cond:
+            pool.in_use -= 1
+            self._closed(pool)
+            self._cond.notify_all()
+
+    def _closed(self, pool):
+        pool.open -= 1
+        pool.closed += 1
+        self._total_open -= 1
+
+    def _pool_for(self, cluster_name, host, port):
+        pool = self._pools.get(cluster_name)
+        if pool is not None and (pool.host, pool.port) != (host, port):
+            # The cluster moved (e.g. a new public IP after /start); never reuse old sockets
+            self._invalidate(cluster_name)
+            pool = None
+        if pool is None:
+            self._evict_pools(keep=self.max_pools - 1)
+            pool = ClusterPool(cluster_name, host, port)
+            self._pools[cluster_name] = pool
+        return pool
+
+    def _evict_idle(self, pool):
+        # Close one idle connection to free a slot. If the cluster itself is at its limit
+        # only its own idle connections help; otherwise take from the least recently used.
+        candidates = [pool] if pool.open >= self.max_per_cluster else list(self._pools.values())
+        for pool in candidates:
+            conn = pool.pop_any_idle()
+            if conn is not None:
+                conn.raw.terminate()
+                self._closed(pool)
+                return True
+        return False
+
+    def _evict_pools(self, keep):
+        for cluster_name, pool in list(self._pools.items()):
+            if len(self._pools) <= keep:
+                return
+            if pool.in_use == 0:
+                self._invalidate(cluster_name)
+
+    def _invalidate(self, cluster_name):
+        pool = self._pools.pop(cluster_name, None)
+        if pool is None:
+            return
+        pool.invalidated = True
+        for conns in pool.idle.values():
+            for conn in conns:
+                conn.raw.terminate()
+                self._closed(pool)
+        pool.idle = {}
+        self._cond.notify_all()
+
+    def invalidate(self, cluster_name):
+        # Drop a cluster's pool; in-use connections are closed when released.
+        # Safe to call from worker threads.
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._invalidate_locked(cluster_name)))
+
+    async def _invalidate_locked(self, cluster_name):
+        async with self._cond:
+            self._invalidate(cluster_name)
+
+    async def close_database(self, cluster_name, database):
+        # Close idle connections to one database, e.g. before dropping it
+        async with self._cond:
+            pool = self._pools.get(cluster_name)
+            if pool is None:
+                return
+            for conn in pool.idle.pop(database, []):
+                conn.raw.terminate()
+                self._closed(pool)
+            self._cond.notify_all()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            now = time.monotonic()
+            async with self._cond:
+                for cluster_name, pool in list(self._pools.items()):
+                    for database, conns in list(pool.idle.items()):
+                        keep = [conn for conn in conns if now - conn.last_used < self.idle_timeout]
+                        for conn in conns:
+                            if conn not in keep:
+                                conn.raw.terminate()
+                                self._closed(pool)
+                        pool.idle[database] = keep
+                    if pool.open == 0 and now - pool.last_used > self.idle_timeout:
+                        del self._pools[cluster_name]
+                self._cond.notify_all()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        if self._reaper is None:
+            self._reaper = asyncio.ensure_future(self._reap())
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        async with self._cond:
+            for cluster_name in list(self._pools):
+                self._invalidate(cluster_name)
+
+    def metrics(self):
+        return {
+            "open": self._total_open,
+            "in_use": sum(pool.in_use for pool in self._pools.values()),
+            "idle": sum(pool.idle_count() for pool in self._pools.values()),
+            "pools": len(self._pools),
+            "limits": {
+                "max_per_cluster": self.max_per_cluster,
+                "max_total": self.max_total,
+                "max_pools": self.max_pools,
+            },
+            "clusters": {name: pool.metrics() for name, pool in self._pools.items()},
+        }
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import yaml
+
+# site.yml's roles in play order: role directory, the tag that runs exactly that role
+# and the when: conditions of its play (cluster is the clusters.db row)
+SITE_ROLES = [
+    ("K3s_postgres", "k3s_postgres", lambda c: c["platform"] == "kubernetes" and int(c["pod_count"] or 0) <= 1),
+    ("k8s_postgres_cluster", "k8s_postgres_cluster", lambda c: c["platform"] == "kubernetes" and int(c["pod_count"] or 0) > 1),
+    ("common", "common", lambda c: c["platform"] != "kubernetes"),
+    ("pgbackrest_install", "pgbackrest_install", lambda c: c["platform"] != "kubernetes"),
+    ("postgres", "postgres", lambda c: c["platform"] != "kubernetes"),
+    ("pgbackrest_config", "pgbackrest_config", lambda c: c["platform"] != "kubernetes" and c["instance_count"] > 1),
+    ("etcd", "etcd", lambda c: c["platform"] != "kubernetes" and c["instance_count"] > 1),
+    ("patroni", "patroni", lambda c: c["platform"] != "kubernetes" and c["instance_count"] > 1),
+    ("haproxy", "haproxy", lambda c: c["platform"] != "kubernetes" and c["instance_count"] > 1),
+    ("keepalived", "keepalived", lambda c: c["platform"] != "kubernetes" and c["instance_count"] > 1),
+]
+ROLE_TAGS = {role: tag for role, tag, _ in SITE_ROLES}
+# Variables site.yml's when: conditions read, part of every role's inputs
+PLAY_VARS = ("platform", "instance_count", "pod_count")
+# Host facts the roles branch on; volatile ones (uptime, memory, date) would make
+# every fingerprint change between runs
+FACT_KEYS = (
+    "os_family", "distribution", "distribution_release", "distribution_major_version",
+    "architecture", "machine_id", "default_ipv4",
+)
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# Roles that read other hosts' variables see the whole inventory
+INVENTORY_WIDE = re.compile(r"\b(?:groups|hostvars|play_hosts|ansible_play_hosts)\b")
+
+
+class RoleFingerprints:
+    # A fingerprint per (host, role) of everything a site.yml run of that role on that
+    # host depends on: the role's files, the group_vars values it can reference, the
+    # host's inventory entry (the whole inventory for roles that look at other hosts)
+    # and the host's cached facts. Stored after a successful run, a matching
+    # fingerprint means running the role again would change nothing.
+    #
+    # Role content is read once per roles directory; template store snapshots never
+    # change, and clusters with a full copy of the templates get moved onto a
+    # snapshot when their templates are upgraded.
+    def __init__(self):
+        self._roles = {}  # (roles_dir, role) -> (digest, identifiers, inventory_wide)
+        self._lock = threading.Lock()
+
+    def role(self, roles_dir, role):
+        key = (os.path.realpath(roles_dir), role)
+        with self._lock:
+            cached = self._roles.get(key)
+        if cached:
+            return cached
+
+        digest = hashlib.sha256()
+        names = set()
+        inventory_wide = False
+        role_dir = os.path.join(key[0], role)
+        for root, dirs, files in os.walk(role_dir):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                with open(path, "rb") as f:
+                    content = f.read()
+                digest.update(os.path.relpath(path, role_dir).encode() + b"\0" + content)
+                text = content.decode(errors="replace")
+                names.update(IDENTIFIER.findall(text))
+                inventory_wide = inventory_wide or bool(INVENTORY_WIDE.search(text))
+        info = (digest.hexdigest(), frozenset(names), inventory_wide)
+        with self._lock:
+            self._roles[key] = info
+        return info
+
+    def compute(self, cluster, roles_dir, group_vars_path, inventory_path, fact_dir):
+        # {host: {role: fingerprint}} for the roles site.yml applies to this cluster; a
+        # host without cached facts gets None, which never matches a stored fingerprint
+        with open(group_vars_path) as f:
+            group_vars = yaml.safe_load(f) or {}
+        with open(inventory_path) as f:
+            inventory = f.read().splitlines()
+        hosts = _inventory_hosts(inventory)
+
+        roles = [role for role, _, applies in SITE_ROLES if applies(cluster)]
+        role_vars = {}
+        fingerprints = {}
+        for host in hosts:
+            facts = _cached_facts(fact_dir, host)
+            own_inventory = [line for line in inventory if _line_host(line, hosts) in (None, host)]
+            fingerprints[host] = {}
+            for role in roles:
+                if facts is None:
+                    fingerprints[host][role] = None
+                    continue
+                digest, names, inventory_wide = self.role(roles_dir, role)
+                if role not in role_vars:
+                    role_vars[role] = _referenced_vars(group_vars, names)
+                inputs = {
+                    "role": digest,
+                    "vars": role_vars[role],
+                    "inventory": inventory if inventory_wide else own_inventory,
+                    "facts": facts,
+                }
+                fingerprints[host][role] = hashlib.sha256(
+                    json.dumps(inputs, sort_keys=True, default=str).encode()
+                ).hexdigest()[:32]
+        return fingerprints
+
+
+def plan(current, stored, force=False):
+    # Groups hosts by the roles that need to run on them: [(hosts, roles)] in role
+    # order, one ansible-playbook run each. stored is {(host, role): fingerprint}.
+    pending = {}
+    for host, roles in current.items():
+        changed = tuple(
+            role for role, fingerprint in roles.items()
+            if force or fingerprint is None or stored.get((host, role)) != fingerprint
+        )
+        if changed:
+            pending.setdefault(changed, []).append(host)
+    return [(hosts, list(roles)) for roles, hosts in pending.items()]
+
+
+def _referenced_vars(group_vars, names):
+    # The group_vars a role names, plus the ones their values name in turn
+    # (pgbackrest_stanza: "{{ cluster_name }}" brings in cluster_name), transitively
+    wanted = [key for key in group_vars if key in names or key in PLAY_VARS]
+    seen = set(wanted)
+    while wanted:
+        value = json.dumps(group_vars[wanted.pop()], default=str)
+        for name in IDENTIFIER.findall(value):
+            if name in group_vars and name not in seen:
+                seen.add(name)
+                wanted.append(name)
+    return {key: group_vars[key] for key in seen}
+
+
+def _inventory_hosts(lines):
+    hosts, group = [], None
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith(("#", ";")):
+            continue
+        if line.startswith("["):
+            group = line
+            continue
+        if group is None or ":" not in group:
+            hosts.append(line.split()[0])
+    return list(dict.fromkeys(hosts))
+
+
+def _line_host(line, hosts):
+    words = line.split()
+    return words[0] if words and words[0] in hosts else None
+
+
+def _cached_facts(fact_dir, host):
+    # The jsonfile fact cache keeps one file per inventory hostname
+    try:
+        with open(os.path.join(fact_dir, host)) as f:
+            facts = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {key: facts.get(f"ansible_{key}", facts.get(key)) for key in FACT_KEYS}
@@ -0,0 +1,94 @@
+import glob
+import os
+import re
+import subprocess
+import time
+
+from log_stream import run_async
+
+EXIT_TIMEOUT = 10
+
+
+def inventory_hosts(inventory_file):
+    # ansible_host addresses listed in an inventory.ini
+    try:
+        with open(inventory_file) as f:
+            return list(dict.fromkeys(re.findall(r"ansible_host=(\S+)", f.read())))
+    except FileNotFoundError:
+        return []
+
+
+class SSHMultiplexer:
+    # SSH master connections shared by every ansible run against the same host.
+    #
+    # The first ansible run to reach user@host:port leaves a ControlMaster behind a
+    # socket in control_dir; later runs (status probes, start/stop, user and database
+    # playbooks) reuse it for persist seconds after its last use instead of doing a new
+    # handshake. Pipelining cuts the per-task SSH round trips on top of that. Sockets
+    # are named user@host:port so the ones of a host can be closed when it goes away
+    # or changes address.
+    def __init__(self, control_dir, persist=600, pipelining=True):
+        self.control_dir = control_dir
+        self.persist = persist
+        self.pipelining = pipelining
+
+    def env(self, env=None):
+        env = dict(env if env is not None else os.environ)
+        os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+        # ServerAlive lets a master to a stopped instance notice and exit
+        env["ANSIBLE_SSH_ARGS"] = (
+            f"-C -o ControlMaster=auto -o ControlPersist={self.persist}s"
+            " -o ServerAliveInterval=15 -o ServerAliveCountMax=3"
+        )
+        env["ANSIBLE_SSH_CONTROL_PATH_DIR"] = self.control_dir
+        env["ANSIBLE_SSH_CONTROL_PATH"] = "%(directory)s/%%r@%%h:%%p"
+        if self.pipelining:
+            env["ANSIBLE_PIPELINING"] = "True"
+        return env
+
+    def sockets(self, host=None):
+        pattern = f"*@{glob.escape(host)}:*" if host else "*@*:*"
+        return sorted(glob.glob(os.path.join(self.control_dir, pattern)))
+
+    async def close_host(self, host):
+        # Stops the masters to host and removes their sockets; returns how many
+        closed = 0
+        for socket_path in self.sockets(host):
+            target = os.path.basename(socket_path).rsplit(":", 1)[0]
+            try:
+                await run_async(
+                    ["ssh", "-o", f"ControlPath={socket_path}", "-O", "exit", target],
+                    timeout=EXIT_TIMEOUT, check=False,
+                )
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Could not stop SSH master {socket_path}: {e}")
+            try:
+                os.unlink(socket_path)
+            except FileNotFoundError:
+                pass
+            closed += 1
+        return closed
+
+    async def close_hosts(self, hosts):
+        closed = 0
+        for host in hosts:
+            if host:
+                closed += await self.close_host(host)
+        return closed
+
+    def stats(self):
+        now = time.time()
+        connections = []
+        for socket_path in self.sockets():
+            target, _, port = os.path.basename(socket_path).rpartition(":")
+            try:
+                age = now - os.stat(socket_path).st_mtime
+            except FileNotFoundError:
+                continue
+            connections.append({"target": target, "port": port, "age_seconds": round(age, 1)})
+        return {
+            "control_dir": self.control_dir,
+            "persist": self.persist,
+            "pipelining": self.pipelining,
+            "connections": connections,
+        }
@@ -0,0 +1,289 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+from migrations import apply_migrations
+
+# sqlite3 keeps a per-connection cache of compiled statements keyed by SQL text,
+# so reusing connections and constant query strings gives us prepared statements.
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT_MS = 5000
+
+CLUSTER_SUMMARY_COLUMNS = ("cluster_name", "status", "timestamp", "platform")
+
+
+class StateStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        # One connection per thread: sqlite3 connections must not be shared across
+        # threads, and FastAPI reuses a bounded set of worker threads anyway.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=BUSY_TIMEOUT_MS / 1000,
+                isolation_level=None,
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so a transaction never has to be
+        # retried half-way through; keep the body short.
+        conn = self.connection()
+        with metrics.SQLITE_SECONDS.time("write"):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def fetch_one(self, sql, params=()):
+        with metrics.SQLITE_SECONDS.time("read"):
+            return self.connection().execute(sql, params).fetchone()
+
+    def fetch_all(self, sql, params=()):
+        with metrics.SQLITE_SECONDS.time("read"):
+            return self.connection().execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        with self.transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    #### Clusters ####
+
+    def migrate(self):
+        apply_migrations(self)
+
+    def get_cluster(self, cluster_name, columns, with_primary_ip=False):
+        # columns are always literals from the calling code, never user input.
+        # with_primary_ip adds the first node's public address as public_ip_1.
+        select = ", ".join(f"c.{column}" for column in columns)
+        if with_primary_ip:
+            return self.fetch_one(f"""
+                SELECT {select}, n.public_ip AS public_ip_1
+                FROM clusters c
+                LEFT JOIN cluster_nodes n ON n.cluster_id = c.id AND n.node_index = 1
+                WHERE c.cluster_name=?
+            """, (cluster_name,))
+        return self.fetch_one(f"SELECT {select} FROM clusters c WHERE c.cluster_name=?", (cluster_name,))
+
+    def list_clusters(self, standalone_only=False):
+        sql = f"SELECT {', '.join(CLUSTER_SUMMARY_COLUMNS)} FROM clusters"
+        if standalone_only:
+            sql += " WHERE instance_count = 1"
+        return self.fetch_all(sql)
+
+    def list_clusters_page(self, limit, after_id=None, descending=False, standalone_only=False,
+                           platform=None, status=None, postgresql_version=None, created_after=None):
+        # Keyset page ordered by id; returns up to limit + 1 rows so the caller can
+        # tell whether there is a next page
+        conditions, params = [], []
+        if standalone_only:
+            conditions.append("instance_count = 1")
+        for column, value in (("platform", platform), ("status", status), ("postgresql_version", postgresql_version)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if created_after is not None:
+            conditions.append("timestamp > ?")
+            params.append(created_after)
+        if after_id is not None:
+            conditions.append("id < ?" if descending else "id > ?")
+            params.append(after_id)
+
+        sql = f"SELECT id, {', '.join(CLUSTER_SUMMARY_COLUMNS)} FROM clusters"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY id {'DESC' if descending else 'ASC'} LIMIT ?"
+        return self.fetch_all(sql, (*params, limit + 1))
+
+    def table_version(self, name):
+        row = self.fetch_one("SELECT version FROM table_versions WHERE name=?", (name,))
+        return row[0] if row else 0
+
+    def list_nodes(self, cluster_name):
+        return self.fetch_all("""
+            SELECT n.node_index, n.instance_id, n.public_ip, n.private_ip
+            FROM cluster_nodes n
+            JOIN clusters c ON c.id = n.cluster_id
+            WHERE c.cluster_name=?
+            ORDER BY n.node_index
+        """, (cluster_name,))
+
+    def insert_cluster(self, nodes=(), **fields):
+        # nodes: iterable of dicts with node_index, instance_id, public_ip, private_ip
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        with self.transaction() as conn:
+            cluster_id = conn.execute(
+                f"INSERT INTO clusters ({columns}) VALUES ({placeholders})",
+                tuple(fields.values()),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO cluster_nodes (cluster_id, node_index, instance_id, public_ip, private_ip) VALUES (?, ?, ?, ?, ?)",
+                [(cluster_id, n["node_index"], n.get("instance_id"), n.get("public_ip"), n.get("private_ip")) for n in nodes],
+            )
+            return cluster_id
+
+    def update_cluster(self, cluster_name, **fields):
+        assignments = ", ".join(f"{column}=?" for column in fields)
+        return self.execute(
+            f"UPDATE clusters SET {assignments} WHERE cluster_name=?",
+            (*fields.values(), cluster_name),
+        )
+
+    def update_node(self, cluster_name, node_index, **fields):
+        assignments = ", ".join(f"{column}=?" for column in fields)
+        return self.execute(
+            f"""
+            UPDATE cluster_nodes SET {assignments}
+            WHERE node_index=? AND cluster_id=(SELECT id FROM clusters WHERE cluster_name=?)
+            """,
+            (*fields.values(), node_index, cluster_name),
+        )
+
+    def replace_nodes(self, cluster_name, nodes, **fields):
+        # Swaps in a cluster's full node list (after a scale) together with column updates
+        with self.transaction() as conn:
+            cluster_id = conn.execute("SELECT id FROM clusters WHERE cluster_name=?", (cluster_name,)).fetchone()[0]
+            if fields:
+                assignments = ", ".join(f"{column}=?" for column in fields)
+                conn.execute(f"UPDATE clusters SET {assignments} WHERE id=?", (*fields.values(), cluster_id))
+            conn.execute("DELETE FROM cluster_nodes WHERE cluster_id=?", (cluster_id,))
+            conn.executemany(
+                "INSERT INTO cluster_nodes (cluster_id, node_index, instance_id, public_ip, private_ip) VALUES (?, ?, ?, ?, ?)",
+                [(cluster_id, n["node_index"], n.get("instance_id"), n.get("public_ip"), n.get("private_ip")) for n in nodes],
+            )
+
+    def template_versions(self):
+        return self.fetch_all(
+            "SELECT template_version, COUNT(*) AS clusters FROM clusters GROUP BY template_version"
+        )
+
+    def delete_cluster(self, cluster_name):
+        # cluster_nodes rows go with it through ON DELETE CASCADE
+        return self.execute("DELETE FROM clusters WHERE cluster_name=?", (cluster_name,))
+
+    #### Role fingerprints ####
+
+    def role_fingerprints(self, cluster_name):
+        # {(host, role): fingerprint}
+        rows = self.fetch_all("""
+            SELECT f.host, f.role, f.fingerprint
+            FROM role_fingerprints f
+            JOIN clusters c ON c.id = f.cluster_id
+            WHERE c.cluster_name=?
+        """, (cluster_name,))
+        return {(row["host"], row["role"]): row["fingerprint"] for row in rows}
+
+    def record_role_fingerprints(self, cluster_name, fingerprints, applied_at):
+        # fingerprints: iterable of (host, role, fingerprint)
+        with self.transaction() as conn:
+            cluster_id = conn.execute("SELECT id FROM clusters WHERE cluster_name=?", (cluster_name,)).fetchone()[0]
+            conn.executemany(
+                "INSERT OR REPLACE INTO role_fingerprints (cluster_id, host, role, fingerprint, applied_at) VALUES (?, ?, ?, ?, ?)",
+                [(cluster_id, host, role, fingerprint, applied_at) for host, role, fingerprint in fingerprints],
+            )
+
+    def delete_role_fingerprints(self, cluster_name, hosts):
+        placeholders = ", ".join("?" for _ in hosts)
+        return self.execute(
+            f"""
+            DELETE FROM role_fingerprints
+            WHERE host IN ({placeholders}) AND cluster_id=(SELECT id FROM clusters WHERE cluster_name=?)
+            """,
+            (*hosts, cluster_name),
+        )
+
+    #### Deploy phases ####
+
+    def insert_deploy_phases(self, cluster_name, job_id, spans):
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO deploy_phases (cluster_name, job_id, phase, parent, started_at, duration) VALUES (?, ?, ?, ?, ?, ?)",
+                [(cluster_name, job_id, s["phase"], s["parent"], s["started_at"], s["duration"]) for s in spans],
+            )
+
+    def deploy_timeline(self, cluster_name):
+        # Phases of the cluster's most recent deploy
+        return self.fetch_all("""
+            SELECT job_id, phase, parent, started_at, duration FROM deploy_phases
+            WHERE job_id = (
+                SELECT job_id FROM deploy_phases WHERE cluster_name=? ORDER BY started_at DESC LIMIT 1
+            )
+            ORDER BY started_at
+        """, (cluster_name,))
+
+    def deploy_phase_durations(self, job_status="succeeded"):
+        # Every recorded duration of deploys that ended in job_status (None: all)
+        sql = """
+            SELECT p.phase, p.parent, p.duration, p.job_id
+            FROM deploy_phases p
+            JOIN jobs j ON j.id = p.job_id
+        """
+        if job_status:
+            return self.fetch_all(sql + " WHERE j.status=? ORDER BY p.duration", (job_status,))
+        return self.fetch_all(sql + " ORDER BY p.duration")
+
+    #### Warm pool ####
+
+    def insert_warm_instance(self, **fields):
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        self.execute(f"INSERT INTO warm_pool ({columns}) VALUES ({placeholders})", tuple(fields.values()))
+
+    def update_warm_instance(self, entry_id, **fields):
+        assignments = ", ".join(f"{column}=?" for column in fields)
+        return self.execute(f"UPDATE warm_pool SET {assignments} WHERE id=?", (*fields.values(), entry_id))
+
+    def delete_warm_instance(self, entry_id):
+        return self.execute("DELETE FROM warm_pool WHERE id=?", (entry_id,))
+
+    def get_warm_instance(self, entry_id):
+        return self.fetch_one("SELECT * FROM warm_pool WHERE id=?", (entry_id,))
+
+    def list_warm_instances(self):
+        return self.fetch_all("SELECT * FROM warm_pool ORDER BY pool_key, created_at")
+
+    def warm_pool_counts(self):
+        return self.fetch_all("SELECT pool_key, status, COUNT(*) AS entries FROM warm_pool GROUP BY pool_key, status")
+
+    def claim_warm_instance(self, claimed_by, pool_key=None, entry_id=None, statuses=("ready",), status="claimed"):
+        # Moves the oldest entry of pool_key (or the entry entry_id) in one of statuses
+        # to status (claimed by a cluster, or on its way to being destroyed) and returns
+        # it, or None; one transaction, so two deploys can never take the same instance
+        status_list = ", ".join("?" for _ in statuses)
+        with self.transaction() as conn:
+            if entry_id is not None:
+                row = conn.execute(
+                    f"SELECT * FROM warm_pool WHERE id=? AND status IN ({status_list})", (entry_id, *statuses)
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    f"SELECT * FROM warm_pool WHERE pool_key=? AND status IN ({status_list}) ORDER BY created_at LIMIT 1",
+                    (pool_key, *statuses),
+                ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE warm_pool SET status=?, claimed_by=? WHERE id=?", (status, claimed_by, row["id"]))
+            return row
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import shutil
+import threading
+
+# Entries of the template tree that every cluster keeps its own copy of: group_vars is
+# rendered at deploy time, inventory is written by terraform and patroni_passwords.txt
+# is a mutable file. Everything else is shared.
+PER_CLUSTER_DIRS = ("group_vars", "inventory")
+PER_CLUSTER_FILES = ("patroni_passwords.txt",)
+CONFIG_FILE = "ansible.cfg"
+
+
+class TemplateStore:
+    # Content-addressed snapshots of the Ansible template tree, one directory per
+    # version under store_root/<fingerprint>, built once and never modified.
+    #
+    # A cluster's ansible directory holds its per-cluster files, symlinks to the
+    # snapshot's playbooks and an ansible.cfg whose roles_path points at the
+    # snapshot's roles, so the roles tree exists once no matter how many clusters use
+    # it. Linking a cluster to a newer snapshot is how template changes reach it.
+    def __init__(self, template_dir, store_root):
+        self.template_dir = template_dir
+        self.store_root = store_root
+        self._lock = threading.Lock()
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(self.template_dir):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, self.template_dir).encode() + b"\0")
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+        return digest.hexdigest()[:16]
+
+    def path(self, version):
+        return os.path.join(self.store_root, version)
+
+    def snapshot(self):
+        # Returns the version of the current template tree, storing it first if new
+        with self._lock:
+            version = self.fingerprint()
+            path = self.path(version)
+            if not os.path.isdir(path):
+                staging = path + ".tmp"
+                shutil.rmtree(staging, ignore_errors=True)
+                shutil.copytree(self.template_dir, staging, symlinks=True)
+                os.rename(staging, path)
+            return version
+
+    def versions(self):
+        if not os.path.isdir(self.store_root):
+            return []
+        return sorted(name for name in os.listdir(self.store_root) if not name.endswith(".tmp"))
+
+    def link(self, ansible_dir, version):
+        # Points a cluster's ansible directory at a snapshot. Shared entries already
+        # there (links to an older snapshot, or a full copy from before the store) are
+        # replaced; per-cluster files are left alone.
+        snapshot = self.path(version)
+        os.makedirs(ansible_dir, exist_ok=True)
+        for name in os.listdir(snapshot):
+            dst = os.path.join(ansible_dir, name)
+            if name in PER_CLUSTER_DIRS:
+                os.makedirs(dst, exist_ok=True)
+                continue
+            if name in PER_CLUSTER_FILES:
+                if not os.path.exists(dst):
+                    shutil.copy2(os.path.join(snapshot, name), dst)
+                continue
+
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                shutil.rmtree(dst)
+            elif os.path.lexists(dst):
+                os.remove(dst)
+            # roles are found through roles_path instead
+            if name != "roles":
+                os.symlink(os.path.join(snapshot, name), dst)
+
+        with open(os.path.join(ansible_dir, CONFIG_FILE), "w") as f:
+            f.write(f"[defaults]\nroles_path = {os.path.join(snapshot, 'roles')}\n")
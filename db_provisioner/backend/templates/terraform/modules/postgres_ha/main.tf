@@ -160,14 +160,15 @@ resource "aws_instance" "postgres_nodes" {
 
 
 resource "null_resource" "wait_for_instance" {
-  depends_on = [aws_instance.postgres_nodes]
+  count = var.instance_count
 
   provisioner "local-exec" {
     command = "echo 'Waiting 300 seconds for EC2 init...'; sleep 300"
   }
 
+  # Once per instance: a scale that targets some nodes doesn't wait for the others again
   triggers = {
-    always_run = timestamp()
+    instance_id = aws_instance.postgres_nodes[count.index].id
   }
 }
 
@@ -0,0 +1,23 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    # The app reads its paths at import time; point them all at a scratch directory.
+    # The lifespan (background refreshers) is not run unless a test enters the client.
+    root = tmp_path_factory.mktemp("backend")
+    for name, path in (
+        ("DB_PROVISIONER_DB_PATH", "clusters.db"),
+        ("DB_PROVISIONER_DEPLOYMENTS_DIR", "deployments"),
+        ("DB_PROVISIONER_TEMPLATE_STORE", "template_store"),
+        ("DB_PROVISIONER_TF_CACHE_DIR", "terraform_cache"),
+        ("DB_PROVISIONER_SSH_CONTROL_DIR", "ssh"),
+    ):
+        os.environ[name] = str(root / path)
+    return importlib.import_module("db_provisioner_backend")
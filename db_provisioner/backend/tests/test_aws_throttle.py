@@ -0,0 +1,58 @@
+import subprocess
+
+import pytest
+
+import aws_throttle
+import metrics
+from aws_throttle import call_with_backoff
+
+
+def retries(tool):
+    prefix = f'aws_throttle_retries_total{{tool="{tool}"}} '
+    return int(next(line for line in metrics.render().splitlines() if line.startswith(prefix))[len(prefix):])
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(aws_throttle.time, "sleep", slept.append)
+    return slept
+
+
+def failing(outputs, cmd=("terraform", "apply")):
+    # fn for call_with_backoff: raises with each output in turn, then returns "done"
+    outputs = list(outputs)
+
+    def fn():
+        if outputs:
+            raise subprocess.CalledProcessError(1, list(cmd), output=outputs.pop(0))
+        return "done"
+    return fn
+
+
+def test_throttled_calls_are_retried_and_counted(sleeps, capsys):
+    before = retries("terraform")
+
+    assert call_with_backoff(failing(["Error: RequestLimitExceeded", "Throttling: Rate exceeded"])) == "done"
+
+    assert retries("terraform") == before + 2
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 2 and 0 <= sleeps[1] <= 4
+    assert capsys.readouterr().out == ""
+
+
+def test_other_failures_are_not_retried(sleeps):
+    before = retries("aws")
+
+    with pytest.raises(subprocess.CalledProcessError):
+        call_with_backoff(failing(["AccessDenied"], cmd=("/usr/local/bin/aws", "ec2")))
+
+    assert retries("aws") == before
+    assert sleeps == []
+
+
+def test_gives_up_after_the_last_attempt(sleeps):
+    with pytest.raises(subprocess.CalledProcessError):
+        call_with_backoff(failing(["Throttling"] * 3), attempts=3)
+
+    assert len(sleeps) == 2
@@ -0,0 +1,109 @@
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(backend):
+    backend.store.execute("DELETE FROM clusters")
+    return TestClient(backend.app)
+
+
+def add(backend, name, platform="ec2", status="running", version="16", instance_count=1, timestamp="2024-01-01T00:00:00"):
+    return backend.store.insert_cluster(
+        cluster_name=name, platform=platform, status=status, postgresql_version=version,
+        instance_count=instance_count, timestamp=timestamp,
+    )
+
+
+def names(response):
+    return [cluster["name"] for cluster in response.json()]
+
+
+def test_cursor_walks_every_page(backend, client):
+    for i in range(5):
+        add(backend, f"c{i}")
+
+    seen, params = [], {"limit": 2}
+    while True:
+        response = client.get("/clusters", params=params)
+        assert response.status_code == 200
+        seen += names(response)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            assert "Link" not in response.headers
+            break
+        assert response.headers["Link"].endswith('rel="next"')
+        assert f"cursor={cursor}" in response.headers["Link"]
+        params = {"limit": 2, "cursor": cursor}
+
+    assert seen == ["c0", "c1", "c2", "c3", "c4"]
+
+
+def test_cursor_encodes_the_last_id(backend, client):
+    ids = [add(backend, f"c{i}") for i in range(3)]
+
+    response = client.get("/clusters", params={"limit": 2, "order": "desc"})
+
+    assert names(response) == ["c2", "c1"]
+    cursor = response.headers["X-Next-Cursor"]
+    assert "=" not in cursor
+    assert backend.decode_cursor(cursor) == ids[1]
+    assert names(client.get("/clusters", params={"limit": 2, "order": "desc", "cursor": cursor})) == ["c0"]
+
+
+def test_filters_combine(backend, client):
+    add(backend, "a", platform="ec2", status="running", version="16", timestamp="2024-01-01T00:00:00")
+    add(backend, "b", platform="ec2", status="stopped", version="16", timestamp="2024-02-01T00:00:00")
+    add(backend, "c", platform="kubernetes", status="running", version="16", timestamp="2024-03-01T00:00:00")
+    add(backend, "d", platform="ec2", status="running", version="15", timestamp="2024-04-01T00:00:00")
+    add(backend, "e", platform="ec2", status="running", version="16", instance_count=3, timestamp="2024-05-01T00:00:00")
+
+    assert names(client.get("/clusters", params={"platform": "ec2"})) == ["a", "b", "d", "e"]
+    assert names(client.get("/clusters", params={"platform": "ec2", "status": "running"})) == ["a", "d", "e"]
+    assert names(client.get("/clusters", params={"platform": "ec2", "status": "running", "version": "16"})) == ["a", "e"]
+    assert names(client.get("/clusters", params={"status": "running", "created_after": "2024-02-15T00:00:00+00:00"})) == ["c", "d", "e"]
+    assert names(client.get("/standalone_clusters", params={"platform": "ec2", "version": "16"})) == ["a", "b"]
+    assert names(client.get("/clusters", params={"platform": "gcp"})) == []
+
+
+def test_filters_apply_across_pages(backend, client):
+    for i in range(6):
+        add(backend, f"c{i}", status="running" if i % 2 else "stopped")
+
+    first = client.get("/clusters", params={"status": "running", "limit": 2})
+    second = client.get("/clusters", params={"status": "running", "limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+
+    assert names(first) == ["c1", "c3"]
+    assert names(second) == ["c5"]
+    assert "X-Next-Cursor" not in second.headers
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "eHl6", "aWQ6YWJj"])  # garbage, "xyz", "id:abc"
+def test_invalid_cursor_is_a_400(client, cursor):
+    response = client.get("/clusters", params={"cursor": cursor})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_if_none_match_until_the_table_changes(backend, client):
+    add(backend, "a")
+    first = client.get("/clusters")
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    unchanged = client.get("/clusters", headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.headers["ETag"] == etag
+    assert unchanged.content == b""
+    # Strong form of the same tag and lists of tags match too
+    assert client.get("/clusters", headers={"If-None-Match": etag.removeprefix("W/")}).status_code == 304
+    assert client.get("/clusters", headers={"If-None-Match": f'"other", {etag}'}).status_code == 304
+
+    backend.store.update_cluster("a", status="stopped")
+
+    changed = client.get("/clusters", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()[0]["status"] == "stopped"
+    assert client.get("/clusters", headers={"If-None-Match": changed.headers["ETag"]}).status_code == 304
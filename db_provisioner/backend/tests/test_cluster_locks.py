@@ -0,0 +1,30 @@
+import asyncio
+
+from cluster_locks import ClusterLocks
+
+
+def test_waiter_cancelled_after_handoff_passes_the_lock_on():
+    async def scenario():
+        locks = ClusterLocks(max_wait=5)
+        entered = []
+
+        async def operation(name):
+            async with locks.exclusive("c1", name):
+                entered.append(name)
+                await asyncio.sleep(0)
+
+        await locks._acquire("c1", "first")
+        waiter = asyncio.create_task(operation("second"))
+        await asyncio.sleep(0)  # second is now queued behind first
+        locks._release("c1")  # hands the lock to second...
+        waiter.cancel()  # ...which is cancelled before it gets to run
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+
+        await asyncio.wait_for(operation("third"), 1)
+        assert entered[-1] == "third"
+        assert locks.stats()["clusters"]["c1"]["holder"] is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import Counter, defaultdict
+
+import pytest
+
+from deploy_scheduler import DeployScheduler
+from jobs import JobManager
+from state_store import StateStore
+
+WAIT = 5
+
+
+class Recorder:
+    # Stub run function for the scheduler: records what started and how many ran at
+    # once, then holds each job until the test releases it
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.started = []
+        self.running = Counter()
+        self.peak = Counter()
+        self.gates = defaultdict(threading.Event)
+
+    def run(self, ctx, name, platform):
+        with self.cond:
+            self.started.append(name)
+            self.running[platform] += 1
+            self.running["total"] += 1
+            for key in (platform, "total"):
+                self.peak[key] = max(self.peak[key], self.running[key])
+            self.cond.notify_all()
+        try:
+            assert self.gates[name].wait(WAIT), f"{name} was never released"
+        finally:
+            with self.cond:
+                self.running[platform] -= 1
+                self.running["total"] -= 1
+                self.cond.notify_all()
+
+    def wait_started(self, count):
+        with self.cond:
+            assert self.cond.wait_for(lambda: len(self.started) >= count, WAIT), self.started
+        # Give the scheduler a moment to (wrongly) start anything beyond that
+        time.sleep(0.05)
+        with self.cond:
+            return set(self.started)
+
+    def release(self, *names):
+        for name in names:
+            self.gates[name].set()
+
+    def wait_finished(self, count):
+        with self.cond:
+            assert self.cond.wait_for(lambda: len(self.started) == count and not self.running["total"], WAIT)
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    store = StateStore(str(tmp_path / "clusters.db"))
+    store.migrate()
+    yield JobManager(store, max_workers=1)
+    store.close()
+
+
+def scheduler(jobs, **kwargs):
+    return DeployScheduler(jobs, **kwargs)
+
+
+def items(recorder, platform, *names):
+    return [(name, platform, recorder.run, (name, platform)) for name in names]
+
+
+def test_platform_limits_hold_and_other_platforms_are_not_blocked(jobs):
+    recorder = Recorder()
+    sched = scheduler(jobs, max_concurrent=10, platform_limits={"ec2": 2, "kubernetes": 1})
+    ec2 = [f"e{i}" for i in range(5)]
+
+    sched.submit_batch("deploy", items(recorder, "ec2", *ec2) + items(recorder, "kubernetes", "k0", "k1"))
+
+    # The kubernetes item is passed over to, behind three ec2 items that must wait
+    assert recorder.wait_started(3) == {"e0", "e1", "k0"}
+    assert sched.stats()["running_by_platform"] == {"ec2": 2, "kubernetes": 1}
+    assert sched.stats()["queued"] == 4
+
+    recorder.release("e0")
+    assert recorder.wait_started(4) == {"e0", "e1", "k0", "e2"}
+
+    recorder.release(*ec2, "k0", "k1")
+    recorder.wait_finished(7)
+    sched.executor.shutdown(wait=True)
+    assert sorted(recorder.started) == sorted(ec2 + ["k0", "k1"])
+    assert recorder.peak["ec2"] == 2
+    assert recorder.peak["kubernetes"] == 1
+    assert sched.stats()["running"] == 0
+
+
+def test_global_limit_holds_across_batches_and_platforms(jobs):
+    recorder = Recorder()
+    sched = scheduler(jobs, max_concurrent=3)
+    barrier = threading.Barrier(3, timeout=WAIT)
+
+    def run(ctx, name, platform):
+        # The first three can only get past the barrier if they really run at once
+        if name in ("a0", "b0", "a1"):
+            barrier.wait()
+        recorder.run(ctx, name, platform)
+
+    sched.submit_batch("deploy", [(n, "ec2", run, (n, "ec2")) for n in ("a0", "a1")])
+    sched.submit_batch("deploy", [(n, "kubernetes", run, (n, "kubernetes")) for n in ("b0", "b1", "b2")])
+
+    assert recorder.wait_started(3) == {"a0", "a1", "b0"}
+    assert sched.stats()["running"] == 3
+    assert sched.stats()["queued"] == 2
+
+    recorder.release("a0")
+    assert recorder.wait_started(4) == {"a0", "a1", "b0", "b1"}
+
+    recorder.release("a1", "b0", "b1", "b2")
+    recorder.wait_finished(5)
+    sched.executor.shutdown(wait=True)
+    assert len(recorder.started) == 5
+    assert recorder.peak["total"] == 3
+
+
+def test_batches_take_turns(jobs):
+    recorder = Recorder()
+    sched = scheduler(jobs, max_concurrent=1)
+
+    # Hold the only slot so both batches are queued before anything of theirs starts
+    sched.submit_batch("deploy", items(recorder, "ec2", "blocker"))
+    recorder.wait_started(1)
+    _, a_jobs = sched.submit_batch("deploy", items(recorder, "ec2", "a0", "a1", "a2"))
+    _, b_jobs = sched.submit_batch("deploy", items(recorder, "kubernetes", "b0", "b1"))
+    assert sched.stats()["queued_batches"] == 2
+
+    recorder.release("blocker", "a0", "a1", "a2", "b0", "b1")
+    recorder.wait_finished(6)
+    sched.executor.shutdown(wait=True)
+
+    assert recorder.started == ["blocker", "a0", "b0", "a1", "b1", "a2"]
+    assert recorder.peak["total"] == 1
+    assert {jobs.get(job_id)["status"] for job_id in a_jobs + b_jobs} == {"succeeded"}
@@ -0,0 +1,126 @@
+import asyncio
+
+from health_cache import HealthCache
+
+
+class FakeProbe:
+    # Sees each cluster's current value, then waits for release() after hold()
+    def __init__(self):
+        self.values = {}
+        self.calls = []
+        self.gate = None
+
+    def hold(self):
+        self.gate = asyncio.Event()
+
+    def release(self):
+        self.gate.set()
+
+    async def __call__(self, cluster_name):
+        self.calls.append(cluster_name)
+        value = self.values.get(cluster_name, "running")
+        if self.gate is not None:
+            await self.gate.wait()
+        return value
+
+
+def age(cache, cluster_name, seconds):
+    cache._entries[cluster_name].checked_monotonic -= seconds
+
+
+def test_fresh_entries_are_served_from_cache():
+    async def scenario():
+        probe = FakeProbe()
+        cache = HealthCache(probe, ttl=30, max_stale=300)
+        entry, stale = await cache.get("c1")
+        assert (entry.value, stale) == ("running", False)
+        probe.values["c1"] = "stopped"
+        entry, stale = await cache.get("c1")
+        assert (entry.value, stale) == ("running", False)
+        assert probe.calls == ["c1"]
+
+    asyncio.run(scenario())
+
+
+def test_stale_entries_are_served_while_refreshing():
+    async def scenario():
+        probe = FakeProbe()
+        cache = HealthCache(probe, ttl=30, max_stale=300)
+        await cache.get("c1")
+        probe.values["c1"] = "stopped"
+        age(cache, "c1", 60)
+
+        entry, stale = await cache.get("c1")
+        assert (entry.value, stale) == ("running", True)
+        await asyncio.sleep(0.01)  # let the background refresh run
+        entry, stale = await cache.get("c1")
+        assert (entry.value, stale) == ("stopped", False)
+        assert probe.calls == ["c1", "c1"]
+
+    asyncio.run(scenario())
+
+
+def test_entries_past_max_stale_wait_for_a_probe():
+    async def scenario():
+        probe = FakeProbe()
+        cache = HealthCache(probe, ttl=30, max_stale=300)
+        await cache.get("c1")
+        probe.values["c1"] = "stopped"
+        age(cache, "c1", 600)
+        entry, stale = await cache.get("c1")
+        assert (entry.value, stale) == ("stopped", False)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_reads_share_one_probe():
+    async def scenario():
+        probe = FakeProbe()
+        probe.hold()
+        cache = HealthCache(probe)
+        reads = [asyncio.ensure_future(cache.get("c1")) for _ in range(5)]
+        await asyncio.sleep(0)
+        probe.release()
+        assert {entry.value for entry, _ in await asyncio.gather(*reads)} == {"running"}
+        assert probe.calls == ["c1"]
+
+    asyncio.run(scenario())
+
+
+def test_probe_in_flight_during_invalidate_is_not_cached():
+    async def scenario():
+        probe = FakeProbe()
+        probe.hold()
+        cache = HealthCache(probe)
+        before = asyncio.ensure_future(cache.get("c1"))
+        while not probe.calls:
+            await asyncio.sleep(0)
+
+        # /stop finishes while the probe that saw the cluster running is still out
+        cache.invalidate("c1")
+        probe.values["c1"] = "stopped"
+        after = asyncio.ensure_future(cache.get("c1"))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        probe.release()
+
+        assert (await before)[0].value == "running"
+        assert (await after)[0].value == "stopped"
+        entry, stale = await cache.get("c1")
+        assert (entry.value, stale) == ("stopped", False)
+        assert probe.calls == ["c1", "c1"]
+
+    asyncio.run(scenario())
+
+
+def test_cache_built_outside_a_loop():
+    # As the app builds it at import time, before any event loop exists
+    cache = HealthCache(FakeProbe(), concurrency=2)
+
+    async def scenario():
+        cache.start()
+        entries = await asyncio.gather(*(cache.get(f"c{i}") for i in range(4)))
+        await cache.stop()
+        return [entry.value for entry, _ in entries]
+
+    assert asyncio.run(scenario()) == ["running"] * 4
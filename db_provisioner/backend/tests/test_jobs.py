@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from jobs import JobManager
+from state_store import StateStore
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    store = StateStore(str(tmp_path / "clusters.db"))
+    store.migrate()
+    manager = JobManager(store, max_workers=1)
+    yield manager
+    manager.executor.shutdown(wait=True)
+    store.close()
+
+
+def wait(jobs, job_id):
+    while jobs.get(job_id)["status"] in ("queued", "running"):
+        time.sleep(0.01)
+    return jobs.get(job_id)
+
+
+def test_failed_phase_does_not_count_as_progress(jobs):
+    def deploy(ctx):
+        with ctx.phase("terraform_init"):
+            pass
+        with ctx.phase("terraform_apply"):
+            raise RuntimeError("apply failed")
+
+    job = wait(jobs, jobs.submit("deploy", "c1", deploy, phases=["terraform_init", "terraform_apply", "ansible"]))
+    assert job["status"] == "failed"
+    assert job["progress"] == 0.333
+    assert [p["status"] for p in job["phases"]] == ["ok", "failed"]
+
+
+def test_job_failing_in_first_phase_reports_no_progress(jobs):
+    def deploy(ctx):
+        with ctx.phase("terraform_init"):
+            raise RuntimeError("init failed")
+
+    job = wait(jobs, jobs.submit("deploy", "c1", deploy, phases=["terraform_init", "terraform_apply"]))
+    assert job["progress"] == 0.0
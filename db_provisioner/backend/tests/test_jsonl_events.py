@@ -0,0 +1,81 @@
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from ansible_events import CALLBACK_DIR, PlaybookEvents, callback_env, loop_results
+
+pytest.importorskip("ansible")
+
+spec = importlib.util.spec_from_file_location("jsonl_events", os.path.join(CALLBACK_DIR, "jsonl_events.py"))
+jsonl_events = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(jsonl_events)
+
+PLAYBOOK = """
+- hosts: localhost
+  gather_facts: false
+  tasks:
+    - name: Create users
+      command: echo {{ item.username }} {{ item.password }}
+      loop: "{{ users }}"
+      loop_control:
+        label: "{{ item.username }}"
+      ignore_errors: true
+"""
+
+USERS = '{"users": [{"username": "alice", "password": "s3cret-a"}, {"username": "bob", "password": "s3cret-b"}]}'
+
+
+def run_playbook(tmp_path):
+    playbook = tmp_path / "users.yml"
+    playbook.write_text(PLAYBOOK)
+    ansible_playbook = shutil.which("ansible-playbook") or pytest.skip("ansible-playbook not on PATH")
+    env = callback_env({**os.environ, "ANSIBLE_LOCAL_TEMP": str(tmp_path / "tmp"), "ANSIBLE_PYTHON_INTERPRETER": sys.executable})
+    proc = subprocess.run(
+        [ansible_playbook, "-i", "localhost,", "-c", "local", str(playbook), "-e", USERS],
+        env=env, capture_output=True, text=True, timeout=120,
+    )
+    events = PlaybookEvents()
+    for line in proc.stdout.splitlines():
+        events.feed(line)
+    events.returncode = proc.returncode
+    return proc, events
+
+
+def test_loop_results_reach_playbook_events_without_passwords(tmp_path):
+    proc, events = run_playbook(tmp_path)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+
+    result = events.task("Create users")["localhost"]
+    items = result.result["results"]
+    assert [item["item"] for item in items] == [{"username": "alice"}, {"username": "bob"}]
+    assert all(item["changed"] and not item.get("failed") for item in items)
+    assert items[0]["stdout"] == "alice ********"
+    assert "s3cret" not in proc.stdout
+    assert loop_results(events, "Create users", 2) == [{"status": "created"}, {"status": "created"}]
+
+
+def test_short_password_is_dropped_without_garbling_output():
+    result = jsonl_events.clean_result({
+        "msg": "ok done",
+        "results": [
+            {"item": {"username": "bob", "password": "ok"}, "stdout": "ok", "msg": "ok done", "changed": True},
+        ],
+    })
+    assert result["msg"] == "ok done"
+    item = result["results"][0]
+    assert item["item"] == {"username": "bob"}
+    assert item["msg"] == "ok done"
+    assert item["stdout"] == "********"
+
+
+def test_long_password_is_masked_inside_other_text():
+    result = jsonl_events.clean_result({
+        "item": {"username": "bob", "password": "correct-horse"},
+        "cmd": "psql -c \"CREATE USER bob WITH PASSWORD 'correct-horse'\"",
+    })
+    assert result["item"] == {"username": "bob"}
+    assert result["cmd"] == "psql -c \"CREATE USER bob WITH PASSWORD '********'\""
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import log_stream
+from log_stream import CommandTimeout, follow_log, redact, run_async
+
+needs_proc = pytest.mark.skipif(not os.path.isdir("/proc"), reason="checks processes through /proc")
+
+# The shell starts a background sleep of its own, so the process group has two members
+SCRIPT = 'echo $$ > "$0"; sleep 30 & echo $! >> "$0"; echo started; sleep 30'
+
+
+def alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def group_pids(pid_file):
+    with open(pid_file) as f:
+        return [int(line) for line in f.read().split()]
+
+
+def wait_gone(pids, timeout=5):
+    deadline = time.monotonic() + timeout
+    while any(alive(pid) for pid in pids) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return [pid for pid in pids if alive(pid)]
+
+
+@needs_proc
+def test_timeout_raises_and_kills_the_process_group(tmp_path):
+    pid_file = str(tmp_path / "pids")
+    log_path = str(tmp_path / "logs" / "operations.log")
+
+    with pytest.raises(CommandTimeout) as raised:
+        asyncio.run(run_async(["sh", "-c", SCRIPT, pid_file], log_path, timeout=0.5))
+
+    assert raised.value.timeout == 0.5
+    assert "started" in raised.value.output
+    assert wait_gone(group_pids(pid_file)) == []
+    with open(log_path) as f:
+        assert "# timed out after 0.5s" in f.read()
+
+
+@needs_proc
+def test_cancel_kills_the_process_group(tmp_path):
+    pid_file = str(tmp_path / "pids")
+
+    async def scenario():
+        task = asyncio.ensure_future(run_async(["sh", "-c", SCRIPT, pid_file]))
+        while not os.path.exists(pid_file) or len(group_pids(pid_file)) < 2:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert wait_gone(group_pids(pid_file)) == []
+
+
+def test_redact_masks_extra_vars_values():
+    cmd = [
+        "ansible-playbook", "-i", "inventory", "-e", "postgres_password=hunter2",
+        "--extra-vars", "a=1 b=2 flag", "-e", '{"postgres_password": "hunter2"}',
+        "-e", "@vars.yml", "site.yml",
+    ]
+
+    assert redact(cmd) == (
+        "ansible-playbook -i inventory -e postgres_password=*** --extra-vars a=*** b=*** flag"
+        " -e *** -e @vars.yml site.yml"
+    )
+
+
+def test_long_lines_are_split_and_pending_stays_bounded(monkeypatch):
+    monkeypatch.setattr(log_stream, "MAX_LINE", 4)
+
+    lines, pending = log_stream.split_lines(b"", b"abcdefghij")
+    assert (lines, pending) == ([b"abcd", b"efgh"], b"ij")
+
+    lines, pending = log_stream.split_lines(pending, b"k\nlm")
+    assert (lines, pending) == ([b"ijk\n"], b"lm")
+
+
+def test_run_async_splits_output_without_newlines(monkeypatch):
+    monkeypatch.setattr(log_stream, "MAX_LINE", 1000)
+    seen = []
+
+    asyncio.run(run_async(["sh", "-c", "head -c 2500 /dev/zero | tr '\\0' x"], on_line=seen.append))
+
+    assert [len(line) for line in seen] == [1000, 1000, 500]
+
+
+def test_follow_log_streams_an_overlong_line_in_pieces(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_stream, "MAX_LINE", 1000)
+    log_path = tmp_path / "operations.log"
+    log_path.write_text("first\n" + "x" * 2500 + "\nlast")
+
+    async def collect():
+        return [event async for event in follow_log(str(log_path), lambda: False, skip_lines=1)]
+
+    events = asyncio.run(collect())
+    assert [e.split("\n")[0] for e in events] == ["id: 2", "id: 3", "id: 4", "id: 5", "event: end"]
+    assert events[1] == f"id: 3\ndata: {'x' * 1000}\n\n"
+    assert events[3] == "id: 5\ndata: last\n\n"
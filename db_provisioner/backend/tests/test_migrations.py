@@ -0,0 +1,59 @@
+import logging
+import sqlite3
+
+import pytest
+
+from migrations import MIGRATIONS, _initial
+from state_store import StateStore
+
+LEGACY_ROWS = [
+    # id, cluster_name, status, public_ip_1, private_ip_1, deployment_dir
+    (1, "alpha", "old", "198.51.100.1", "10.0.0.1", "/deployments/alpha-old"),
+    (2, "beta", "running", "198.51.100.2", "10.0.0.2", "/deployments/beta"),
+    (3, None, "orphan", "198.51.100.3", "10.0.0.3", "/deployments/unnamed"),
+    (4, "alpha", "running", "198.51.100.4", "10.0.0.4", "/deployments/alpha"),
+]
+
+
+def legacy_database(path, user_version):
+    # The pre-migration single-table layout, as written by version 0 (no user_version)
+    # or after migration 1
+    conn = sqlite3.connect(path)
+    _initial(conn)
+    conn.executemany(
+        "INSERT INTO clusters (id, cluster_name, status, public_ip_1, private_ip_1, deployment_dir) VALUES (?, ?, ?, ?, ?, ?)",
+        LEGACY_ROWS,
+    )
+    conn.execute(f"PRAGMA user_version = {user_version}")
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("user_version", [0, 1])
+def test_duplicate_and_unnamed_rows_are_kept_aside(tmp_path, caplog, user_version):
+    path = str(tmp_path / "clusters.db")
+    legacy_database(path, user_version)
+    store = StateStore(path)
+    with caplog.at_level(logging.WARNING, logger="migrations"):
+        store.migrate()
+
+    assert store.fetch_one("PRAGMA user_version")[0] == MIGRATIONS[-1][0]
+    clusters = {row["cluster_name"]: row["id"] for row in store.fetch_all("SELECT id, cluster_name FROM clusters")}
+    assert clusters == {"alpha": 4, "beta": 2}
+    assert [tuple(row) for row in store.fetch_all(
+        "SELECT cluster_id, node_index, public_ip FROM cluster_nodes ORDER BY cluster_id"
+    )] == [(2, 1, "198.51.100.2"), (4, 1, "198.51.100.4")]
+
+    moved = store.fetch_all(
+        "SELECT id, cluster_name, status, public_ip_1, private_ip_1, deployment_dir FROM clusters_duplicates ORDER BY id"
+    )
+    assert [tuple(row) for row in moved] == [LEGACY_ROWS[0], LEGACY_ROWS[2]]
+    assert "alpha (id 1)" in caplog.text and "<no name> (id 3)" in caplog.text
+    store.close()
+
+
+def test_clean_database_moves_nothing(tmp_path):
+    store = StateStore(str(tmp_path / "clusters.db"))
+    store.migrate()
+    assert store.fetch_one("SELECT COUNT(*) FROM clusters_duplicates")[0] == 0
+    store.close()
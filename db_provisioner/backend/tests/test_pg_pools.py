@@ -0,0 +1,149 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import pg_pools
+from pg_pools import PoolRegistry
+
+
+class FakeConnection:
+    def __init__(self, host, database):
+        self.host = host
+        self.database = database
+        self.healthy = True
+        self.terminated = False
+        self.pings = 0
+
+    async def fetchval(self, sql):
+        self.pings += 1
+        if not self.healthy:
+            raise ConnectionResetError("server closed the connection")
+        return 1
+
+    def is_closed(self):
+        return self.terminated
+
+    def terminate(self):
+        self.terminated = True
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    # Every connection the registry opened, in order; stands in for asyncpg.connect
+    opened = []
+
+    async def connect(host, port, database, user, password, timeout):
+        conn = FakeConnection(host, database)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(pg_pools, "asyncpg", SimpleNamespace(connect=connect))
+    return opened
+
+
+async def use(registry, cluster_name, database="postgres"):
+    async with registry.connection(cluster_name, f"{cluster_name}.example", 5432, database) as conn:
+        return conn
+
+
+def test_global_cap_evicts_least_recently_used_idle_connection(connections):
+    async def scenario():
+        registry = PoolRegistry("postgres", "secret", max_per_cluster=2, max_total=2)
+        c1 = await use(registry, "c1")
+        c2 = await use(registry, "c2")
+        assert await use(registry, "c1") is c1  # c1 is now the most recently used
+
+        c3 = await use(registry, "c3")
+
+        assert (c1.terminated, c2.terminated, c3.terminated) == (False, True, False)
+        assert registry.metrics()["open"] == 2
+        assert registry.metrics()["clusters"]["c2"]["closed"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_pool_cap_drops_least_recently_used_pool(connections):
+    async def scenario():
+        registry = PoolRegistry("postgres", "secret", max_pools=2)
+        c1 = await use(registry, "c1")
+        c2 = await use(registry, "c2")
+        await use(registry, "c1")
+
+        await use(registry, "c3")
+
+        assert list(registry.metrics()["clusters"]) == ["c1", "c3"]
+        assert c2.terminated and not c1.terminated
+        assert registry.metrics()["open"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_pool_in_use_is_not_dropped_for_the_pool_cap(connections):
+    async def scenario():
+        registry = PoolRegistry("postgres", "secret", max_pools=1)
+        async with registry.connection("c1", "c1.example", 5432) as c1:
+            await use(registry, "c2")
+            assert not c1.terminated
+            assert set(registry.metrics()["clusters"]) == {"c1", "c2"}
+
+    asyncio.run(scenario())
+
+
+def test_idle_connection_is_pinged_before_reuse(connections):
+    async def scenario():
+        registry = PoolRegistry("postgres", "secret", health_check_after=0)
+        first = await use(registry, "c1")
+
+        assert await use(registry, "c1") is first
+        assert first.pings == 1
+
+        first.healthy = False
+        second = await use(registry, "c1")
+
+        assert second is not first
+        assert first.terminated
+        stats = registry.metrics()["clusters"]["c1"]
+        assert (stats["health_failures"], stats["created"], stats["closed"], stats["open"]) == (1, 2, 1, 1)
+
+    asyncio.run(scenario())
+
+
+def test_recently_used_connection_is_not_pinged(connections):
+    async def scenario():
+        registry = PoolRegistry("postgres", "secret", health_check_after=60)
+        first = await use(registry, "c1")
+        assert await use(registry, "c1") is first
+        assert first.pings == 0
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_from_a_worker_thread(connections):
+    async def scenario():
+        registry = PoolRegistry("postgres", "secret", reap_interval=3600)
+        registry.start()
+        idle = await use(registry, "c1", "app")
+        async with registry.connection("c1", "c1.example", 5432) as busy:
+            called_from = []
+
+            def invalidate():
+                called_from.append(threading.current_thread())
+                registry.invalidate("c1")
+
+            await asyncio.to_thread(invalidate)
+            assert called_from[0] is not threading.main_thread()
+            for _ in range(10):
+                await asyncio.sleep(0)
+
+            assert "c1" not in registry.metrics()["clusters"]
+            assert idle.terminated
+            assert not busy.terminated
+        # The connection in use at the time is closed when it comes back
+        assert busy.terminated
+        assert registry.metrics()["open"] == 0
+        assert await use(registry, "c1") not in (idle, busy)
+        await registry.close()
+
+    asyncio.run(scenario())
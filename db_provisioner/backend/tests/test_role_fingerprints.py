@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from role_fingerprints import RoleFingerprints, _inventory_hosts, _referenced_vars, plan
+
+INVENTORY = """\
+# generated by terraform
+bastion ansible_host=203.0.113.9
+
+[postgresql]
+node1 ansible_host=198.51.100.1 ansible_user=rocky private_ip=10.0.0.1
+node2 ansible_host=198.51.100.2 ansible_user=rocky private_ip=10.0.0.2
+
+[etcd]
+node1
+node3 ansible_host=198.51.100.3
+
+[cluster:children]
+postgresql
+etcd
+
+[postgresql:vars]
+server_public_ip=192.0.2.1
+
+[all:vars]
+; interpreter for every host
+ansible_python_interpreter=/usr/bin/python3
+"""
+
+
+def test_inventory_hosts_skips_children_and_vars_sections():
+    assert _inventory_hosts(INVENTORY.splitlines()) == ["bastion", "node1", "node2", "node3"]
+
+
+def test_plan_groups_hosts_that_need_the_same_roles():
+    current = {
+        "node1": {"common": "c1", "postgres": "p1", "haproxy": "h1"},
+        "node2": {"common": "c1", "postgres": "p2", "haproxy": "h1"},
+        "node3": {"common": "c1", "postgres": "p3", "haproxy": "h1"},
+        "node4": {"common": "c1", "postgres": "p4", "haproxy": None},
+    }
+    stored = {
+        ("node1", "common"): "c1", ("node1", "postgres"): "p1", ("node1", "haproxy"): "h1",
+        ("node2", "common"): "c1", ("node2", "postgres"): "old", ("node2", "haproxy"): "h1",
+        ("node3", "common"): "c1", ("node3", "haproxy"): "h1",
+        ("node4", "common"): "c1", ("node4", "postgres"): "p4", ("node4", "haproxy"): None,
+    }
+
+    assert plan(current, stored) == [
+        (["node2", "node3"], ["postgres"]),
+        (["node4"], ["haproxy"]),
+    ]
+
+
+def test_plan_force_runs_every_role_everywhere():
+    current = {"node1": {"common": "c1", "postgres": "p1"}, "node2": {"common": "c1", "postgres": "p1"}}
+    stored = {(host, role): fp for host, roles in current.items() for role, fp in roles.items()}
+
+    assert plan(current, stored) == []
+    assert plan(current, stored, force=True) == [(["node1", "node2"], ["common", "postgres"])]
+
+
+def test_referenced_vars_follow_templated_values():
+    group_vars = {
+        "pgbackrest_stanza": "{{ cluster_name }}",
+        "cluster_name": "{{ prefix }}-db",
+        "prefix": "prod",
+        "allowed_ips": ["{{ allowed_ip_1 }}"],
+        "allowed_ip_1": "203.0.113.1/32",
+        "haproxy_listen_port": 5433,
+        "platform": "ec2",
+    }
+
+    assert _referenced_vars(group_vars, {"pgbackrest_stanza", "allowed_ips", "undefined"}) == {
+        "pgbackrest_stanza": "{{ cluster_name }}",
+        "cluster_name": "{{ prefix }}-db",
+        "prefix": "prod",
+        "allowed_ips": ["{{ allowed_ip_1 }}"],
+        "allowed_ip_1": "203.0.113.1/32",
+        "platform": "ec2",
+    }
+
+
+@pytest.fixture
+def cluster_dir(tmp_path):
+    role = tmp_path / "roles" / "pgbackrest_config" / "tasks"
+    role.mkdir(parents=True)
+    (role / "main.yml").write_text("- name: stanza\n  debug: msg={{ pgbackrest_stanza }}\n")
+    (tmp_path / "inventory.ini").write_text("[postgresql]\nnode1 ansible_host=198.51.100.1\n")
+    facts = tmp_path / "facts"
+    facts.mkdir()
+    (facts / "node1").write_text(json.dumps({"ansible_os_family": "RedHat"}))
+    return tmp_path
+
+
+def fingerprint(cluster_dir, group_vars):
+    (cluster_dir / "all.yml").write_text(group_vars)
+    cluster = {"platform": "ec2", "instance_count": 3, "pod_count": None}
+    return RoleFingerprints().compute(
+        cluster, str(cluster_dir / "roles"), str(cluster_dir / "all.yml"),
+        str(cluster_dir / "inventory.ini"), str(cluster_dir / "facts"),
+    )["node1"]["pgbackrest_config"]
+
+
+def test_fingerprint_changes_with_a_variable_reached_through_another(cluster_dir):
+    before = fingerprint(cluster_dir, 'pgbackrest_stanza: "{{ cluster_name }}"\ncluster_name: a\nunrelated: 1\n')
+
+    assert fingerprint(cluster_dir, 'pgbackrest_stanza: "{{ cluster_name }}"\ncluster_name: a\nunrelated: 2\n') == before
+    assert fingerprint(cluster_dir, 'pgbackrest_stanza: "{{ cluster_name }}"\ncluster_name: b\nunrelated: 1\n') != before
@@ -0,0 +1,120 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+
+
+class FakeJob:
+    job_id = "job-1"
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        self.phases.append(name)
+        yield {}
+
+
+@pytest.fixture
+def scale(backend, monkeypatch, tmp_path):
+    # run_scale with terraform, ansible and EC2 replaced by recorders
+    calls = {"playbooks": [], "terraform": [], "closed": [], "applied": None}
+
+    async def run_playbook(cmd, deployment_dir, **kwargs):
+        calls["playbooks"].append(cmd[3:])
+
+    def run_streaming(cmd, log_path, **kwargs):
+        calls["terraform"].append(cmd)
+
+    async def close_hosts(ips):
+        calls["closed"].extend(ips)
+
+    def record_fingerprints(cluster_name, cluster, deployment_dir, template_version, applied=None):
+        calls["applied"] = applied
+
+    monkeypatch.setattr(backend, "run_playbook", run_playbook)
+    monkeypatch.setattr(backend, "run_streaming", run_streaming)
+    monkeypatch.setattr(backend, "render_cluster_config", lambda *args, **kwargs: None)
+    monkeypatch.setattr(backend, "record_fingerprints", record_fingerprints)
+    monkeypatch.setattr(backend.template_store, "snapshot", lambda: "v2")
+    monkeypatch.setattr(backend.template_store, "link", lambda ansible_dir, version: None)
+    monkeypatch.setattr(backend.ssh_mux, "close_hosts", close_hosts)
+
+    def run(current, target):
+        backend.store.execute("DELETE FROM clusters")
+        backend.store.insert_cluster(
+            cluster_name="pg", platform="ec2", instance_count=current, deployment_dir=str(tmp_path),
+            nodes=[{"node_index": i, "public_ip": f"198.51.100.{i}"} for i in range(1, current + 1)],
+        )
+        monkeypatch.setattr(backend, "terraform_instance_ids", lambda tf_module_dir: [f"i-{i}" for i in range(target)])
+        monkeypatch.setattr(backend, "describe_nodes", lambda ids: [
+            {"node_index": i + 1, "instance_id": instance_id, "public_ip": f"198.51.100.{i + 1}"}
+            for i, instance_id in enumerate(ids)
+        ])
+        job = FakeJob()
+        result = backend.run_scale(job, "pg", target)
+        return result, job, calls
+
+    return run
+
+
+def site(args):
+    return args[0].endswith("site.yml")
+
+
+def test_scale_up_adds_the_new_members(backend, scale):
+    result, job, calls = scale(3, 5)
+
+    assert job.phases == ["render", "terraform_apply", "describe_instances", "configure", "register"]
+    [apply] = calls["terraform"]
+    assert [arg for arg in apply if arg.startswith("-target=")] == [
+        "-target=aws_instance.postgres_nodes[3]", "-target=aws_instance.postgres_nodes[4]",
+        "-target=null_resource.mount_disks[3]", "-target=null_resource.mount_disks[4]",
+        "-target=local_file.ansible_inventory",
+    ]
+
+    members, joining_site, staying_site = calls["playbooks"]
+    assert members[0].endswith("scale_members.yml")
+    assert json.loads(members[2]) == {"etcd_member_host": "pg-node-1", "joining": ["pg-node-4", "pg-node-5"]}
+    assert site(joining_site)
+    assert joining_site[1:] == ["--limit", "pg-node-4,pg-node-5", "-e", "etcd_initial_cluster_state=existing"]
+    assert site(staying_site)
+    assert staying_site[1:] == ["--limit", "pg-node-1,pg-node-2,pg-node-3", "--tags", "haproxy,patroni_config"]
+
+    assert result["instance_count"] == 5
+    assert [n["node_index"] for n in backend.store.list_nodes("pg")] == [1, 2, 3, 4, 5]
+    assert set(calls["applied"]["pg-node-1"]) == {"haproxy"}
+    assert set(calls["applied"]["pg-node-4"]) == set(backend.ROLE_TAGS)
+    assert calls["closed"] == []
+
+
+def test_scale_down_removes_members_before_terraform(backend, scale):
+    result, job, calls = scale(4, 2)
+
+    assert job.phases == ["render", "leave", "terraform_apply", "describe_instances", "configure", "register"]
+    [apply] = calls["terraform"]
+    assert [arg for arg in apply if arg.startswith("-target=")] == [
+        "-target=aws_instance.postgres_nodes[2]", "-target=aws_instance.postgres_nodes[3]",
+        "-target=null_resource.mount_disks[2]", "-target=null_resource.mount_disks[3]",
+        "-target=local_file.ansible_inventory",
+    ]
+
+    leave, staying_site = calls["playbooks"]
+    assert json.loads(leave[2]) == {"etcd_member_host": "pg-node-1", "leaving": ["pg-node-3", "pg-node-4"]}
+    assert staying_site[1:] == ["--limit", "pg-node-1,pg-node-2", "--tags", "haproxy,patroni_config"]
+
+    assert result["instance_count"] == 2
+    assert [n["node_index"] for n in backend.store.list_nodes("pg")] == [1, 2]
+    assert sorted(calls["closed"]) == ["198.51.100.3", "198.51.100.4"]
+
+
+def test_wait_for_instance_is_keyed_on_the_instance(backend):
+    # A targeted scale applies mount_disks, which depends on wait_for_instance; a
+    # trigger that changes on every apply would make each scale sleep again
+    with open(f"{backend.TEMPLATE_DIR}/terraform/modules/postgres_ha/main.tf") as f:
+        main_tf = f.read()
+    block = main_tf.split('resource "null_resource" "wait_for_instance"', 1)[1].split("\nresource ", 1)[0]
+
+    assert "timestamp()" not in block
+    assert "aws_instance.postgres_nodes[count.index].id" in block
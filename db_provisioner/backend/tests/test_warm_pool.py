@@ -0,0 +1,191 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from state_store import StateStore
+from warm_pool import WarmPool, pool_key
+
+SPEC = ("ami-1", "t3.micro", "16", 0)
+KEY = pool_key(*SPEC)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = StateStore(str(tmp_path / "clusters.db"))
+    store.migrate()
+    yield store
+    store.close()
+
+
+class FakeJobs:
+    # build/destroy callbacks that only record what they were asked to do
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.builds = []
+        self.destroys = []
+
+    def build(self, entry_id, spec):
+        with self.lock:
+            self.builds.append((entry_id, spec))
+            return f"build-{entry_id}"
+
+    def destroy(self, entry_id):
+        with self.lock:
+            self.destroys.append(entry_id)
+            return f"destroy-{entry_id}"
+
+
+def make_pool(store, fake, specs=None, **kwargs):
+    return WarmPool(store, {SPEC: 2} if specs is None else specs, fake.build, fake.destroy, **kwargs)
+
+
+def statuses(store):
+    return sorted(row["status"] for row in store.list_warm_instances())
+
+
+def build_all(pool, fake):
+    for entry_id, _ in fake.builds:
+        pool.built(entry_id, instance_id=f"i-{entry_id}")
+
+
+def test_refill_builds_what_is_missing_once(store):
+    fake = FakeJobs()
+    pool = make_pool(store, fake)
+
+    pool.refill()
+    pool.refill()
+
+    assert len(fake.builds) == 2
+    assert statuses(store) == ["building", "building"]
+    assert {row["job_id"] for row in store.list_warm_instances()} == {f"build-{e}" for e, _ in fake.builds}
+
+
+def test_concurrent_refills_do_not_overbuild(store):
+    fake = FakeJobs()
+    pool = make_pool(store, fake, specs={SPEC: 3})
+    barrier = threading.Barrier(8)
+
+    def refill():
+        barrier.wait()
+        pool.refill()
+
+    threads = [threading.Thread(target=refill) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(fake.builds) == 3
+
+
+def test_failed_build_backs_off(store):
+    fake = FakeJobs()
+    pool = make_pool(store, fake, specs={SPEC: 1}, retry_after=600)
+    pool.refill()
+    entry_id, spec = fake.builds[0]
+
+    pool.build_failed(entry_id, spec, "apply failed")
+    pool.refill()
+
+    assert len(fake.builds) == 1
+    assert pool.stats()["specs"][0]["retry_in"] > 0
+    assert pool.stats()["build_failures"] == 1
+
+
+def test_concurrent_claims_never_share_an_instance(store):
+    fake = FakeJobs()
+    pool = make_pool(store, fake, specs={SPEC: 3})
+    pool.refill()
+    build_all(pool, fake)
+    barrier = threading.Barrier(10)
+
+    def claim(i):
+        barrier.wait()
+        return pool.claim(SPEC, f"cluster-{i}")
+
+    with ThreadPoolExecutor(10) as executor:
+        claims = list(executor.map(claim, range(10)))
+
+    won = [row for row in claims if row]
+    assert len(won) == 3
+    assert len({row["id"] for row in won}) == 3
+    assert pool.stats()["claims"] == 3
+    assert pool.stats()["misses"] == 7
+    rows = store.list_warm_instances()
+    assert {row["status"] for row in rows} == {"claimed"}
+    assert {row["claimed_by"] for row in rows} <= {f"cluster-{i}" for i in range(10)}
+
+
+def test_claim_only_takes_ready_entries_of_its_spec(store):
+    fake = FakeJobs()
+    other = ("ami-2", "t3.micro", "16", 0)
+    pool = make_pool(store, fake, specs={SPEC: 1, other: 1})
+    pool.refill()
+
+    assert pool.claim(SPEC, "c1") is None  # still building
+    build_all(pool, fake)
+    claimed = pool.claim(SPEC, "c1")
+    assert claimed["pool_key"] == KEY
+    assert pool.claim(SPEC, "c2") is None
+
+
+def test_refill_after_a_claim_replaces_it(store):
+    fake = FakeJobs()
+    pool = make_pool(store, fake)
+    pool.refill()
+    build_all(pool, fake)
+    pool.claim(SPEC, "c1")
+
+    with ThreadPoolExecutor(1) as executor:
+        pool.refill_soon(executor)
+
+    assert len(fake.builds) == 3
+    assert statuses(store) == ["building", "claimed", "ready"]
+
+
+def test_trim_marks_surplus_as_trimming_and_destroys_it(store):
+    fake = FakeJobs()
+    pool = make_pool(store, fake, specs={SPEC: 3})
+    pool.refill()
+    build_all(pool, fake)
+
+    pool.specs = {SPEC: 1}
+    pool.refill()
+
+    trimmed = [row for row in store.list_warm_instances() if row["status"] == "trimming"]
+    assert len(trimmed) == 2
+    assert all(row["claimed_by"] is None for row in trimmed)
+    assert sorted(fake.destroys) == sorted(row["id"] for row in trimmed)
+    assert all(row["job_id"] == f"destroy-{row['id']}" for row in trimmed)
+    assert pool.stats()["trimmed"] == 2
+    # Trimming entries can't be claimed and aren't trimmed twice
+    assert pool.claim(SPEC, "c1")["status"] == "ready"
+    assert pool.claim(SPEC, "c2") is None
+    pool.refill()
+    assert len(fake.destroys) == 2
+
+
+def test_trim_leaves_entries_being_built(store):
+    fake = FakeJobs()
+    pool = make_pool(store, fake)
+    pool.refill()
+
+    pool.specs = {}
+    pool.refill()
+
+    assert fake.destroys == []
+    assert statuses(store) == ["building", "building"]
+
+
+def test_recover_fails_unfinished_entries(store):
+    fake = FakeJobs()
+    pool = make_pool(store, fake, specs={SPEC: 3})
+    pool.refill()
+    build_all(pool, fake)
+    pool.claim(SPEC, "c1")
+    store.claim_warm_instance(None, pool_key=KEY, status="trimming")
+
+    pool.recover()
+
+    assert statuses(store) == ["failed", "failed", "ready"]
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+
+from log_stream import run_streaming
+
+LOCK_FILE = ".terraform.lock.hcl"
+
+# Created by terraform (or by us) inside a module directory; never part of the template
+GENERATED = {".terraform", LOCK_FILE, "terraform.tfvars", "terraform.tfstate", "terraform.tfstate.backup"}
+
+
+class TerraformWorkspace:
+    # Shared provider plugin cache plus one pre-initialized copy of a module template
+    # per template version, kept under cache_root/modules/<name>-<fingerprint>.
+    #
+    # A cluster's module directory gets symlinks to the immutable module files, a copy
+    # of the dependency lock file and its own terraform.tfvars (written by the caller).
+    # Its terraform init then links providers from the plugin cache instead of
+    # downloading them. Versioned directories are never modified once built, so
+    # existing clusters keep pointing at the files they were deployed with.
+    def __init__(self, template_dir, cache_root):
+        self.template_dir = template_dir
+        self.cache_root = cache_root
+        self.plugin_cache_dir = os.path.join(cache_root, "plugin-cache")
+        self.name = os.path.basename(template_dir)
+        self._lock = threading.Lock()
+
+    def env(self):
+        os.makedirs(self.plugin_cache_dir, exist_ok=True)
+        return {**os.environ, "TF_PLUGIN_CACHE_DIR": self.plugin_cache_dir, "TF_IN_AUTOMATION": "1"}
+
+    def template_files(self):
+        return sorted(
+            name for name in os.listdir(self.template_dir)
+            if name not in GENERATED and os.path.isfile(os.path.join(self.template_dir, name))
+        )
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        for name in self.template_files():
+            digest.update(name.encode() + b"\0")
+            with open(os.path.join(self.template_dir, name), "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()[:16]
+
+    def warm(self):
+        # Returns the pre-initialized module directory for the current template,
+        # building it first if needed. Concurrent callers wait for one build.
+        with self._lock:
+            module_dir = os.path.join(self.cache_root, "modules", f"{self.name}-{self.fingerprint()}")
+            if os.path.exists(os.path.join(module_dir, LOCK_FILE)):
+                return module_dir
+
+            staging = module_dir + ".tmp"
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            for name in self.template_files():
+                shutil.copy2(os.path.join(self.template_dir, name), staging)
+            run_streaming(
+                ["terraform", "init", "-input=false", "-backend=false"],
+                os.path.join(self.cache_root, "warm.log"),
+                cwd=staging, env=self.env(),
+            )
+            shutil.rmtree(module_dir, ignore_errors=True)
+            os.rename(staging, module_dir)
+            return module_dir
+
+    def start(self):
+        # Warm in the background at startup; the first deploy waits on the lock if needed
+        threading.Thread(target=self._warm_quietly, name="terraform-warm", daemon=True).start()
+
+    def _warm_quietly(self):
+        try:
+            self.warm()
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Terraform workspace warm-up failed, deploys will initialize from scratch: {e}")
+
+    def prepare(self, dest):
+        try:
+            module_dir = self.warm()
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Terraform workspace unavailable, copying the module template instead: {e}")
+            module_dir = None
+
+        os.makedirs(dest, exist_ok=True)
+        if module_dir is None:
+            for name in self.template_files():
+                shutil.copy2(os.path.join(self.template_dir, name), dest)
+            return
+
+        for name in self.template_files():
+            _link(os.path.join(module_dir, name), os.path.join(dest, name))
+        # terraform init may update the lock file, so each cluster gets its own copy
+        shutil.copy2(os.path.join(module_dir, LOCK_FILE), dest)
+
+
+def _link(src, dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.symlink(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
@@ -0,0 +1,175 @@
+import asyncio
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Entries still counted towards a spec's size. The others: "claimed" by a deploy,
+# "destroying" (DELETE /warm_pool/{id}) or "trimming" (surplus) on their way out, and
+# "failed".
+LIVE_STATES = ("building", "ready")
+
+
+def parse_specs(value, default_volume_size=0):
+    # "ami:instance_type:postgresql_version[:data_volume_size]=count,..."
+    # -> {(ami, instance_type, postgresql_version, data_volume_size): count}
+    specs = {}
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        spec, _, count = entry.rpartition("=")
+        parts = spec.split(":")
+        if len(parts) not in (3, 4) or not all(parts) or not count.isdigit():
+            raise ValueError(f"Invalid warm pool spec {entry!r}, expected ami:instance_type:version[:volume_size]=count")
+        ami, instance_type, version = parts[:3]
+        size = int(parts[3]) if len(parts) == 4 else default_volume_size
+        specs[(ami, instance_type, version, size)] = int(count)
+    return specs
+
+
+def pool_key(ami, instance_type, postgresql_version, data_volume_size):
+    return f"{ami}:{instance_type}:{postgresql_version}:{data_volume_size}"
+
+
+class WarmPool:
+    # Standalone EC2 instances built ahead of time (terraform apply, disk mount and
+    # site.yml) for each configured spec, left running and idle under a placeholder
+    # name. A /deploy matching a spec claims one instead of provisioning, so it only
+    # renames the instance and applies the cluster-specific settings.
+    #
+    # Entries live in the warm_pool table. build(entry_id, spec) and destroy(entry_id)
+    # submit the jobs that do the work and return their job ids. refill() tops every
+    # spec back up; it runs every interval seconds and, through refill_soon(), after
+    # each claim. A spec whose build failed is not retried for retry_after seconds.
+    def __init__(self, store, specs, build, destroy, interval=60, retry_after=600):
+        self.store = store
+        self.specs = specs
+        self.build = build
+        self.destroy = destroy
+        self.interval = interval
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._backoff = {}  # pool_key -> monotonic time builds may resume
+        self._task = None
+        self._counters = {"claims": 0, "misses": 0, "builds": 0, "build_failures": 0, "trimmed": 0}
+
+    def key_for(self, request):
+        # The spec a deploy request can be served from, or None
+        if request.platform != "ec2" or request.instance_count != 1:
+            return None
+        spec = (request.ami, request.instance_type, request.postgresql_version, request.data_volume_size)
+        return spec if spec in self.specs else None
+
+    def claim(self, spec, cluster_name):
+        # Takes the oldest ready entry for spec; None when there is none
+        row = self.store.claim_warm_instance(cluster_name, pool_key=pool_key(*spec))
+        with self._lock:
+            self._counters["claims" if row else "misses"] += 1
+        return dict(row) if row else None
+
+    def refill(self):
+        with self._lock:
+            counts = {}
+            for row in self.store.warm_pool_counts():
+                counts.setdefault(row["pool_key"], {})[row["status"]] = row["entries"]
+
+            now = time.monotonic()
+            for spec, wanted in self.specs.items():
+                key = pool_key(*spec)
+                have = sum(counts.get(key, {}).get(status, 0) for status in LIVE_STATES)
+                if have >= wanted or self._backoff.get(key, 0) > now:
+                    continue
+                for _ in range(wanted - have):
+                    self._build(key, spec)
+
+            # Ready instances beyond what their spec asks for, e.g. after the pool was shrunk
+            wanted_by_key = {pool_key(*spec): wanted for spec, wanted in self.specs.items()}
+            for key, statuses in counts.items():
+                surplus = statuses.get("ready", 0) - wanted_by_key.get(key, 0)
+                for _ in range(max(0, surplus)):
+                    row = self.store.claim_warm_instance(None, pool_key=key, status="trimming")
+                    if row is None:
+                        break
+                    self.store.update_warm_instance(row["id"], job_id=self.destroy(row["id"]))
+                    self._counters["trimmed"] += 1
+
+    def refill_soon(self, executor):
+        # refill() on executor, so a deploy that claimed an instance doesn't wait for it
+        executor.submit(self._refill_logged)
+
+    def _refill_logged(self):
+        try:
+            self.refill()
+        except Exception as e:
+            print(f"Warm pool refill failed: {e}")
+
+    def _build(self, key, spec):
+        ami, instance_type, version, size = spec
+        entry_id = uuid.uuid4().hex[:12]
+        self.store.insert_warm_instance(
+            id=entry_id, pool_key=key, ami=ami, instance_type=instance_type, postgresql_version=version,
+            data_volume_size=size, status="building", created_at=datetime.utcnow().isoformat(),
+        )
+        self.store.update_warm_instance(entry_id, job_id=self.build(entry_id, spec))
+        self._counters["builds"] += 1
+
+    def built(self, entry_id, **fields):
+        self.store.update_warm_instance(entry_id, status="ready", ready_at=datetime.utcnow().isoformat(), **fields)
+
+    def build_failed(self, entry_id, spec, error):
+        self.store.update_warm_instance(entry_id, status="failed", error=error)
+        with self._lock:
+            self._backoff[pool_key(*spec)] = time.monotonic() + self.retry_after
+            self._counters["build_failures"] += 1
+
+    def release(self, entry_id):
+        # The instance now belongs to a cluster (or is gone)
+        self.store.delete_warm_instance(entry_id)
+
+    def recover(self):
+        # Builds, claims and destroys a previous process was running never finished;
+        # their instances may exist and are left for DELETE /warm_pool/{id} to destroy
+        self.store.execute(
+            "UPDATE warm_pool SET status='failed', error='interrupted' "
+            "WHERE status IN ('building', 'claimed', 'destroying', 'trimming')"
+        )
+
+    async def _refill_loop(self):
+        while True:
+            await asyncio.to_thread(self._refill_logged)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.specs and self._task is None:
+            self._task = asyncio.ensure_future(self._refill_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        counts = {}
+        for row in self.store.warm_pool_counts():
+            counts.setdefault(row["pool_key"], {})[row["status"]] = row["entries"]
+        now = time.monotonic()
+        with self._lock:
+            specs = [
+                {
+                    "pool_key": pool_key(*spec),
+                    "ami": spec[0],
+                    "instance_type": spec[1],
+                    "postgresql_version": spec[2],
+                    "data_volume_size": spec[3],
+                    "size": wanted,
+                    **{status: counts.get(pool_key(*spec), {}).get(status, 0) for status in ("ready", "building", "failed")},
+                    "retry_in": round(max(0.0, self._backoff.get(pool_key(*spec), 0) - now), 1),
+                }
+                for spec, wanted in self.specs.items()
+            ]
+            return {"enabled": bool(self.specs), "specs": specs, **self._counters}